@@ -0,0 +1,63 @@
+import os
+from abc import ABC, abstractmethod
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+# Strategy used by crud when assigning orders, see STRATEGIES
+ASSIGN_STRATEGY = os.getenv("ASSIGN_STRATEGY", "density")
+
+# Weights are arbitrary floats, sums of them may be off by float rounding
+CAPACITY_EPSILON = 1e-6
+
+
+class AssignmentStrategy(ABC):
+    name = None
+
+    @abstractmethod
+    def select(self, orders_id: Sequence[int], weights: Sequence[float], capacity: float) -> List[int]:
+        # Ids of the candidate orders a courier with `capacity` kg left takes
+        pass
+
+
+class TakeAll(AssignmentStrategy):
+    # Every matching order, whatever the courier already carries
+    name = "all"
+
+    def select(self, orders_id: Sequence[int], weights: Sequence[float], capacity: float):
+        return sorted(orders_id)
+
+
+class DensityPacker(AssignmentStrategy):
+    # Greedy knapsack by value per kg. Every order earns the same, so the
+    # densest orders are the lightest ones and taking them first maximises
+    # the number of orders that fit: the packed set is the longest prefix
+    # of the weight-sorted candidates whose running sum fits the capacity.
+    name = "density"
+
+    def select(self, orders_id: Sequence[int], weights: Sequence[float], capacity: float):
+        if not len(orders_id) or capacity <= 0:
+            return []
+        weights = np.asarray(weights, dtype=np.float64)
+        by_density = np.argsort(weights, kind="stable")
+        count = np.searchsorted(np.cumsum(weights[by_density]), capacity + CAPACITY_EPSILON, side="right")
+        return sorted(np.asarray(orders_id, dtype=np.int64)[by_density[:count]].tolist())
+
+
+STRATEGIES: Dict[str, AssignmentStrategy] = {}
+
+
+def register(strategy: AssignmentStrategy):
+    STRATEGIES[strategy.name] = strategy
+    return strategy
+
+
+register(TakeAll())
+register(DensityPacker())
+
+
+def get_strategy(name: str = None):
+    name = name or ASSIGN_STRATEGY
+    if name not in STRATEGIES:
+        raise ValueError("Unknown assignment strategy %s" % name)
+    return STRATEGIES[name]
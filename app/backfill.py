@@ -0,0 +1,26 @@
+from sqlalchemy import func, select
+from sqlalchemy.engine import Connection
+
+from . import models
+
+
+def rebuild_courier_region_stats(connection: Connection):
+    stats = models.CourierRegionStats.__table__
+    completed = models.CompletedCourierOrder.__table__
+    connection.execute(stats.delete())
+    connection.execute(stats.insert().from_select(
+        ["courier_id", "region_id", "lead_time_sum", "completed_count"],
+        select(
+            completed.c.courier_id,
+            completed.c.order_region,
+            func.sum(completed.c.lead_time),
+            func.count()
+        ).group_by(completed.c.courier_id, completed.c.order_region)
+    ))
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    with engine.begin() as conn:
+        rebuild_courier_region_stats(conn)
@@ -0,0 +1,210 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from weakref import WeakKeyDictionary
+
+from sqlalchemy.orm import Session
+
+from . import metrics
+
+COURIER_CACHE_SIZE = int(os.getenv("COURIER_CACHE_SIZE", "10000"))
+# Other workers' writes become visible after at most this many seconds
+COURIER_CACHE_TTL = float(os.getenv("COURIER_CACHE_TTL", "10"))
+
+
+class InvalidationLog:
+    # Numbers invalidations by a shared clock. A reader takes stamp() before
+    # it reads and keeps what it read only while changed_since is False.
+    # Invalidations are forgotten after ttl, a stamp older than a forgotten
+    # one counts as changed. Callers hold their own lock.
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self.clock = 0
+        self.horizon = 0
+        # key -> (clock, monotonic time) of its last invalidation, oldest first
+        self.touched = OrderedDict()
+
+    def stamp(self):
+        return self.clock
+
+    def touch(self, key):
+        self.clock += 1
+        now = time.monotonic()
+        self.touched[key] = (self.clock, now)
+        self.touched.move_to_end(key)
+        while self.touched:
+            clock, touched_at = next(iter(self.touched.values()))
+            if touched_at + self.ttl > now:
+                break
+            self.touched.popitem(last=False)
+            self.horizon = clock
+
+    def changed_since(self, keys, stamp):
+        if stamp < self.horizon:
+            return True
+        for key in keys:
+            touched = self.touched.get(key)
+            if touched is not None and touched[0] > stamp:
+                return True
+        return False
+
+
+class LRUCache:
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+        # Entries live ttl, a read racing an invalidation takes far less
+        self.invalidated = InvalidationLog(ttl)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self.entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def stamp(self, key):
+        # Taken before the value is read: set refuses it once the key was
+        # invalidated in between, so a write racing the read is never lost
+        with self.lock:
+            return self.invalidated.stamp()
+
+    def set(self, key, value, stamp=None):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            if stamp is not None and self.invalidated.changed_since((key,), stamp):
+                return
+            self.entries[key] = (value, time.monotonic() + self.ttl)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self.lock:
+            self.invalidated.touch(key)
+            if self.entries.pop(key, None) is not None:
+                self.invalidations += 1
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def collect(self, name: str):
+        with self.lock:
+            size = len(self.entries)
+            counters = (
+                ("hits", self.hits),
+                ("misses", self.misses),
+                ("evictions", self.evictions),
+                ("expirations", self.expirations),
+                ("invalidations", self.invalidations)
+            )
+        lines = []
+        for counter, value in counters:
+            lines += metrics.metric(
+                "%s_%s_total" % (name, counter), "counter", "%s cache %s" % (name, counter), value
+            )
+        lines += metrics.metric("%s_size" % name, "gauge", "%s cache entries" % name, size)
+        lines += metrics.metric("%s_max_size" % name, "gauge", "%s cache size bound" % name, self.max_size)
+        return lines
+
+
+courier_profiles = LRUCache(COURIER_CACHE_SIZE, COURIER_CACHE_TTL)
+metrics.register(lambda: courier_profiles.collect("courier_cache"))
+
+
+def courier_key(db: Session, courier_id: int):
+    # Sessions bound to different databases must not share entries
+    return db.get_bind(), courier_id
+
+
+ASSIGNMENT_CACHE_SIZE = int(os.getenv("ASSIGNMENT_CACHE_SIZE", "10000"))
+# Orders other workers add reach a courier's snapshot after at most this many
+# seconds plus order_index.ORDER_INDEX_TTL, the age of the index it is matched on
+ASSIGNMENT_CACHE_TTL = float(os.getenv("ASSIGNMENT_CACHE_TTL", "5"))
+
+
+class AssignmentSnapshots:
+    # Last /orders/assign answer per courier. It holds while the courier was
+    # not touched (completion, PATCH, batch assign), no order was added to
+    # its regions and no new matching plan was published. A snapshot records
+    # the stamp taken before the data it was computed from, so a write racing
+    # the computation is never lost.
+    def __init__(self, max_size: int, ttl: float):
+        self.entries = LRUCache(max_size, ttl)
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        # engine -> InvalidationLog of ("courier", id), ("region", id) and "plan"
+        self.logs = WeakKeyDictionary()
+
+    def _log(self, db: Session):
+        bind = db.get_bind()
+        log = self.logs.get(bind)
+        if log is None:
+            log = self.logs[bind] = InvalidationLog(self.ttl)
+        return log
+
+    @staticmethod
+    def _keys(courier_id: int, regions):
+        return ["plan", ("courier", courier_id)] + [("region", region_id) for region_id in regions]
+
+    def stamp(self, db: Session):
+        # Taken before the courier is read
+        with self.lock:
+            return self._log(db).stamp()
+
+    def get(self, db: Session, courier_id: int):
+        entry = self.entries.get(courier_key(db, courier_id))
+        if entry is None:
+            return None
+        regions, stamp, value = entry
+        with self.lock:
+            changed = self._log(db).changed_since(self._keys(courier_id, regions), stamp)
+        if changed:
+            self.entries.invalidate(courier_key(db, courier_id))
+            return None
+        return value
+
+    def set(self, db: Session, courier_id: int, regions, stamp, value):
+        with self.lock:
+            if self._log(db).changed_since(self._keys(courier_id, regions), stamp):
+                return
+        self.entries.set(courier_key(db, courier_id), (tuple(regions), stamp, value))
+
+    def touch_courier(self, db: Session, courier_id: int):
+        with self.lock:
+            self._log(db).touch(("courier", courier_id))
+        self.entries.invalidate(courier_key(db, courier_id))
+
+    def touch_regions(self, db: Session, regions):
+        with self.lock:
+            log = self._log(db)
+            for region_id in set(regions):
+                log.touch(("region", region_id))
+
+    def touch_all(self, db: Session):
+        with self.lock:
+            self._log(db).touch("plan")
+
+
+assignments = AssignmentSnapshots(ASSIGNMENT_CACHE_SIZE, ASSIGNMENT_CACHE_TTL)
+metrics.register(lambda: assignments.entries.collect("assignment_cache"))
@@ -0,0 +1,188 @@
+import bisect
+import heapq
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+# Worker processes matching large batches of couriers, one per core by
+# default; 0 or 1 matches them in the calling process
+MATCH_WORKERS = int(os.getenv("MATCH_WORKERS", str(os.cpu_count() or 1)))
+# Window comparisons (each courier's working intervals times the delivery
+# windows in its regions) from which a batch is matched over OrderWindows,
+# across the MATCH_WORKERS processes, instead of one index lookup per courier
+PARALLEL_MATCH_THRESHOLD = int(os.getenv("PARALLEL_MATCH_THRESHOLD", "1000000"))
+
+# (courier_id, regions, max_weight, working intervals)
+CourierSpec = Tuple[int, Sequence[int], float, Sequence[Tuple[int, int]]]
+
+
+class OrderWindows:
+    # Delivery windows of pending orders as flat arrays, one row per window,
+    # laid out like PendingOrderIndex: grouped by (region, weight bucket) and
+    # sorted by begin within a group, so an overlap is found by bisecting.
+    # Cheap to pickle; a worker process is sent the subset of its regions.
+    def __init__(self, order_id: np.ndarray, begin: np.ndarray, end: np.ndarray,
+                 groups: Dict[int, List[Tuple[int, int, int, int]]], buckets: Sequence[float]):
+        self.order_id = order_id
+        self.begin = begin
+        self.end = end
+        # region_id -> [(bucket, first row, row after the last, longest window)]
+        self.groups = groups
+        self.buckets = tuple(buckets)
+
+    @classmethod
+    def from_orders(cls, orders: Dict[int, Tuple[int, float, List[Tuple[int, int]]]], buckets: Sequence[float]):
+        # orders as kept by PendingOrderIndex: order_id -> (region_id, weight, windows)
+        counts = [len(windows) for _, _, windows in orders.values()]
+        order_id = np.repeat(np.fromiter(orders.keys(), dtype=np.int64, count=len(orders)), counts)
+        region = np.repeat(np.fromiter((entry[0] for entry in orders.values()), dtype=np.int64, count=len(orders)),
+                           counts)
+        weight = np.repeat(np.fromiter((entry[1] for entry in orders.values()), dtype=np.float64, count=len(orders)),
+                           counts)
+        bounds = np.fromiter(
+            (bound for _, _, windows in orders.values() for window in windows for bound in window),
+            dtype=np.int32, count=2 * len(order_id)
+        ).reshape(-1, 2)
+        begin = bounds[:, 0]
+        end = bounds[:, 1]
+        if not len(order_id):
+            return cls(order_id, begin, end, {}, buckets)
+        bucket = np.searchsorted(np.asarray(buckets, dtype=np.float64), weight, side="left")
+
+        rows = np.lexsort((begin, bucket, region))
+        order_id, region, bucket, begin, end = order_id[rows], region[rows], bucket[rows], begin[rows], end[rows]
+        starts = np.flatnonzero(np.append(True, (region[1:] != region[:-1]) | (bucket[1:] != bucket[:-1])))
+        stops = np.append(starts[1:], len(rows))
+        max_lengths = np.maximum.reduceat(end - begin, starts)
+        groups = {}
+        for lo, hi, max_length in zip(starts.tolist(), stops.tolist(), max_lengths.tolist()):
+            groups.setdefault(int(region[lo]), []).append((int(bucket[lo]), lo, hi, max_length))
+        return cls(order_id, begin, end, groups, buckets)
+
+    def subset(self, regions: Sequence[int]):
+        # The rows of some regions only, which are contiguous per region
+        spans = []
+        groups = {}
+        rows = 0
+        for region_id in regions:
+            region_groups = self.groups[region_id]
+            lo, hi = region_groups[0][1], region_groups[-1][2]
+            spans.append((lo, hi))
+            groups[region_id] = [
+                (bucket, group_lo - lo + rows, group_hi - lo + rows, max_length)
+                for bucket, group_lo, group_hi, max_length in region_groups
+            ]
+            rows += hi - lo
+        return OrderWindows(
+            np.concatenate([self.order_id[lo:hi] for lo, hi in spans]),
+            np.concatenate([self.begin[lo:hi] for lo, hi in spans]),
+            np.concatenate([self.end[lo:hi] for lo, hi in spans]),
+            groups, self.buckets
+        )
+
+
+def _match(windows: OrderWindows, couriers: Sequence[CourierSpec]):
+    # courier_id -> sorted array of the ids of the orders it can take: in one
+    # of its regions, within its weight bucket, and with a delivery window
+    # overlapping one of its working intervals. No side effects, and arrays
+    # are what comes back from a worker cheaply.
+    matched = {}
+    for courier_id, regions, max_weight, working_hours in couriers:
+        max_bucket = bisect.bisect_left(windows.buckets, max_weight)
+        found = []
+        for region_id in set(regions):
+            for bucket, lo, hi, max_length in windows.groups.get(region_id, ()):
+                if bucket > max_bucket:
+                    break
+                begin = windows.begin[lo:hi]
+                for w_begin, w_end in working_hours:
+                    first = lo + int(np.searchsorted(begin, w_begin - max_length + 1, side="left"))
+                    last = lo + int(np.searchsorted(begin, w_end, side="left"))
+                    if first < last:
+                        found.append(windows.order_id[first:last][windows.end[first:last] > w_begin])
+        if found:
+            # An order with several matching windows is found once per window
+            order_ids = np.sort(np.concatenate(found))
+            matched[courier_id] = order_ids[np.append(True, order_ids[1:] != order_ids[:-1])]
+        else:
+            matched[courier_id] = np.zeros(0, dtype=np.int64)
+    return matched
+
+
+def match_couriers(windows: OrderWindows, couriers: Sequence[CourierSpec]):
+    # courier_id -> sorted list of the ids of the orders it can take
+    return {courier_id: order_ids.tolist() for courier_id, order_ids in _match(windows, couriers).items()}
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def _pool(workers: int):
+    with _pools_lock:
+        pool = _pools.get(workers)
+        if pool is None:
+            # spawn: forking a process that runs threads (the server's
+            # threadpool, the matching task) may copy a held lock
+            pool = _pools[workers] = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+        return pool
+
+
+def shutdown():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown()
+
+
+def partition_regions(windows: OrderWindows, couriers: Sequence[CourierSpec], parts: int):
+    # The regions that have windows, split into at most parts lists of about
+    # the same work: a window is a row to send and scan, a courier one bisect
+    # per working interval and weight bucket of each of its regions
+    costs = {region_id: groups[-1][2] - groups[0][1] for region_id, groups in windows.groups.items()}
+    for _, regions, _, working_hours in couriers:
+        for region_id in set(regions):
+            if region_id in costs:
+                costs[region_id] += len(working_hours) * len(windows.groups[region_id])
+    loads = [(0, part) for part in range(min(parts, len(costs)))]
+    partition = [[] for _ in loads]
+    for region_id in sorted(costs, key=costs.get, reverse=True):
+        load, part = heapq.heappop(loads)
+        partition[part].append(region_id)
+        heapq.heappush(loads, (load + costs[region_id], part))
+    return partition
+
+
+def match_all(windows: OrderWindows, couriers: Sequence[CourierSpec], workers: int = None):
+    # match_couriers across worker processes. Each is sent the windows of its
+    # share of the regions and the couriers working there, so no row is
+    # pickled twice; a courier's orders are merged from its regions' workers.
+    workers = MATCH_WORKERS if workers is None else workers
+    couriers = list(couriers)
+    if workers <= 1 or len(windows.groups) < 2:
+        return match_couriers(windows, couriers)
+    parts = []
+    specs = []
+    for regions in partition_regions(windows, couriers, workers):
+        in_part = set(regions)
+        parts.append(windows.subset(regions))
+        specs.append([
+            (courier_id, [region_id for region_id in courier_regions if region_id in in_part],
+             max_weight, working_hours)
+            for courier_id, courier_regions, max_weight, working_hours in couriers
+            if not in_part.isdisjoint(courier_regions)
+        ])
+    found = {courier_id: [] for courier_id, _, _, _ in couriers}
+    for part in _pool(workers).map(_match, parts, specs):
+        for courier_id, order_ids in part.items():
+            found[courier_id].append(order_ids)
+    # An order is in one region, so the workers never return it twice
+    return {
+        courier_id: np.sort(np.concatenate(order_ids)).tolist() if order_ids else []
+        for courier_id, order_ids in found.items()
+    }
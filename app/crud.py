@@ -1,13 +1,28 @@
-from sqlalchemy.orm import Session
-from typing import List
+from sqlalchemy import and_, case, exists, func, literal, or_, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session, aliased, selectinload
+from typing import Dict, List, Tuple
 from datetime import datetime
+import time
 import dateutil.parser
 
-from . import models, schemas
+from . import assignment, cache, candidates, matching, models, order_index, schemas
+
+# Bound parameters a statement may carry on SQLite builds older than 3.32
+SQLITE_MAX_VARIABLES = 999
+IN_CHUNK_SIZE = 500
+# claim_orders binds five parameters per order: its id in IN and a WHEN/THEN
+# pair in each of the two CASEs, plus a few for the other columns
+CLAIM_CHUNK_SIZE = (SQLITE_MAX_VARIABLES - 10) // 5
+# Selections re-run when concurrent assigns took some of the chosen orders
+CLAIM_ATTEMPTS = 3
 
 
 def get_courier_by_id(db: Session, courier_id: int):
-    db_courier = db.query(models.Courier).filter(models.Courier.courier_id == courier_id).first()
+    db_courier = db.query(models.Courier) \
+        .options(selectinload(models.Courier.regions), selectinload(models.Courier.working_hours)) \
+        .filter(models.Courier.courier_id == courier_id) \
+        .first()
     if not db_courier:
         return None
     rating = db_courier.rating
@@ -16,14 +31,104 @@ def get_courier_by_id(db: Session, courier_id: int):
         rating = 0
     if earning is None:
         earning = 0
-    courier = schemas.Courier
-    courier.courier_id = db_courier.courier_id
-    courier.courier_type = db_courier.type
-    courier.regions = get_regions_by_courier_id(db, courier_id)
-    courier.working_hours = get_working_hours_by_courier_id(db, courier_id)
-    courier.rating = rating
-    courier.earning = earning
-    return courier
+    return schemas.Courier(
+        courier_id=db_courier.courier_id,
+        courier_type=db_courier.type,
+        regions=[region.region_id for region in db_courier.regions],
+        working_hours=[w_h.courier_working_hours for w_h in db_courier.working_hours],
+        rating=rating,
+        earning=earning
+    )
+
+
+def get_courier_profile(db: Session, courier_id: int):
+    key = cache.courier_key(db, courier_id)
+    profile = cache.courier_profiles.get(key)
+    if profile is not None:
+        return profile
+
+    stamp = cache.courier_profiles.stamp(key)
+    courier = get_courier_by_id(db, courier_id)
+    if courier is None:
+        return None
+    profile = {
+        "courier_id": courier.courier_id,
+        "courier_type": courier.courier_type,
+        "regions": courier.regions,
+        "working_hours": courier.working_hours
+    }
+    has_completed_orders = db.query(
+        exists().where(models.CompletedCourierOrder.courier_id == courier_id)
+    ).scalar()
+    if has_completed_orders:
+        profile["rating"] = courier.rating
+    profile["earning"] = courier.earning
+    cache.courier_profiles.set(key, profile, stamp)
+    return profile
+
+
+def list_couriers(db: Session, after: int, page_size: int, courier_type: str = None, region: int = None):
+    # One keyset page of couriers with id > after
+    query = db.query(models.Courier) \
+        .options(selectinload(models.Courier.regions), selectinload(models.Courier.working_hours)) \
+        .filter(models.Courier.courier_id > after)
+    if courier_type is not None:
+        query = query.filter(models.Courier.type == courier_type)
+    if region is not None:
+        query = query.filter(exists()
+                             .where(models.CourierRegion.courier_id == models.Courier.courier_id)
+                             .where(models.CourierRegion.region_id == region))
+    couriers = []
+    for db_courier in query.order_by(models.Courier.courier_id).limit(page_size):
+        couriers.append(schemas.Courier(
+            courier_id=db_courier.courier_id,
+            courier_type=db_courier.type,
+            regions=[region.region_id for region in db_courier.regions],
+            working_hours=[w_h.courier_working_hours for w_h in db_courier.working_hours],
+            rating=db_courier.rating or 0,
+            earning=db_courier.earning or 0
+        ))
+    return couriers
+
+
+ORDER_STATUSES = ("pending", "assigned", "completed")
+
+
+def list_orders(
+        db: Session, after: int, page_size: int, status: str = None,
+        region: int = None, courier_id: int = None, courier_type: str = None
+):
+    # One keyset page of orders with id > after
+    query = db.query(models.Order, models.CompletedCourierOrder.complete_time) \
+        .outerjoin(models.CompletedCourierOrder, models.CompletedCourierOrder.order_id == models.Order.id) \
+        .options(selectinload(models.Order.delivery_hours)) \
+        .filter(models.Order.id > after)
+    if status is not None:
+        query = query.filter(models.Order.status == status)
+    if region is not None:
+        query = query.filter(models.Order.region_id == region)
+    if courier_id is not None:
+        query = query.filter(models.Order.courier_id == courier_id)
+    if courier_type is not None:
+        # Orders released before check_courier cleared the type still carry it
+        query = query.filter(models.Order.courier_type == courier_type) \
+            .filter(models.Order.status != "pending")
+
+    orders = []
+    for db_order, complete_time in query.order_by(models.Order.id).limit(page_size):
+        pending = db_order.status == "pending"
+        orders.append(schemas.OrderRecord(
+            order_id=db_order.id,
+            weight=db_order.weight,
+            region=db_order.region_id,
+            delivery_hours=[d_h.delivery_hours for d_h in db_order.delivery_hours],
+            status=db_order.status,
+            courier_id=None if pending else db_order.courier_id,
+            courier_type=None if pending else db_order.courier_type,
+            assign_time=None if pending else db_order.assign_time,
+            complete_time=complete_time
+        ))
+    return orders
 
 
 def get_order_by_id(db: Session, order_id: int):
@@ -31,7 +136,10 @@ def get_order_by_id(db: Session, order_id: int):
 
 
 def get_regions_by_courier_id(db: Session, courier_id: int):
-    db_regions = db.query(models.CourierRegion).filter(models.CourierRegion.courier_id == courier_id).all()
+    db_regions = db.query(models.CourierRegion) \
+        .filter(models.CourierRegion.courier_id == courier_id) \
+        .order_by(models.CourierRegion.id) \
+        .all()
     regions = []
     for region in db_regions:
         regions.append(region.region_id)
@@ -39,269 +147,623 @@ def get_regions_by_courier_id(db: Session, courier_id: int):
 
 
 def get_working_hours_by_courier_id(db: Session, courier_id: int):
-    db_w_h = db.query(models.CourierWorkingHours).filter(models.CourierWorkingHours.courier_id == courier_id).all()
+    db_w_h = db.query(models.CourierWorkingHours) \
+        .filter(models.CourierWorkingHours.courier_id == courier_id) \
+        .order_by(models.CourierWorkingHours.id) \
+        .all()
     working_hours = []
     for w_h in db_w_h:
         working_hours.append(w_h.courier_working_hours)
     return working_hours
 
 
-def get_orders_by_working_hours(db: Session, working_hours: List[str], orders_id: List[int]):
-    orders_list = []
-    suited = False
-    for order_n in orders_id:
-        order = db.query(models.Order) \
-            .filter(models.Order.courier_id == -1) \
-            .filter(models.Order.id == order_n) \
-            .first()
-        if order is None:
-            return orders_list
-        for d_h_class in order.delivery_hours:
-            d_h = d_h_class.delivery_hours
-            for w_h in working_hours:
-                if checking_the_time(w_h, d_h):
-                    orders_list.append(order)
-                    suited = True
-                    break
-            if suited:
-                break
-
-    return orders_list
-
-
-def get_orders_by_regions(db: Session, regions_id: List[int]):
-    regions_list = []
-    for region_id in regions_id:
-        order = db.query(models.Order) \
-            .filter(models.Order.courier_id == -1) \
-            .filter(models.Order.region_id == region_id) \
-            .first()
-        if order is not None:
-            regions_list.append(order)
-    return regions_list
+def get_working_intervals_by_courier_id(db: Session, courier_id: int):
+    return db.query(models.CourierWorkingHours.begin, models.CourierWorkingHours.end) \
+        .filter(models.CourierWorkingHours.courier_id == courier_id) \
+        .all()
 
 
-def get_orders_weighing_less_than(db: Session, weight: float):
+def get_pending_orders_by_ids(db: Session, orders_id: List[int]):
+    orders = []
+    for i in range(0, len(orders_id), IN_CHUNK_SIZE):
+        orders += db.query(models.Order) \
+            .filter(models.Order.id.in_(orders_id[i:i + IN_CHUNK_SIZE])) \
+            .filter(models.Order.courier_id == -1) \
+            .all()
+    return orders
+
+
+def get_max_weight(courier_type: str):
+    if courier_type == "foot":
+        return 10.0
+    elif courier_type == "bike":
+        return 15.0
+    return 50.0
+
+
+def get_suitable_orders(db: Session, courier_id: int, max_weight: float):
+    d_h = models.OrderDeliveryHours
+    w_h = models.CourierWorkingHours
+    courier_regions = db.query(models.CourierRegion.region_id) \
+        .filter(models.CourierRegion.courier_id == courier_id)
+    hours_overlap = exists() \
+        .where(d_h.order_id == models.Order.id) \
+        .where(w_h.courier_id == courier_id) \
+        .where(d_h.begin < w_h.end) \
+        .where(w_h.begin < d_h.end)
+    pending = models.Order.courier_id == -1
+    if db.get_bind().dialect.name == "sqlite":
+        # Without table statistics SQLite takes any equality on
+        # order_courier_id to be selective and walks every pending order
+        # through ix_order_courier_status. Marked likely, the condition leaves
+        # the region and weight lookup of ix_order_pending as the cheaper plan.
+        pending = func.likely(pending)
     return db.query(models.Order) \
-        .filter(models.Order.courier_id == -1) \
-        .filter(models.Order.weight <= weight) \
+        .filter(pending) \
+        .filter(models.Order.weight <= max_weight) \
+        .filter(models.Order.region_id.in_(courier_regions)) \
+        .filter(hours_overlap) \
         .all()
 
 
-def create_courier(db: Session, courier: schemas.CourierDto):
-    db_courier = models.Courier(
-        type=courier.courier_type,
-        rating=None,
-        earning=None
-    )
-    for region in courier.regions:
-        db_courier_regions = models.CourierRegion(
-            courier_id=courier.courier_id,
-            region_id=region
-        )
-        db.add(db_courier_regions)
-    for w_hours in courier.working_hours:
-        db_courier_working_hours = models.CourierWorkingHours(
-            courier_id=courier.courier_id,
-            courier_working_hours=w_hours
-        )
-        db.add(db_courier_working_hours)
-    db.add(db_courier)
-    db.commit()
-    db.refresh(db_courier)
-    return db_courier
-
-
-def create_order(db: Session, order: schemas.OrderDto):
-    db_order = models.Order(
-        weight=order.weight,
-        region_id=order.region,
-    )
-    for d_hours in order.delivery_hours:
-        db_order_delivery_hours = models.OrderDeliveryHours(
-            order_id=order.order_id,
-            delivery_hours=d_hours
-        )
-        db.add(db_order_delivery_hours)
-    db.add(db_order)
-    db.commit()
-    db.refresh(db_order)
-    return db_order
+def create_couriers(db: Session, couriers: List[schemas.CourierDto]):
+    db_couriers = []
+    db_regions = []
+    db_working_hours = []
+    for courier in couriers:
+        db_couriers.append({
+            "courier_id": courier.courier_id,
+            "type": courier.courier_type
+        })
+        for region in courier.regions:
+            db_regions.append({
+                "courier_id": courier.courier_id,
+                "region_id": region
+            })
+        for w_hours in courier.working_hours:
+            begin, end = convert_to_minute(w_hours)
+            db_working_hours.append({
+                "courier_id": courier.courier_id,
+                "courier_working_hours": w_hours,
+                "begin": begin,
+                "end": end
+            })
+    try:
+        db.bulk_insert_mappings(models.Courier, db_couriers)
+        db.bulk_insert_mappings(models.CourierRegion, db_regions)
+        db.bulk_insert_mappings(models.CourierWorkingHours, db_working_hours)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    return len(db_couriers) + len(db_regions) + len(db_working_hours)
+
+
+def create_orders(db: Session, orders: List[schemas.OrderDto]):
+    db_orders = []
+    db_delivery_hours = []
+    for order in orders:
+        db_orders.append({
+            "id": order.order_id,
+            "weight": order.weight,
+            "region_id": order.region
+        })
+        for d_hours in order.delivery_hours:
+            begin, end = convert_to_minute(d_hours)
+            db_delivery_hours.append({
+                "order_id": order.order_id,
+                "delivery_hours": d_hours,
+                "begin": begin,
+                "end": end
+            })
+    try:
+        db.bulk_insert_mappings(models.Order, db_orders)
+        db.bulk_insert_mappings(models.OrderDeliveryHours, db_delivery_hours)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    cache.assignments.touch_regions(db, [order["region_id"] for order in db_orders])
+    index = order_index.peek_index(db)
+    if index is not None:
+        windows = {}
+        for d_hours in db_delivery_hours:
+            windows.setdefault(d_hours["order_id"], []).append((d_hours["begin"], d_hours["end"]))
+        for order in db_orders:
+            index.add(order["id"], order["region_id"], order["weight"], windows.get(order["id"], []))
+    return len(db_orders) + len(db_delivery_hours)
+
+
+def get_taken_ids(db: Session, key, ids: List[int]):
+    # The ids among `ids` that already have a row, key being the id column
+    taken = set()
+    for i in range(0, len(ids), IN_CHUNK_SIZE):
+        taken.update(row_id for row_id, in db.query(key).filter(key.in_(ids[i:i + IN_CHUNK_SIZE])))
+    return taken
+
+
+def import_orders(db: Session, orders: List[schemas.OrderDto]):
+    # Writes the orders whose id is not taken yet, returns the positions of the skipped ones
+    existing = get_taken_ids(db, models.Order.id, [order.order_id for order in orders])
+    fresh = []
+    skipped = []
+    for position, order in enumerate(orders):
+        if order.order_id in existing:
+            skipped.append(position)
+        else:
+            existing.add(order.order_id)
+            fresh.append(order)
+    if fresh:
+        create_orders(db, fresh)
+    return skipped
+
+
+def get_assignment(db: Session, courier_id: int):
+    # assign_order behind the courier's snapshot, None for an unknown courier
+    snapshot = cache.assignments.get(db, courier_id)
+    if snapshot is not None:
+        return snapshot
+    stamp = cache.assignments.stamp(db)
+    courier = get_courier_by_id(db, courier_id)
+    if courier is None:
+        return None
+    orders_id, assign_time = assign_order(db, courier)
+    cache.assignments.set(db, courier_id, courier.regions, stamp, (orders_id, assign_time))
+    return orders_id, assign_time
 
 
 def assign_order(db: Session, courier: schemas.Courier):
-    if courier.courier_type == "foot":
-        weight = 10.0
-    elif courier.courier_type == "bike":
-        weight = 15.0
-    else:
-        weight = 50.0
-
-    suitable_orders = []
-
-    assigned_orders = db.query(models.Order).filter(models.Order.courier_id == courier.courier_id).all()
-    completed_orders = db.query(models.CompletedCourierOrder) \
-        .filter(models.CompletedCourierOrder.courier_id == courier.courier_id) \
+    # Returns the ids of the courier's outstanding orders and their assign time
+    active_orders = db.query(models.Order.id, models.Order.weight, models.Order.assign_time) \
+        .filter(models.Order.courier_id == courier.courier_id) \
+        .filter(models.Order.status == "assigned") \
         .all()
 
-    assigned_orders_id = []
-    completed_orders_id = []
-    for order in assigned_orders:
-        assigned_orders_id.append(order.id)
-    for order in completed_orders:
-        completed_orders_id.append(order.order_id)
-
-    list_by_weight = get_orders_weighing_less_than(db, weight)
-    if list_by_weight:
-        orders_id_by_weight = []
-        for order in list_by_weight:
-            orders_id_by_weight.append(order.id)
-
-        list_by_region = get_orders_by_regions(db, courier.regions)
-        if list_by_region:
-            orders_id_by_region = []
-            for order in list_by_region:
-                orders_id_by_region.append(order.id)
-
-            orders_id = list(set(orders_id_by_weight) & set(orders_id_by_region))
-            if orders_id:
-                suitable_orders = get_orders_by_working_hours(db, courier.working_hours, orders_id)
+    max_weight = get_max_weight(courier.courier_type)
+    index = order_index.get_index(db)
+    if index is None:
+        suitable_orders = get_suitable_orders(db, courier.courier_id, max_weight)
+    else:
+        working_hours = get_working_intervals_by_courier_id(db, courier.courier_id)
+        orders_id = sorted(index.match(courier.regions, max_weight, working_hours))
+        suitable_orders = get_pending_orders_by_ids(db, orders_id)
+    plan = matching.get_plan(db)
+    if plan is not None:
+        planned_orders_id = plan.orders_for(courier.courier_id)
+        if planned_orders_id is None:
+            available = set(plan.available_to(courier.courier_id, [order.id for order in suitable_orders]))
+        else:
+            # The plan may have been solved before the courier's last PATCH:
+            # planned orders it no longer fits are not handed out
+            available = set(planned_orders_id)
+        suitable_orders = [order for order in suitable_orders if order.id in available]
+
+    carried = sum(float(order.weight) for order in active_orders)
+    # Plain values: every commit below expires the loaded orders
+    candidates = {order.id: float(order.weight) for order in suitable_orders}
+    capacity = max_weight - carried
+    strategy = assignment.get_strategy()
 
     now = datetime.now()
     assign_time = now.isoformat()
-    change_assign_time = True
-    for order in suitable_orders:
-        db_order = db.query(models.Order).get(order.id)
-        db_order.courier_id = courier.courier_id
-        db_order.courier_type = courier.courier_type
-        db_order.assign_time = now
-        db.commit()
-        change_assign_time = False
-
-    if change_assign_time:
-        if assigned_orders:
-            max_time = assigned_orders[0].assign_time
-            for order in assigned_orders:
-                if order.assign_time > max_time:
-                    max_time = order.assign_time
-            assign_time = max_time
-
-    orders_id = list(set(assigned_orders_id) ^ set(completed_orders_id))
-    for order_id in orders_id:
-        db_order = db.query(models.Order).get(order_id)
-        suitable_orders.append(db_order)
-
-    suitable_orders = list(set(suitable_orders))
-
-    return suitable_orders, assign_time
-
-
-def update_courier(db: Session, changes: dict, courier_id: int):
-    fields = [
-        "courier_id",
-        "courier_type",
-        "regions",
-        "working_hours"
+    claimed = []
+    for _ in range(CLAIM_ATTEMPTS):
+        selected = strategy.select(list(candidates), list(candidates.values()), capacity)
+        if not selected:
+            break
+        try:
+            owners = {order_id: (courier.courier_id, courier.courier_type) for order_id in selected}
+            won = claim_orders(db, owners, now)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        # Orders another request claimed first are not pending anymore either
+        if index is not None:
+            index.remove(selected)
+        claimed += won
+        if len(won) == len(selected):
+            break
+        # Lost some to a concurrent claim: refill from what is left
+        capacity -= sum(candidates[order_id] for order_id in won)
+        for order_id in selected:
+            del candidates[order_id]
+
+    if claimed:
+        cache.courier_profiles.invalidate(cache.courier_key(db, courier.courier_id))
+    elif active_orders:
+        assign_time = max(order.assign_time for order in active_orders)
+
+    orders_id = set(claimed)
+    orders_id.update(order.id for order in active_orders)
+    return sorted(orders_id), assign_time
+
+
+def claim_orders(db: Session, owners: Dict[int, Tuple[int, str]], assign_time: datetime):
+    # Assigns every order still pending to its courier in owners, given as
+    # order_id -> (courier_id, courier_type), and returns the ids claimed,
+    # without committing. An order claimed by a concurrent transaction is
+    # skipped, so no order is ever handed to two couriers.
+    postgres = db.get_bind().dialect.name == "postgresql"
+    orders_id = list(owners)
+    claimed = []
+    for i in range(0, len(orders_id), CLAIM_CHUNK_SIZE):
+        chunk = orders_id[i:i + CLAIM_CHUNK_SIZE]
+        if postgres:
+            # Rows locked by another assign are skipped instead of waited for
+            chunk = [order_id for order_id, in db.query(models.Order.id)
+                     .filter(models.Order.id.in_(chunk))
+                     .filter(models.Order.courier_id == -1)
+                     .with_for_update(skip_locked=True)]
+            if not chunk:
+                continue
+        db.query(models.Order) \
+            .filter(models.Order.id.in_(chunk)) \
+            .filter(models.Order.courier_id == -1) \
+            .update({
+                models.Order.courier_id: case(
+                    {order_id: owners[order_id][0] for order_id in chunk}, value=models.Order.id
+                ),
+                models.Order.courier_type: case(
+                    {order_id: owners[order_id][1] for order_id in chunk}, value=models.Order.id
+                ),
+                models.Order.assign_time: assign_time,
+                models.Order.status: "assigned"
+            }, synchronize_session=False)
+        if postgres:
+            claimed += chunk
+        else:
+            # Rows this transaction updated stay locked until it commits
+            claimed += [order_id for order_id, courier_id in db.query(models.Order.id, models.Order.courier_id)
+                        .filter(models.Order.id.in_(chunk))
+                        if courier_id == owners[order_id][0]]
+    return claimed
+
+
+def get_idle_courier_ids(db: Session):
+    busy = exists() \
+        .where(models.Order.courier_id == models.Courier.courier_id) \
+        .where(models.Order.status == "assigned")
+    rows = db.query(models.Courier.courier_id).filter(~busy).order_by(models.Courier.courier_id)
+    return [courier_id for courier_id, in rows]
+
+
+def get_courier_constraints(db: Session, courier_ids: List[int]):
+    # courier_id -> (courier_type, regions, working intervals), three queries per chunk
+    couriers = {}
+    for i in range(0, len(courier_ids), IN_CHUNK_SIZE):
+        chunk = courier_ids[i:i + IN_CHUNK_SIZE]
+        for courier_id, courier_type in db.query(models.Courier.courier_id, models.Courier.type) \
+                .filter(models.Courier.courier_id.in_(chunk)):
+            couriers[courier_id] = (courier_type, [], [])
+        for courier_id, region_id in db.query(models.CourierRegion.courier_id, models.CourierRegion.region_id) \
+                .filter(models.CourierRegion.courier_id.in_(chunk)) \
+                .order_by(models.CourierRegion.id):
+            couriers[courier_id][1].append(region_id)
+        for courier_id, begin, end in db.query(
+                models.CourierWorkingHours.courier_id,
+                models.CourierWorkingHours.begin,
+                models.CourierWorkingHours.end
+        ) \
+                .filter(models.CourierWorkingHours.courier_id.in_(chunk)) \
+                .order_by(models.CourierWorkingHours.id):
+            couriers[courier_id][2].append((begin, end))
+    return couriers
+
+
+def get_active_orders(db: Session, courier_ids: List[int]):
+    # courier_id -> [(order_id, weight, assign_time)] of assigned, not yet completed orders
+    active_orders = {}
+    for i in range(0, len(courier_ids), IN_CHUNK_SIZE):
+        rows = db.query(models.Order.courier_id, models.Order.id, models.Order.weight, models.Order.assign_time) \
+            .filter(models.Order.courier_id.in_(courier_ids[i:i + IN_CHUNK_SIZE])) \
+            .filter(models.Order.status == "assigned") \
+            .order_by(models.Order.id)
+        for courier_id, order_id, weight, assign_time in rows:
+            active_orders.setdefault(courier_id, []).append((order_id, float(weight), assign_time))
+    return active_orders
+
+
+def match_couriers(index: order_index.PendingOrderIndex, couriers: dict):
+    # courier_id -> ids of the pending orders each courier of
+    # get_courier_constraints fits. A large batch is matched over a snapshot
+    # of the index, across candidates.MATCH_WORKERS processes.
+    specs = [
+        (courier_id, regions, get_max_weight(courier_type), working_hours)
+        for courier_id, (courier_type, regions, working_hours) in couriers.items()
     ]
-    db_courier = db.query(models.Courier).get(courier_id)
-    for field in fields:
-        change = changes.get(field)
-        if change is not None:
-            if field == "regions":
-                db_regions = db.query(models.CourierRegion) \
-                    .filter(models.CourierRegion.courier_id == courier_id) \
-                    .all()
-                for region in db_regions:
-                    db.delete(region)
-
-                for region in change:
-                    db_region = models.CourierRegion(
-                        courier_id=courier_id,
-                        region_id=region
-                    )
-                    db.add(db_region)
-                    db.commit()
-            elif field == "working_hours":
-                db_working_hours = db.query(models.CourierWorkingHours) \
-                    .filter(models.CourierWorkingHours.courier_id == courier_id) \
-                    .all()
-                for w_h in db_working_hours:
-                    db.delete(w_h)
-
-                for w_h in change:
-                    db_w_h = models.CourierWorkingHours(
-                        courier_id=courier_id,
-                        courier_working_hours=w_h
-                    )
-                    db.add(db_w_h)
-                    db.commit()
-            elif field == "courier_id":
-                db_courier.courier_id = change
-            else:
-                db_courier.type = change
+    if index.comparisons(specs) < candidates.PARALLEL_MATCH_THRESHOLD:
+        return {
+            courier_id: sorted(index.match(regions, max_weight, working_hours))
+            for courier_id, regions, max_weight, working_hours in specs
+        }
+    return candidates.match_all(index.windows(), specs)
+
+
+def read_batch_inputs(db: Session, courier_ids: List[int]):
+    # Everything select_batch needs from the db: the couriers' constraints,
+    # the pending order index, their outstanding orders and the published plan
+    couriers = get_courier_constraints(db, courier_ids)
+    index = order_index.get_index(db)
+    if index is None:
+        regions = {region_id for _, courier_regions, _ in couriers.values() for region_id in courier_regions}
+        index = order_index.PendingOrderIndex.snapshot(db, regions)
+    active_orders = get_active_orders(db, list(couriers))
+    return couriers, index, active_orders, matching.get_plan(db)
+
+
+def select_batch(courier_ids: List[int], couriers: dict, index: order_index.PendingOrderIndex,
+                 active_orders: dict, plan: matching.Plan):
+    # CPU only, no session: the server runs it off the event loop.
+    # Couriers are served in the order given, each order goes to the first one it fits.
+    start = time.perf_counter()
+    strategy = assignment.get_strategy()
+    matched = match_couriers(index, couriers)
+    taken = set()
+    assignments = {}
+    for courier_id in courier_ids:
+        if courier_id not in couriers or courier_id in assignments:
+            continue
+        max_weight = get_max_weight(couriers[courier_id][0])
+        orders_id = [order_id for order_id in matched[courier_id] if order_id not in taken]
+        if plan is not None:
+            orders_id = plan.available_to(courier_id, orders_id)
+        weights = index.weights(orders_id)
+        carried = sum(weight for _, weight, _ in active_orders.get(courier_id, []))
+        orders_id = strategy.select(list(weights), list(weights.values()), max_weight - carried)
+        taken.update(orders_id)
+        assignments[courier_id] = orders_id
+    return assignments, time.perf_counter() - start
+
+
+def claim_batch(db: Session, couriers: dict, assignments: dict):
+    # Commits the orders select_batch chose and returns each courier's
+    # outstanding orders with their assign time
+    now = datetime.now()
+    taken = [order_id for orders_id in assignments.values() for order_id in orders_id]
+    if taken:
+        try:
+            claim_orders(db, {
+                order_id: (courier_id, couriers[courier_id][0])
+                for courier_id, orders_id in assignments.items() for order_id in orders_id
+            }, now)
             db.commit()
-    db.refresh(db_courier)
+        except Exception:
+            db.rollback()
+            raise
+        for courier_id, orders_id in assignments.items():
+            if orders_id:
+                cache.courier_profiles.invalidate(cache.courier_key(db, courier_id))
+                cache.assignments.touch_courier(db, courier_id)
+        index = order_index.peek_index(db)
+        if index is not None:
+            index.remove(taken)
+
+    active_orders = get_active_orders(db, list(assignments))
+    results = []
+    for courier_id in assignments:
+        orders = active_orders.get(courier_id, [])
+        result = {"courier_id": courier_id, "orders": [order_id for order_id, _, _ in orders]}
+        if orders:
+            assign_times = [assign_time for _, _, assign_time in orders]
+            result["assign_time"] = (now if now in assign_times else max(assign_times)).isoformat()
+        results.append(result)
+    return results
+
+
+def read_assignment_plan_inputs(db: Session):
+    # Everything solve_assignment_plan needs from the db: the couriers'
+    # constraints, their outstanding orders and the pending order index
+    rows = db.query(models.Courier.courier_id).order_by(models.Courier.courier_id)
+    courier_ids = [courier_id for courier_id, in rows]
+    couriers = get_courier_constraints(db, courier_ids)
+    active_orders = get_active_orders(db, courier_ids)
+    index = order_index.get_index(db)
+    if index is None:
+        index = order_index.PendingOrderIndex.snapshot(db, None)
+    return couriers, active_orders, index
+
+
+def solve_assignment_plan(couriers: dict, active_orders: dict, index: order_index.PendingOrderIndex,
+                          time_budget: float):
+    # CPU only, no session: the server runs it off the event loop
+    start = time.perf_counter()
+    matched = match_couriers(index, couriers)
+    inputs = {}
+    weights = {}
+    for courier_id, (courier_type, _, _) in couriers.items():
+        max_weight = get_max_weight(courier_type)
+        carried = sum(weight for _, weight, _ in active_orders.get(courier_id, []))
+        courier_weights = index.weights(matched[courier_id])
+        weights.update(courier_weights)
+        inputs[courier_id] = (max_weight - carried, list(courier_weights))
+
+    assignments, complete = matching.solve(inputs, weights, time_budget - (time.perf_counter() - start))
+    return matching.Plan(assignments, complete, time.perf_counter() - start)
+
+
+def publish_assignment_plan(db: Session, plan: matching.Plan):
+    matching.publish(db, plan)
+    cache.assignments.touch_all(db)
+
+
+def diff_children(db: Session, model, key, courier_id: int, wanted: list):
+    # Deletes the rows whose key is no longer wanted and returns the wanted
+    # keys that have no row yet, so unchanged rows are left untouched
+    rows = db.query(model.id, key).filter(model.courier_id == courier_id).order_by(model.id).all()
+    wanted_set = set(wanted)
+    kept = set()
+    stale = []
+    for row_id, value in rows:
+        if value in wanted_set and value not in kept:
+            kept.add(value)
+        else:
+            stale.append(row_id)
+    for i in range(0, len(stale), IN_CHUNK_SIZE):
+        db.query(model) \
+            .filter(model.id.in_(stale[i:i + IN_CHUNK_SIZE])) \
+            .delete(synchronize_session=False)
+    return [value for value in wanted if value not in kept]
 
-    courier_dto = schemas.CourierDto
-    courier_dto.courier_id = db_courier.courier_id
-    courier_dto.courier_type = db_courier.type
-    courier_dto.regions = get_regions_by_courier_id(db, courier_id)
-    courier_dto.working_hours = get_working_hours_by_courier_id(db, courier_id)
 
-    return courier_dto
+def update_courier(db: Session, changes: dict, courier_id: int):
+    # Applies a PATCH without committing, returns the courier's id afterwards
+    courier_type = changes.get("courier_type")
+    if courier_type is not None:
+        db.query(models.Courier) \
+            .filter(models.Courier.courier_id == courier_id) \
+            .update({models.Courier.type: courier_type}, synchronize_session=False)
+
+    regions = changes.get("regions")
+    if regions is not None:
+        regions = list(dict.fromkeys(regions))
+        added = diff_children(db, models.CourierRegion, models.CourierRegion.region_id, courier_id, regions)
+        db.bulk_insert_mappings(models.CourierRegion, [
+            {"courier_id": courier_id, "region_id": region} for region in added
+        ])
+
+    working_hours = changes.get("working_hours")
+    if working_hours is not None:
+        working_hours = list(dict.fromkeys(working_hours))
+        added = diff_children(
+            db, models.CourierWorkingHours, models.CourierWorkingHours.courier_working_hours,
+            courier_id, working_hours
+        )
+        mappings = []
+        for w_h in added:
+            begin, end = convert_to_minute(w_h)
+            mappings.append({"courier_id": courier_id, "courier_working_hours": w_h, "begin": begin, "end": end})
+        db.bulk_insert_mappings(models.CourierWorkingHours, mappings)
+
+    new_courier_id = changes.get("courier_id")
+    if new_courier_id is not None and new_courier_id != courier_id:
+        # Everything keyed by the courier moves with it. The rows referencing
+        # the courier point at the new row before the old one goes, so no
+        # foreign key is ever left dangling; a taken id fails the insert.
+        courier = models.Courier.__table__
+        db.execute(courier.insert().from_select(
+            [courier.c.courier_id, courier.c.courier_type, courier.c.courier_rating, courier.c.courier_earnings],
+            select(literal(new_courier_id), courier.c.courier_type, courier.c.courier_rating,
+                   courier.c.courier_earnings)
+            .where(courier.c.courier_id == courier_id)
+        ))
+        for model in (
+                models.CourierRegion,
+                models.CourierWorkingHours,
+                models.CompletedCourierOrder,
+                models.CourierRegionStats,
+                models.Order
+        ):
+            db.query(model) \
+                .filter(model.courier_id == courier_id) \
+                .update({model.courier_id: new_courier_id}, synchronize_session=False)
+        db.query(models.Courier) \
+            .filter(models.Courier.courier_id == courier_id) \
+            .delete(synchronize_session=False)
+        courier_id = new_courier_id
+    return courier_id
+
+
+def courier_violations(db: Session, courier_id: int):
+    # Condition on models.Order that holds for orders the courier no longer
+    # fits: too heavy for its type, outside its regions, or with delivery
+    # hours none of which overlap its working hours
+    d_h = aliased(models.OrderDeliveryHours)
+    w_h = models.CourierWorkingHours
+    courier_type = db.query(models.Courier.type).filter(models.Courier.courier_id == courier_id).scalar()
+    in_regions = exists() \
+        .where(models.CourierRegion.courier_id == courier_id) \
+        .where(models.CourierRegion.region_id == models.Order.region_id)
+    has_hours = exists().where(d_h.order_id == models.Order.id)
+    hours_overlap = exists() \
+        .where(d_h.order_id == models.Order.id) \
+        .where(w_h.courier_id == courier_id) \
+        .where(d_h.begin < w_h.end) \
+        .where(w_h.begin < d_h.end)
+    return or_(
+        models.Order.weight > get_max_weight(courier_type),
+        ~in_regions,
+        and_(has_hours, ~hours_overlap)
+    )
 
 
 def check_courier(db: Session, courier_id: int):
-    courier_orders = db.query(models.Order).filter(models.Order.courier_id == courier_id).all()
-    courier_regions = get_regions_by_courier_id(db, courier_id)
-    courier_w_h = get_working_hours_by_courier_id(db, courier_id)
-    courier = get_courier_by_id(db, courier_id)
-    courier_max_weight = courier.courier_type
-
-    if courier_max_weight == "foot":
-        courier_max_weight = 10.0
-    elif courier_max_weight == "bike":
-        courier_max_weight = 15.0
-    else:
-        courier_max_weight = 50.0
-
-    for order in courier_orders:
-        if order.weight > courier_max_weight:
-            order.courier_id = -1
-            order.assign_time = None
-            db.commit()
-        elif order.region_id not in courier_regions:
-            order.courier_id = -1
-            order.assign_time = None
-            db.commit()
-        elif order.delivery_hours:
-            ok = False
-            for d_h in order.delivery_hours:
-                for w_h in courier_w_h:
-                    if checking_the_time(w_h, d_h):
-                        ok = True
-            if not ok:
-                order.courier_id = -1
-                order.assign_time = None
-                db.commit()
-
-
-def checking_the_time(w_h: str, d_h: str):
-    # Delivery hours convert in minute
-    d_h_begin, d_h_end = convert_to_minute(d_h)
-
-    # Working hours convert in minute
-    w_h_begin, w_h_end = convert_to_minute(w_h)
+    # Unassigns the outstanding orders the courier no longer fits, without
+    # committing. Returns them as (order_id, region_id, weight, windows).
+    rows = db.query(
+        models.Order.id,
+        models.Order.region_id,
+        models.Order.weight,
+        models.OrderDeliveryHours.begin,
+        models.OrderDeliveryHours.end
+    ) \
+        .outerjoin(models.OrderDeliveryHours, models.OrderDeliveryHours.order_id == models.Order.id) \
+        .filter(models.Order.courier_id == courier_id) \
+        .filter(models.Order.status == "assigned") \
+        .filter(courier_violations(db, courier_id)) \
+        .all()
+    released = {}
+    for order_id, region_id, weight, begin, end in rows:
+        if order_id not in released:
+            released[order_id] = (order_id, region_id, weight, [])
+        if begin is not None:
+            released[order_id][3].append((begin, end))
+
+    released_id = list(released)
+    for i in range(0, len(released_id), IN_CHUNK_SIZE):
+        db.query(models.Order) \
+            .filter(models.Order.id.in_(released_id[i:i + IN_CHUNK_SIZE])) \
+            .filter(models.Order.courier_id == courier_id) \
+            .update({
+                models.Order.courier_id: -1,
+                models.Order.courier_type: None,
+                models.Order.assign_time: None,
+                models.Order.status: "pending"
+            }, synchronize_session=False)
+    return list(released.values())
+
+
+def patch_courier(db: Session, changes: dict, courier_id: int):
+    if db.query(exists().where(models.Courier.courier_id == courier_id)).scalar() is not True:
+        return None
+    try:
+        new_courier_id = update_courier(db, changes, courier_id)
+        released = check_courier(db, new_courier_id)
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+
+    cache.courier_profiles.invalidate(cache.courier_key(db, courier_id))
+    cache.courier_profiles.invalidate(cache.courier_key(db, new_courier_id))
+    cache.assignments.touch_courier(db, courier_id)
+    cache.assignments.touch_courier(db, new_courier_id)
+    matching.drop_courier(db, courier_id)
+    matching.drop_courier(db, new_courier_id)
+    # Released orders are pending again, for the couriers of their regions too
+    cache.assignments.touch_regions(db, [region_id for _, region_id, _, _ in released])
+    index = order_index.peek_index(db)
+    if index is not None:
+        for order_id, region_id, weight, windows in released:
+            index.add(order_id, region_id, weight, windows)
+
+    courier_type = db.query(models.Courier.type).filter(models.Courier.courier_id == new_courier_id).scalar()
+    regions = changes.get("regions")
+    working_hours = changes.get("working_hours")
+    return schemas.CourierDto(
+        courier_id=new_courier_id,
+        courier_type=courier_type,
+        # A PATCH answers with the lists in the order it sent them
+        regions=list(dict.fromkeys(regions)) if regions is not None
+        else get_regions_by_courier_id(db, new_courier_id),
+        working_hours=list(dict.fromkeys(working_hours)) if working_hours is not None
+        else get_working_hours_by_courier_id(db, new_courier_id)
+    )
 
-    b1 = d_h_end <= w_h_begin
-    b2 = d_h_begin >= w_h_end
 
-    if b1 or b2:
-        return False
-    elif d_h_begin <= w_h_begin < d_h_end:
-        return True
-    elif w_h_begin <= d_h_begin < d_h_end:
-        return True
+def intervals_overlap(begin_1: int, end_1: int, begin_2: int, end_2: int):
+    return begin_1 < end_2 and begin_2 < end_1
 
 
 def convert_to_minute(time: str):
@@ -319,44 +781,58 @@ def create_completed_courier_order(
         complete_time_g: datetime,
         order_region: int
 ):
-    completed_orders = db.query(models.CompletedCourierOrder) \
+    # Served backwards from the (courier_id, order_region, order_number) index
+    last_completed_order = db.query(
+        models.CompletedCourierOrder.order_number,
+        models.CompletedCourierOrder.complete_time
+    ) \
         .filter(models.CompletedCourierOrder.courier_id == courier_id) \
         .filter(models.CompletedCourierOrder.order_region == order_region) \
-        .all()
-    last_completed_order = []
-    if completed_orders:
-        for order in completed_orders:
-            last_completed_order.append(order.order_number)
-        last_completed_order = list(set(last_completed_order))[-1]
-    else:
-        last_completed_order = 0
+        .order_by(models.CompletedCourierOrder.order_number.desc()) \
+        .first()
 
-    if last_completed_order == 0:
-        db_order = db.query(models.Order).get(order_id)
-        completion_time = db_order.assign_time
+    if last_completed_order is None:
+        last_order_number = 0
+        completion_time = db.query(models.Order).get(order_id).assign_time
     else:
-        db_last_completed_order = db.query(models.CompletedCourierOrder) \
-            .filter(models.CompletedCourierOrder.order_number == last_completed_order) \
-            .first()
-        completion_time = db_last_completed_order.complete_time
+        last_order_number, completion_time = last_completed_order
 
-    complete_time = complete_time_g.strftime('%Y-%m-%dT%H:%M:%S')
-    completion_time = completion_time.strftime('%Y-%m-%dT%H:%M:%S')
-    complete_time_s = dateutil.parser.parse(complete_time)
-    completion_time_s = dateutil.parser.parse(completion_time)
-
-    lead_time = int((complete_time_s - completion_time_s).total_seconds())
+    # Naive wall-clock times on both sides, as assign_time is stored
+    complete_time_g = complete_time_g.replace(tzinfo=None)
+    lead_time = int((complete_time_g - completion_time).total_seconds())
 
     db_completed_courier_order = models.CompletedCourierOrder(
         courier_id=courier_id,
         order_id=order_id,
-        order_number=last_completed_order + 1,
+        order_number=last_order_number + 1,
         complete_time=complete_time_g,
         lead_time=lead_time,
         order_region=order_region
     )
     db.add(db_completed_courier_order)
-    db.commit()
+    add_completion_to_stats(db, courier_id, order_region, lead_time)
+
+
+def add_completion_to_stats(db: Session, courier_id: int, region_id: int, lead_time: int):
+    # One upsert, incremented in SQL: concurrent completions never overwrite
+    # each other, and two first completions in a region both count instead
+    # of one failing on the primary key
+    stats = models.CourierRegionStats.__table__
+    insert = postgresql.insert if db.get_bind().dialect.name == "postgresql" else sqlite.insert
+    statement = insert(stats).values(
+        courier_id=courier_id,
+        region_id=region_id,
+        lead_time_sum=lead_time,
+        completed_count=1
+    )
+    db.execute(statement.on_conflict_do_update(
+        index_elements=[stats.c.courier_id, stats.c.region_id],
+        set_={
+            stats.c.lead_time_sum: stats.c.lead_time_sum + statement.excluded.lead_time_sum,
+            stats.c.completed_count: stats.c.completed_count + 1
+        }
+    ))
+    db.flush()
 
 
 def order_complete(db: Session, order_info: dict):
@@ -369,8 +845,9 @@ def order_complete(db: Session, order_info: dict):
     if db_order is None or db_order.courier_id != courier_id:
         return None
     complete_time_dt = dateutil.parser.parse(complete_time)
-    if db.query(models.CompletedCourierOrder).filter(models.CompletedCourierOrder.order_id == order_id).first() is None:
-
+    if db_order.status != "completed":
+        # Committed with the completion row and the courier's rating
+        db_order.status = "completed"
         create_completed_courier_order(
             db, courier_id, order_id,
             complete_time_dt,
@@ -386,32 +863,24 @@ def order_complete(db: Session, order_info: dict):
             earning_ratio = 9
 
         calculate_courier_rating_earning(db, courier_id, earning_ratio)
+        cache.courier_profiles.invalidate(cache.courier_key(db, courier_id))
+        cache.assignments.touch_courier(db, courier_id)
 
     return order_id
 
 
 def calculate_courier_rating_earning(db: Session, courier_id: int, earning_ratio: int):
     db_courier = db.query(models.Courier).get(courier_id)
-    db_all_completed_orders = db.query(models.CompletedCourierOrder) \
-        .filter(models.CompletedCourierOrder.courier_id == courier_id) \
+    region_stats = db.query(
+        models.CourierRegionStats.lead_time_sum,
+        models.CourierRegionStats.completed_count
+    ) \
+        .filter(models.CourierRegionStats.courier_id == courier_id) \
         .all()
 
-    all_regions = []
-    for completed_order in db_all_completed_orders:
-        all_regions.append(completed_order.order_region)
-    all_regions = list(set(all_regions))
     average_lead_time_in_regions = []
-    for region in all_regions:
-        db_completed_orders = db.query(models.CompletedCourierOrder) \
-            .filter(models.CompletedCourierOrder.order_region == region) \
-            .all()
-        average_lead_time = 0
-        count = 0
-        for order in db_completed_orders:
-            average_lead_time += order.lead_time
-            count += 1
-        average_lead_time /= count
-        average_lead_time_in_regions.append(average_lead_time)
+    for lead_time_sum, completed_count in region_stats:
+        average_lead_time_in_regions.append(lead_time_sum / completed_count)
 
     t = min(average_lead_time_in_regions)
     rating = ((60 * 60 - min(t, 60 * 60)) / (60 * 60)) * 5
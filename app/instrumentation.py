@@ -0,0 +1,140 @@
+import logging
+import os
+import sys
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from starlette.routing import Match
+
+from . import metrics
+
+# Statements slower than this many seconds are logged with the app function
+# that issued them, 0 turns the log off
+SLOW_QUERY_SECONDS = float(os.getenv("SLOW_QUERY_SECONDS", "0"))
+
+LABELS = ("method", "route")
+
+REQUEST_SECONDS = metrics.histogram(
+    "http_request_duration_seconds", "Wall time of a request, streamed bodies included",
+    label_names=LABELS
+)
+REQUEST_DB_SECONDS = metrics.histogram(
+    "http_request_db_seconds", "Time a request spent executing statements",
+    label_names=LABELS
+)
+REQUEST_STATEMENTS = metrics.histogram(
+    "http_request_db_statements", "Statements executed by a request",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 500, 1000, 10000), label_names=LABELS
+)
+REQUEST_ROWS = metrics.histogram(
+    "http_request_db_rows", "Rows fetched by a request",
+    buckets=(1, 10, 100, 1000, 10000, 100000, 1000000), label_names=LABELS
+)
+
+logger = logging.getLogger(__name__)
+
+
+class RequestStats:
+    def __init__(self):
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+
+
+# Set for the duration of a request. The threadpool and the response tasks
+# run in copies of the request context, which share the same RequestStats.
+_current: ContextVar = ContextVar("request_stats", default=None)
+
+
+class RowCountingCursor:
+    # Stands in for the DBAPI cursor of a SELECT so the rows the result reads
+    # are counted as they are fetched
+    def __init__(self, cursor, stats: RequestStats):
+        self._cursor = cursor
+        self._stats = stats
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        if row is not None:
+            self._stats.rows += 1
+        return row
+
+    def fetchmany(self, *args):
+        rows = self._cursor.fetchmany(*args)
+        self._stats.rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = self._cursor.fetchall()
+        self._stats.rows += len(rows)
+        return rows
+
+
+def caller():
+    # Innermost named function of the app, outside this module and the db
+    # plumbing. Comprehensions run in frames of their own and are skipped.
+    frame = sys._getframe(1)
+    while frame is not None:
+        module = frame.f_globals.get("__name__", "")
+        if module.startswith("app.") and module not in ("app.instrumentation", "app.database") \
+                and not frame.f_code.co_name.startswith("<"):
+            return "%s.%s" % (module, frame.f_code.co_name)
+        frame = frame.f_back
+    return "unknown"
+
+
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context.query_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context.query_start
+    stats = _current.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.db_time += elapsed
+        if cursor.description is not None:
+            context.cursor = RowCountingCursor(cursor, stats)
+    if SLOW_QUERY_SECONDS and elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning("Slow query %.3fs in %s: %s", elapsed, caller(), statement)
+
+
+def route_of(scope):
+    # The path template, so every courier id does not become its own series
+    app = scope.get("app")
+    if app is not None:
+        for route in app.router.routes:
+            match, _ = route.matches(scope)
+            if match == Match.FULL:
+                return route.path
+    return "unmatched"
+
+
+class RequestMetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _current.set(stats)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            elapsed = time.perf_counter() - start
+            _current.reset(token)
+            labels = (scope["method"], route_of(scope))
+            REQUEST_SECONDS.observe(elapsed, *labels)
+            REQUEST_DB_SECONDS.observe(stats.db_time, *labels)
+            REQUEST_STATEMENTS.observe(stats.statements, *labels)
+            REQUEST_ROWS.observe(stats.rows, *labels)
@@ -1,118 +1,248 @@
+import asyncio
+import logging
+import time
 from typing import List, Dict
 
 import uvicorn
-from fastapi import Depends, FastAPI, HTTPException, Request, status
+from fastapi import Depends, FastAPI, HTTPException, Query, Request, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 
-from app import schemas, crud, models
-from app.database import SessionLocal, engine
+from app import schemas, crud, candidates, instrumentation, matching, metrics, migrations, models, order_index, \
+    streaming, validation
+from app.database import DB_ASYNC, AsyncSessionLocal, SessionLocal, engine, run_db
 
-models.Base.metadata.create_all(bind=engine)
+migrations.upgrade(engine)
 
 app = FastAPI()
+app.add_middleware(instrumentation.RequestMetricsMiddleware)
+logger = logging.getLogger(__name__)
 
 
 # Dependency
-def get_db():
+if DB_ASYNC:
+    async def get_db():
+        async with AsyncSessionLocal() as db:
+            yield db
+else:
+    def get_db():
+        db = SessionLocal()
+        try:
+            yield db
+        finally:
+            db.close()
+
+
+async def run_in_session(fn, *args):
+    if DB_ASYNC:
+        async with AsyncSessionLocal() as db:
+            return await run_db(db, fn, *args)
     db = SessionLocal()
     try:
-        yield db
+        return await run_db(db, fn, *args)
     finally:
         db.close()
 
 
+@app.on_event("startup")
+async def build_order_index():
+    await run_in_session(order_index.get_index)
+
+
+async def compute_assignment_plan():
+    # Only the reads and the publish go through a session: an AsyncSession
+    # would run the solve on the event loop and stall every request meanwhile
+    start = time.perf_counter()
+    couriers, active_orders, index = await run_in_session(crud.read_assignment_plan_inputs)
+    time_budget = matching.MATCHING_TIME_BUDGET - (time.perf_counter() - start)
+    plan = await run_in_threadpool(crud.solve_assignment_plan, couriers, active_orders, index, time_budget)
+    await run_in_session(crud.publish_assignment_plan, plan)
+    return plan
+
+
+async def run_global_matching():
+    while True:
+        try:
+            await compute_assignment_plan()
+        except Exception:
+            logger.exception("Global matching failed")
+        await asyncio.sleep(matching.MATCHING_INTERVAL)
+
+
+@app.on_event("startup")
+async def start_global_matching():
+    if matching.GLOBAL_MATCHING:
+        app.state.matching_task = asyncio.create_task(run_global_matching())
+
+
+@app.on_event("shutdown")
+async def stop_global_matching():
+    task = getattr(app.state, "matching_task", None)
+    if task is not None:
+        task.cancel()
+
+
+@app.on_event("shutdown")
+def stop_match_workers():
+    candidates.shutdown()
+
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
-    couriers_v_e = []
-    is_courier = True
-    if exc.body.get("data")[0].get("courier_id") is None:
-        is_courier = False
-        type_obj = "orders"
-    else:
-        type_obj = "couriers"
+    # Imports validate their items themselves, see import_validation_error
+    return JSONResponse(status_code=status.HTTP_400_BAD_REQUEST, content={"detail": "Bad request"})
 
-    print(exc.errors())
 
-    for error in exc.errors():
-        error_number = error.get("loc")[2]
-        if is_courier:
-            element_id = exc.body.get("data")[error_number].get("courier_id")
-        else:
-            element_id = exc.body.get("data")[error_number].get("order_id")
-        couriers_v_e.append({"id": element_id})
+def import_validation_error(kind: str, invalid_ids: list):
     return JSONResponse(
         status_code=status.HTTP_400_BAD_REQUEST,
-        content=jsonable_encoder({"validation_error": {type_obj: couriers_v_e}})
+        content=jsonable_encoder({"validation_error": {kind: [{"id": item_id} for item_id in invalid_ids]}})
     )
 
 
+async def taken_ids_error(db: Session, kind: str, key, items: list):
+    # The import was rolled back: its ids already in the database are the invalid ones
+    ids = [item["id"] for item in items]
+    taken = await run_db(db, crud.get_taken_ids, key, ids)
+    return import_validation_error(kind, [item_id for item_id in ids if item_id in taken])
+
+
 @app.post("/couriers", status_code=201, response_model=dict)
-def create_couriers(data: Dict[str, List[schemas.CourierDto]],
-                    db: Session = Depends(get_db)):
+async def create_couriers(data: Dict[str, list], db: Session = Depends(get_db)):
+    if "data" not in data:
+        raise HTTPException(status_code=400, detail="Bad request")
+    couriers, invalid_ids = validation.validate_couriers(data["data"])
+    if invalid_ids:
+        return import_validation_error("couriers", invalid_ids)
     created_couriers = []
-    for courier in data.get("data"):
+    for courier in couriers:
         created_couriers.append({"id": courier.courier_id})
-        crud.create_courier(db, courier)
+    try:
+        await run_db(db, crud.create_couriers, couriers)
+    except IntegrityError:
+        return await taken_ids_error(db, "couriers", models.Courier.courier_id, created_couriers)
     return {"couriers": created_couriers}
 
 
+async def stream_pages(db: Session, list_page, key, after: int, limit: int, **filters):
+    # Keyset pages read one at a time, so an export never sits in memory whole
+    sent = 0
+    while limit is None or sent < limit:
+        page_size = streaming.LIST_PAGE_SIZE if limit is None else min(streaming.LIST_PAGE_SIZE, limit - sent)
+        page = await run_db(db, lambda session: list_page(session, after, page_size, **filters))
+        for record in page:
+            yield (record.json() + "\n").encode()
+        sent += len(page)
+        if len(page) < page_size:
+            break
+        after = key(page[-1])
+
+
+@app.get("/couriers")
+async def list_couriers(
+        after: int = 0, limit: int = Query(None, ge=1), type: str = None, region: int = None,
+        db: Session = Depends(get_db)
+):
+    if type is not None and type not in ("foot", "bike", "car"):
+        raise HTTPException(status_code=400, detail="Bad request")
+    return streaming.NDJSONResponse(stream_pages(
+        db, crud.list_couriers, lambda courier: courier.courier_id, after, limit,
+        courier_type=type, region=region
+    ))
+
+
+@app.get("/orders")
+async def list_orders(
+        after: int = 0, limit: int = Query(None, ge=1), status: str = None, region: int = None,
+        courier_id: int = None, type: str = None, db: Session = Depends(get_db)
+):
+    if status is not None and status not in crud.ORDER_STATUSES:
+        raise HTTPException(status_code=400, detail="Bad request")
+    if type is not None and type not in ("foot", "bike", "car"):
+        raise HTTPException(status_code=400, detail="Bad request")
+    return streaming.NDJSONResponse(stream_pages(
+        db, crud.list_orders, lambda order: order.order_id, after, limit,
+        status=status, region=region, courier_id=courier_id, courier_type=type
+    ))
+
+
 @app.get("/couriers/{courier_id}", response_model=dict)
-def get_full_courier(courier_id: int, db: Session = Depends(get_db)):
-    db_courier = crud.get_courier_by_id(db, courier_id=courier_id)
-    if db_courier is None:
+async def get_full_courier(courier_id: int, db: Session = Depends(get_db)):
+    courier = await run_db(db, crud.get_courier_profile, courier_id)
+    if courier is None:
         raise HTTPException(status_code=404, detail="Courier not found")
-
-    if db.query(models.CompletedCourierOrder).filter(models.CompletedCourierOrder.courier_id == courier_id).all():
-        courier = {
-            "courier_id": db_courier.courier_id,
-            "courier_type": db_courier.courier_type,
-            "regions": db_courier.regions,
-            "working_hours": db_courier.working_hours,
-            "rating": db_courier.rating,
-            "earning": db_courier.earning
-        }
-    else:
-        courier = {
-            "courier_id": db_courier.courier_id,
-            "courier_type": db_courier.courier_type,
-            "regions": db_courier.regions,
-            "working_hours": db_courier.working_hours,
-            "earning": db_courier.earning
-        }
     return courier
 
 
+@app.get("/metrics")
+async def get_metrics():
+    return Response(content=metrics.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.post("/orders", status_code=201, response_model=dict)
-def create_order(data: Dict[str, List[schemas.OrderDto]], db: Session = Depends(get_db)):
+async def create_order(data: Dict[str, list], db: Session = Depends(get_db)):
+    if "data" not in data:
+        raise HTTPException(status_code=400, detail="Bad request")
+    orders, invalid_ids = validation.validate_orders(data["data"])
+    if invalid_ids:
+        return import_validation_error("orders", invalid_ids)
     created_orders = []
-    for order in data.get("data"):
+    for order in orders:
         created_orders.append({"id": order.order_id})
-        crud.create_order(db, order)
+    try:
+        await run_db(db, crud.create_orders, orders)
+    except IntegrityError:
+        return await taken_ids_error(db, "orders", models.Order.id, created_orders)
     return {"orders": created_orders}
 
 
+@app.post("/orders/stream", status_code=200, response_model=dict)
+async def import_orders(request: Request, db: Session = Depends(get_db)):
+    # NDJSON, one order per line. Valid orders are written every
+    # IMPORT_BATCH_SIZE records, each batch in its own transaction.
+    summary = streaming.ImportSummary()
+    batch = []
+
+    async def write_batch():
+        skipped = set(await run_db(db, crud.import_orders, [order for _, order in batch]))
+        for position, (record, order) in enumerate(batch):
+            if position in skipped:
+                summary.reject(record, order.order_id, "duplicate order_id")
+            else:
+                summary.accepted += 1
+        batch.clear()
+
+    record = 0
+    async for line in streaming.ndjson_lines(request.stream()):
+        record += 1
+        order, order_id, reason = streaming.parse_order(line)
+        if order is None:
+            summary.reject(record, order_id, reason)
+            continue
+        batch.append((record, order))
+        if len(batch) >= streaming.IMPORT_BATCH_SIZE:
+            await write_batch()
+    if batch:
+        await write_batch()
+    return summary.as_dict()
+
+
 @app.post("/orders/assign", status_code=200, response_model=dict)
-def assign_order(courier: Dict[str, int], db: Session = Depends(get_db)):
-    assigned_orders = []
+async def assign_order(courier: Dict[str, int], db: Session = Depends(get_db)):
+    return await run_db(db, assign_courier_orders, courier.get("courier_id"))
 
-    courier = crud.get_courier_by_id(db, courier.get("courier_id"))
-    if courier is None:
-        raise HTTPException(status_code=400, detail="Bad request")
 
-    orders, assign_time = crud.assign_order(db, courier)
-    orders_id = []
-    for order in orders:
-        if isinstance(order, models.Order):
-            orders_id.append(order.id)
-        else:
-            orders_id.append(order.order_id)
-    orders_id = list(set(orders_id))
-    for order in orders_id:
-        assigned_orders.append({"id": order})
+def assign_courier_orders(db: Session, courier_id: int):
+    assignment = crud.get_assignment(db, courier_id)
+    if assignment is None:
+        raise HTTPException(status_code=400, detail="Bad request")
 
+    orders_id, assign_time = assignment
+    assigned_orders = [{"id": order_id} for order_id in orders_id]
     if assigned_orders:
         dict_ = {
             "orders": assigned_orders,
@@ -125,8 +255,46 @@ def assign_order(courier: Dict[str, int], db: Session = Depends(get_db)):
     return dict_
 
 
+@app.post("/orders/assign/batch", status_code=200, response_model=dict)
+async def assign_orders_batch(request: Dict, db: Session = Depends(get_db)):
+    courier_ids = request.get("courier_ids")
+    all_idle = request.get("all_idle", False)
+    if (courier_ids is None) == (not all_idle) or set(request.keys()) - {"courier_ids", "all_idle"}:
+        raise HTTPException(status_code=400, detail="Bad request")
+    if courier_ids is not None:
+        if not isinstance(courier_ids, list) \
+                or not all(isinstance(courier_id, int) and not isinstance(courier_id, bool)
+                           for courier_id in courier_ids):
+            raise HTTPException(status_code=400, detail="Bad request")
+    return await assign_couriers_batch(db, courier_ids)
+
+
+async def assign_couriers_batch(db: Session, courier_ids: List[int] = None):
+    if courier_ids is None:
+        courier_ids = await run_db(db, crud.get_idle_courier_ids)
+    # As in compute_assignment_plan, only the reads and the claim go through
+    # the session: an AsyncSession would run the match on the event loop
+    couriers, index, active_orders, plan = await run_db(db, crud.read_batch_inputs, courier_ids)
+    assignments, solve_time = await run_in_threadpool(
+        crud.select_batch, courier_ids, couriers, index, active_orders, plan
+    )
+    results = await run_db(db, crud.claim_batch, couriers, assignments)
+    found = {result["courier_id"] for result in results}
+    couriers = []
+    for result in results:
+        courier = {"courier_id": result["courier_id"], "orders": [{"id": order_id} for order_id in result["orders"]]}
+        if "assign_time" in result:
+            courier["assign_time"] = result["assign_time"]
+        couriers.append(courier)
+    return {
+        "couriers": couriers,
+        "not_found": sorted({courier_id for courier_id in courier_ids if courier_id not in found}),
+        "solve_time": solve_time
+    }
+
+
 @app.patch("/couriers/{courier_id}", status_code=200, response_model=schemas.CourierDto)
-def update_courier(courier_id: int, changes: Dict, db: Session = Depends(get_db)):
+async def update_courier(courier_id: int, changes: Dict, db: Session = Depends(get_db)):
     fields = [
         "courier_id",
         "courier_type",
@@ -137,14 +305,34 @@ def update_courier(courier_id: int, changes: Dict, db: Session = Depends(get_db)
     for key in keys:
         if key not in fields:
             raise HTTPException(status_code=400, detail="Bad request")
-    courier_dto = crud.update_courier(db, changes, courier_id)
-    crud.check_courier(db, courier_id)
-    return courier_dto
+    new_courier_id = changes.get("courier_id")
+    if new_courier_id is not None and (not isinstance(new_courier_id, int) or isinstance(new_courier_id, bool)):
+        raise HTTPException(status_code=400, detail="Bad request")
+    courier_type = changes.get("courier_type")
+    if courier_type is not None and courier_type not in ("foot", "bike", "car"):
+        raise HTTPException(status_code=400, detail="Bad request")
+    regions = changes.get("regions")
+    if regions is not None:
+        if not isinstance(regions, list) \
+                or not all(isinstance(region, int) and not isinstance(region, bool) for region in regions):
+            raise HTTPException(status_code=400, detail="Bad request")
+    working_hours = changes.get("working_hours")
+    if working_hours is not None:
+        if not isinstance(working_hours, list) or not all(map(schemas.is_valid_hours, working_hours)):
+            raise HTTPException(status_code=400, detail="Bad request")
+    try:
+        courier = await run_db(db, crud.patch_courier, changes, courier_id)
+    except IntegrityError:
+        # courier_id changed to one that is already taken
+        raise HTTPException(status_code=400, detail="Bad request")
+    if courier is None:
+        raise HTTPException(status_code=404, detail="Courier not found")
+    return courier
 
 
 @app.post("/orders/complete", status_code=200, response_model=dict)
-def order_complete(order_info: Dict, db: Session = Depends(get_db)):
-    order_id = crud.order_complete(db, order_info)
+async def order_complete(order_info: Dict, db: Session = Depends(get_db)):
+    order_id = await run_db(db, crud.order_complete, order_info)
     if order_id is None:
         raise HTTPException(status_code=400, detail="Bad request")
     return {"order_id": order_id}
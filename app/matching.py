@@ -0,0 +1,172 @@
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Tuple
+from weakref import WeakKeyDictionary
+
+from sqlalchemy.orm import Session
+
+from . import metrics
+from .assignment import CAPACITY_EPSILON
+
+# GLOBAL_MATCHING=1 assigns from a plan solved for all couriers at once
+# instead of serving each /orders/assign call first-come first-served
+GLOBAL_MATCHING = os.getenv("GLOBAL_MATCHING", "0") == "1"
+MATCHING_INTERVAL = float(os.getenv("MATCHING_INTERVAL", "5"))
+MATCHING_TIME_BUDGET = float(os.getenv("MATCHING_TIME_BUDGET", "1"))
+
+SOLVE_SECONDS = metrics.histogram(
+    "matching_solve_seconds", "Time spent solving one global assignment plan",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 2.0, 5.0, 10.0, 30.0)
+)
+
+
+def max_matching(adjacency: Dict[int, List[int]]):
+    # Hopcroft-Karp over courier -> candidate orders. Candidates are listed in
+    # order of preference, which the initial greedy pass and every search follow.
+    match_left = {}
+    match_right = {}
+    for u, edges in adjacency.items():
+        for v in edges:
+            if v not in match_right:
+                match_left[u] = v
+                match_right[v] = u
+                break
+
+    while True:
+        dist = {}
+        queue = deque()
+        for u in adjacency:
+            if u not in match_left:
+                dist[u] = 0
+                queue.append(u)
+        augmentable = False
+        while queue:
+            u = queue.popleft()
+            for v in adjacency[u]:
+                w = match_right.get(v)
+                if w is None:
+                    augmentable = True
+                elif w not in dist:
+                    dist[w] = dist[u] + 1
+                    queue.append(w)
+        if not augmentable:
+            return match_left
+
+        for root in [u for u in adjacency if u not in match_left]:
+            stack = [(root, iter(adjacency[root]))]
+            via = []
+            while stack:
+                u, edges = stack[-1]
+                for v in edges:
+                    w = match_right.get(v)
+                    if w is None:
+                        via.append(v)
+                        for (x, _), y in zip(stack, via):
+                            match_left[x] = y
+                            match_right[y] = x
+                        stack = []
+                        break
+                    if dist.get(w) == dist[u] + 1:
+                        via.append(v)
+                        stack.append((w, iter(adjacency[w])))
+                        break
+                else:
+                    # Dead end, no later search goes through u in this phase
+                    dist[u] = None
+                    stack.pop()
+                    if via:
+                        via.pop()
+
+
+def solve(couriers: Dict[int, Tuple[float, Iterable[int]]], weights: Dict[int, float], time_budget: float):
+    # couriers: courier_id -> (capacity left, candidate order ids).
+    # Every round is a maximum matching giving each courier at most one more
+    # order, lighter orders first, so nobody gets a second order while a
+    # courier who could still be served has none. Rounds stop once nothing
+    # is matched or the time budget is spent, after at least one round.
+    deadline = time.perf_counter() + time_budget
+    capacity = {}
+    candidates = {}
+    for courier_id, (capacity_left, orders_id) in couriers.items():
+        capacity[courier_id] = capacity_left
+        candidates[courier_id] = sorted(orders_id, key=lambda order_id: (weights[order_id], order_id))
+    assignments = {courier_id: [] for courier_id in couriers}
+    taken = set()
+
+    complete = True
+    while True:
+        adjacency = {}
+        for courier_id, orders_id in candidates.items():
+            limit = capacity[courier_id] + CAPACITY_EPSILON
+            orders_id = [
+                order_id for order_id in orders_id
+                if order_id not in taken and weights[order_id] <= limit
+            ]
+            candidates[courier_id] = orders_id
+            if orders_id:
+                adjacency[courier_id] = orders_id
+        if not adjacency:
+            break
+        matched = max_matching(adjacency)
+        if not matched:
+            break
+        for courier_id, order_id in matched.items():
+            assignments[courier_id].append(order_id)
+            capacity[courier_id] -= weights[order_id]
+            taken.add(order_id)
+        if time.perf_counter() > deadline:
+            complete = False
+            break
+    return assignments, complete
+
+
+class Plan:
+    def __init__(self, assignments: Dict[int, List[int]], complete: bool, solve_time: float):
+        self.assignments = assignments
+        self.reserved = {
+            order_id: courier_id for courier_id, orders_id in assignments.items() for order_id in orders_id
+        }
+        self.complete = complete
+        self.solve_time = solve_time
+
+    def orders_for(self, courier_id: int):
+        # None for a courier the plan was not solved for
+        return self.assignments.get(courier_id)
+
+    def available_to(self, courier_id: int, orders_id: Iterable[int]):
+        # Drops orders the plan reserved for other couriers
+        return [order_id for order_id in orders_id if self.reserved.get(order_id, courier_id) == courier_id]
+
+    def drop(self, courier_id: int):
+        # Releases the orders reserved for the courier, which is then served
+        # like a courier the plan was not solved for
+        for order_id in self.assignments.pop(courier_id, ()):
+            self.reserved.pop(order_id, None)
+
+
+# One plan per engine, like the pending order index
+_plans = WeakKeyDictionary()
+_plans_lock = threading.Lock()
+
+
+def publish(db: Session, plan: Plan):
+    SOLVE_SECONDS.observe(plan.solve_time)
+    with _plans_lock:
+        _plans[db.get_bind()] = plan
+
+
+def get_plan(db: Session):
+    if not GLOBAL_MATCHING:
+        return None
+    with _plans_lock:
+        return _plans.get(db.get_bind())
+
+
+def drop_courier(db: Session, courier_id: int):
+    # A PATCH may leave the courier unfit for its planned orders
+    with _plans_lock:
+        plan = _plans.get(db.get_bind())
+        if plan is not None:
+            plan.drop(courier_id)
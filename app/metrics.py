@@ -0,0 +1,89 @@
+import threading
+from typing import Callable, Dict, Iterable, List, Optional, Sequence
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_collectors: List[Callable[[], Iterable[str]]] = []
+
+
+def register(collector: Callable[[], Iterable[str]]):
+    _collectors.append(collector)
+    return collector
+
+
+def _labels(labels: Optional[Dict[str, str]]):
+    if not labels:
+        return ""
+    pairs = []
+    for key, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append('%s="%s"' % (key, value))
+    return "{" + ",".join(pairs) + "}"
+
+
+def header(name: str, kind: str, description: str):
+    return ["# HELP %s %s" % (name, description), "# TYPE %s %s" % (name, kind)]
+
+
+def sample(name: str, value, labels: Optional[Dict[str, str]] = None):
+    return "%s%s %s" % (name, _labels(labels), repr(float(value)))
+
+
+def metric(name: str, kind: str, description: str, value, labels: Optional[Dict[str, str]] = None):
+    return header(name, kind, description) + [sample(name, value, labels)]
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    def __init__(self, name: str, description: str,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, label_names: Sequence[str] = ()):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.label_names = tuple(label_names)
+        self.lock = threading.Lock()
+        # label values -> [per-bucket counts, sum, count]
+        self.series = {}
+
+    def observe(self, value: float, *label_values):
+        with self.lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def collect(self):
+        lines = header(self.name, "histogram", self.description)
+        with self.lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self.series.items()]
+        for label_values, counts, total, count in sorted(series):
+            labels = dict(zip(self.label_names, label_values))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(sample(self.name + "_bucket", cumulative, dict(labels, le=repr(bound))))
+            lines.append(sample(self.name + "_bucket", count, dict(labels, le="+Inf")))
+            lines.append(sample(self.name + "_sum", total, labels))
+            lines.append(sample(self.name + "_count", count, labels))
+        return lines
+
+
+def histogram(name: str, description: str, buckets: Sequence[float] = DEFAULT_BUCKETS,
+              label_names: Sequence[str] = ()):
+    registered = Histogram(name, description, buckets, label_names)
+    register(registered.collect)
+    return registered
+
+
+def render():
+    lines = []
+    for collector in _collectors:
+        lines.extend(collector())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,138 @@
+from datetime import datetime
+
+from sqlalchemy import Column, DATETIME, Integer, MetaData, Table, inspect, select, func
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.sql import text
+
+from . import models
+from .backfill import rebuild_courier_region_stats
+from .crud import convert_to_minute
+from .database import Base
+
+metadata = MetaData()
+
+schema_version = Table(
+    "schema_version", metadata,
+    Column("version", Integer, primary_key=True),
+    Column("applied_at", DATETIME, nullable=False)
+)
+
+# Ordered (version, upgrade) pairs; versions are never renumbered or reused
+MIGRATIONS = []
+
+
+def migration(version: int):
+    def register(upgrade_fn):
+        MIGRATIONS.append((version, upgrade_fn))
+        MIGRATIONS.sort(key=lambda m: m[0])
+        return upgrade_fn
+    return register
+
+
+def _add_minute_columns(connection: Connection, table: str, hours_column: str):
+    for column in ("begin_minute", "end_minute"):
+        connection.execute(text(
+            'ALTER TABLE %s ADD COLUMN %s INTEGER NOT NULL DEFAULT 0' % (table, column)
+        ))
+    rows = connection.execute(text('SELECT id, %s FROM %s' % (hours_column, table))).fetchall()
+    params = []
+    for row_id, hours in rows:
+        begin, end = convert_to_minute(hours)
+        params.append({"id": row_id, "begin": begin, "end": end})
+    if params:
+        connection.execute(text(
+            'UPDATE %s SET begin_minute = :begin, end_minute = :end WHERE id = :id' % table
+        ), params)
+
+
+@migration(1)
+def add_hours_in_minutes(connection: Connection):
+    _add_minute_columns(connection, "courier_working_hours", "courier_working_hours")
+    _add_minute_columns(connection, "order_delivery_hours", "order_delivery_hours")
+
+
+@migration(2)
+def add_filter_indexes(connection: Connection):
+    inspector = inspect(connection)
+    for model in (
+            models.Order,
+            models.CourierRegion,
+            models.CourierWorkingHours,
+            models.OrderDeliveryHours,
+            models.CompletedCourierOrder
+    ):
+        columns = {column["name"] for column in inspector.get_columns(model.__tablename__)}
+        for index in model.__table__.indexes:
+            # Indexes over columns of later migrations are created by those
+            if index.name and index.name.startswith("ix_") \
+                    and all(column.name in columns for column in index.columns):
+                index.create(connection, checkfirst=True)
+
+
+@migration(3)
+def add_courier_region_stats(connection: Connection):
+    models.CourierRegionStats.__table__.create(connection, checkfirst=True)
+    rebuild_courier_region_stats(connection)
+
+
+@migration(4)
+def add_order_status(connection: Connection):
+    orders = models.Order.__table__
+    connection.execute(text(
+        "ALTER TABLE %s ADD COLUMN order_status VARCHAR NOT NULL DEFAULT 'pending'"
+        % connection.dialect.identifier_preparer.format_table(orders)
+    ))
+    completed = select(models.CompletedCourierOrder.order_id).scalar_subquery()
+    connection.execute(
+        orders.update()
+        .where(orders.c.order_courier_id != -1)
+        .where(orders.c.order_id.notin_(completed))
+        .values(order_status="assigned")
+    )
+    connection.execute(
+        orders.update()
+        .where(orders.c.order_id.in_(completed))
+        .values(order_status="completed")
+    )
+    for index in orders.indexes:
+        if index.name == "ix_order_courier_status":
+            index.create(connection, checkfirst=True)
+
+
+def head():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+
+def current_version(connection: Connection):
+    return connection.execute(select(func.max(schema_version.c.version))).scalar() or 0
+
+
+def _stamp(connection: Connection, version: int):
+    connection.execute(schema_version.insert(), {"version": version, "applied_at": datetime.now()})
+
+
+def upgrade(engine: Engine):
+    with engine.begin() as connection:
+        tables = inspect(connection).get_table_names()
+        if schema_version.name not in tables:
+            schema_version.create(connection)
+            if models.Courier.__tablename__ not in tables:
+                # Empty database: the models already describe the latest schema
+                Base.metadata.create_all(connection)
+                _stamp(connection, head())
+                return head()
+        version = current_version(connection)
+        for migration_version, upgrade_fn in MIGRATIONS:
+            if migration_version > version:
+                upgrade_fn(connection)
+                _stamp(connection, migration_version)
+                version = migration_version
+        # Tables introduced after a database was created come from the models
+        Base.metadata.create_all(connection)
+    return version
+
+
+if __name__ == "__main__":
+    from .database import engine
+
+    print("schema version", upgrade(engine))
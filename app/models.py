@@ -1,5 +1,6 @@
-from sqlalchemy import Column, ForeignKey, Integer, String, Numeric, DATETIME
+from sqlalchemy import Column, ForeignKey, Index, Integer, String, Numeric, DATETIME
 from sqlalchemy.orm import relationship
+from sqlalchemy.sql import text
 
 from .database import Base
 
@@ -12,9 +13,10 @@ class Courier(Base):
     rating = Column('courier_rating', Numeric, default=0.0)
     earning = Column('courier_earnings', Integer, default=0)
 
-    regions = relationship("CourierRegion", back_populates="courier")
-    working_hours = relationship("CourierWorkingHours", back_populates="courier")
+    regions = relationship("CourierRegion", back_populates="courier", order_by="CourierRegion.id")
+    working_hours = relationship("CourierWorkingHours", back_populates="courier", order_by="CourierWorkingHours.id")
     order_complete = relationship("CompletedCourierOrder", back_populates="courier")
+    region_stats = relationship("CourierRegionStats", back_populates="courier")
 
 
 class CourierRegion(Base):
@@ -26,6 +28,10 @@ class CourierRegion(Base):
 
     courier = relationship("Courier", back_populates="regions")
 
+    __table_args__ = (
+        Index('ix_courier_region_courier', 'courier_id', 'region_id'),
+    )
+
 
 class CourierWorkingHours(Base):
     __tablename__ = "courier_working_hours"
@@ -33,9 +39,15 @@ class CourierWorkingHours(Base):
     id = Column('id', Integer, primary_key=True, nullable=False)
     courier_id = Column('courier_id', Integer, ForeignKey("courier.courier_id"), nullable=False)
     courier_working_hours = Column('courier_working_hours', String, nullable=False)
+    begin = Column('begin_minute', Integer, nullable=False)
+    end = Column('end_minute', Integer, nullable=False)
 
     courier = relationship("Courier", back_populates="working_hours")
 
+    __table_args__ = (
+        Index('ix_courier_working_hours_courier', 'courier_id', 'begin_minute', 'end_minute'),
+    )
+
 
 class CompletedCourierOrder(Base):
     __tablename__ = "completed_courier_order"
@@ -52,6 +64,23 @@ class CompletedCourierOrder(Base):
     order = relationship("Order", back_populates="order_complete")
     courier = relationship("Courier", back_populates="order_complete")
 
+    __table_args__ = (
+        Index('ix_completed_courier_order_courier', 'courier_id', 'order_region', 'order_number'),
+        Index('ix_completed_courier_order_region', 'order_region', 'lead_time'),
+        Index('ix_completed_courier_order_order', 'order_id'),
+    )
+
+
+class CourierRegionStats(Base):
+    __tablename__ = "courier_region_stats"
+
+    courier_id = Column('courier_id', Integer, ForeignKey("courier.courier_id"), primary_key=True)
+    region_id = Column('region_id', Integer, primary_key=True)
+    lead_time_sum = Column('lead_time_sum', Integer, nullable=False, default=0)
+    completed_count = Column('completed_count', Integer, nullable=False, default=0)
+
+    courier = relationship("Courier", back_populates="region_stats")
+
 
 class Order(Base):
     __tablename__ = "order"
@@ -62,10 +91,25 @@ class Order(Base):
     courier_id = Column('order_courier_id', Integer, default=-1)
     courier_type = Column('order_courier_type', String)
     assign_time = Column('assign_time', DATETIME)
+    # pending -> assigned -> completed, moved in the same transaction as courier_id
+    # and the completion row; a release moves an assigned order back to pending
+    status = Column('order_status', String, nullable=False, default="pending", server_default="pending")
 
-    delivery_hours = relationship("OrderDeliveryHours", back_populates="order")
+    delivery_hours = relationship("OrderDeliveryHours", back_populates="order", order_by="OrderDeliveryHours.id")
     order_complete = relationship("CompletedCourierOrder", back_populates="order")
 
+    __table_args__ = (
+        Index('ix_order_courier', 'order_courier_id', 'assign_time'),
+        # A courier's active orders and their latest assign_time
+        Index('ix_order_courier_status', 'order_courier_id', 'order_status', 'assign_time'),
+        # Only unassigned orders are searched by region and weight
+        Index(
+            'ix_order_pending', 'order_region_id', 'order_weight',
+            sqlite_where=text('order_courier_id = -1'),
+            postgresql_where=text('order_courier_id = -1')
+        ),
+    )
+
 
 class OrderDeliveryHours(Base):
     __tablename__ = "order_delivery_hours"
@@ -73,5 +117,11 @@ class OrderDeliveryHours(Base):
     id = Column('id', Integer, primary_key=True, nullable=False)
     order_id = Column('order_id', Integer, ForeignKey("order.order_id"), nullable=False)
     delivery_hours = Column('order_delivery_hours', String, nullable=False)
+    begin = Column('begin_minute', Integer, nullable=False)
+    end = Column('end_minute', Integer, nullable=False)
 
     order = relationship("Order", back_populates="delivery_hours")
+
+    __table_args__ = (
+        Index('ix_order_delivery_hours_order', 'order_id', 'begin_minute', 'end_minute'),
+    )
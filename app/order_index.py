@@ -0,0 +1,231 @@
+import bisect
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Set, Tuple
+from weakref import WeakKeyDictionary
+
+from sqlalchemy.orm import Session
+
+from . import candidates, models
+
+ORDER_INDEX_ENABLED = os.getenv("ORDER_INDEX", "1") != "0"
+# The index only sees the writes of its own process: it is reloaded from the
+# db once older than this many seconds, so orders other workers add or
+# release are matched after at most that long. 0 never reloads it, for a
+# single worker.
+ORDER_INDEX_TTL = float(os.getenv("ORDER_INDEX_TTL", "5"))
+
+# Upper weight bound of every bucket, one per courier type limit
+WEIGHT_BUCKETS = (10.0, 15.0, 50.0)
+
+
+def weight_bucket(weight: float):
+    return bisect.bisect_left(WEIGHT_BUCKETS, weight)
+
+
+class DeliveryWindows:
+    # Delivery windows of one (region, weight bucket) as a list of
+    # (begin, end, order_id) sorted by begin. max_length bounds how far
+    # before a working interval an overlapping window can start.
+    def __init__(self):
+        self.windows = []
+        self.max_length = 0
+
+    def add(self, begin: int, end: int, order_id: int):
+        bisect.insort(self.windows, (begin, end, order_id))
+        self.max_length = max(self.max_length, end - begin)
+
+    def remove(self, begin: int, end: int, order_id: int):
+        i = bisect.bisect_left(self.windows, (begin, end, order_id))
+        if i < len(self.windows) and self.windows[i] == (begin, end, order_id):
+            del self.windows[i]
+
+    def stab(self, begin: int, end: int, found: Set[int]):
+        lo = bisect.bisect_left(self.windows, (begin - self.max_length + 1,))
+        hi = bisect.bisect_left(self.windows, (end,))
+        for i in range(lo, hi):
+            w_begin, w_end, order_id = self.windows[i]
+            if w_end > begin:
+                found.add(order_id)
+
+
+class PendingOrderIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.built = False
+        # time.monotonic() when the db was read for the current contents
+        self.loaded_at = None
+        # Mutations made while a rebuild reads the db, replayed over its result
+        self.journal = None
+        self.buckets: Dict[Tuple[int, int], DeliveryWindows] = {}
+        self.orders: Dict[int, Tuple[int, float, List[Tuple[int, int]]]] = {}
+
+    def _add(self, order_id: int, region_id: int, weight: float, windows: List[Tuple[int, int]]):
+        self._remove(order_id)
+        bucket = weight_bucket(weight)
+        self.orders[order_id] = (region_id, weight, windows)
+        delivery_windows = self.buckets.get((region_id, bucket))
+        if delivery_windows is None:
+            delivery_windows = self.buckets[(region_id, bucket)] = DeliveryWindows()
+        for begin, end in windows:
+            delivery_windows.add(begin, end, order_id)
+
+    def _remove(self, order_id: int):
+        entry = self.orders.pop(order_id, None)
+        if entry is None:
+            return
+        region_id, weight, windows = entry
+        delivery_windows = self.buckets[(region_id, weight_bucket(weight))]
+        for begin, end in windows:
+            delivery_windows.remove(begin, end, order_id)
+
+    def _remove_all(self, order_ids: Iterable[int]):
+        for order_id in order_ids:
+            self._remove(order_id)
+
+    def add(self, order_id: int, region_id: int, weight: float, windows: List[Tuple[int, int]]):
+        with self.lock:
+            if self.built:
+                self._add(order_id, region_id, float(weight), windows)
+            if self.journal is not None:
+                self.journal.append((self._add, (order_id, region_id, float(weight), windows)))
+
+    def remove(self, order_ids: Iterable[int]):
+        order_ids = list(order_ids)
+        with self.lock:
+            if self.built:
+                self._remove_all(order_ids)
+            if self.journal is not None:
+                self.journal.append((self._remove_all, (order_ids,)))
+
+    def match(self, regions: Iterable[int], max_weight: float, working_hours: List[Tuple[int, int]]):
+        found = set()
+        with self.lock:
+            for region_id in regions:
+                for bucket in range(weight_bucket(max_weight) + 1):
+                    delivery_windows = self.buckets.get((region_id, bucket))
+                    if delivery_windows is None:
+                        continue
+                    for begin, end in working_hours:
+                        delivery_windows.stab(begin, end, found)
+        return found
+
+    def comparisons(self, couriers: Iterable[candidates.CourierSpec]):
+        # Window comparisons matching these couriers would take, see candidates
+        total = 0
+        with self.lock:
+            for _, regions, max_weight, working_hours in couriers:
+                for region_id in set(regions):
+                    for bucket in range(weight_bucket(max_weight) + 1):
+                        delivery_windows = self.buckets.get((region_id, bucket))
+                        if delivery_windows is not None:
+                            total += len(delivery_windows.windows) * len(working_hours)
+        return total
+
+    def weights(self, order_ids: Iterable[int]):
+        # Orders removed since they were matched are left out
+        with self.lock:
+            return {
+                order_id: self.orders[order_id][1] for order_id in order_ids if order_id in self.orders
+            }
+
+    def windows(self):
+        # Snapshot for candidates.match_all
+        with self.lock:
+            return candidates.OrderWindows.from_orders(self.orders, WEIGHT_BUCKETS)
+
+    def rebuild(self, db: Session):
+        # The db is read without holding the lock, so matching (and, in async
+        # mode, other coroutines on the same thread) never waits on the query
+        with self.lock:
+            if self.journal is not None:
+                return False
+            self.journal = []
+        loaded_at = time.monotonic()
+        try:
+            orders = load_pending_orders(db)
+        except Exception:
+            with self.lock:
+                self.journal = None
+            raise
+
+        with self.lock:
+            self.buckets = {}
+            self.orders = {}
+            for order_id, (region_id, weight, windows) in orders.items():
+                self._add(order_id, region_id, weight, windows)
+            for mutation, args in self.journal:
+                mutation(*args)
+            self.journal = None
+            self.built = True
+            self.loaded_at = loaded_at
+        return True
+
+    def expired(self):
+        return ORDER_INDEX_TTL > 0 and self.loaded_at is not None \
+            and time.monotonic() - self.loaded_at > ORDER_INDEX_TTL
+
+    @classmethod
+    def snapshot(cls, db: Session, regions: Iterable[int] = None):
+        # Detached index over the pending orders of some (or all) regions, for callers
+        # that have no shared index to read from
+        index = cls()
+        for order_id, (region_id, weight, windows) in load_pending_orders(db, regions).items():
+            index._add(order_id, region_id, weight, windows)
+        index.built = True
+        return index
+
+
+def load_pending_orders(db: Session, regions: Iterable[int] = None):
+    query = db.query(
+        models.Order.id,
+        models.Order.region_id,
+        models.Order.weight,
+        models.OrderDeliveryHours.begin,
+        models.OrderDeliveryHours.end
+    ) \
+        .join(models.OrderDeliveryHours, models.OrderDeliveryHours.order_id == models.Order.id) \
+        .filter(models.Order.courier_id == -1)
+    if regions is not None:
+        query = query.filter(models.Order.region_id.in_(list(regions)))
+
+    orders = {}
+    for order_id, region_id, weight, begin, end in query:
+        if order_id not in orders:
+            orders[order_id] = (region_id, float(weight), [])
+        orders[order_id][2].append((begin, end))
+    return orders
+
+
+# One index per engine, so sessions bound to different databases never share state
+_indexes = WeakKeyDictionary()
+_indexes_lock = threading.Lock()
+
+
+def _index_for(db: Session):
+    bind = db.get_bind()
+    with _indexes_lock:
+        index = _indexes.get(bind)
+        if index is None:
+            index = _indexes[bind] = PendingOrderIndex()
+    return index
+
+
+def get_index(db: Session):
+    if not ORDER_INDEX_ENABLED:
+        return None
+    index = _index_for(db)
+    if not index.built or index.expired():
+        # An expired index keeps answering other callers while one reloads it
+        index.rebuild(db)
+    # None while another caller is still building it: match in SQL meanwhile
+    return index if index.built else None
+
+
+def peek_index(db: Session):
+    # Mutations only need to reach an index that has already been built;
+    # an unbuilt one reads the committed state when it is first used
+    if not ORDER_INDEX_ENABLED:
+        return None
+    return _index_for(db)
@@ -1,8 +1,15 @@
+import re
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 from pydantic import BaseModel, validator
 
+HOURS_RE = re.compile(r"(?:[01]\d|2[0-3]):[0-5]\d-(?:[01]\d|2[0-3]):[0-5]\d")
+
+
+def is_valid_hours(hours):
+    return isinstance(hours, str) and HOURS_RE.fullmatch(hours) is not None
+
 
 class CourierRegion(BaseModel):
     id: int
@@ -31,6 +38,12 @@ class CourierDto(BaseModel):
             raise ValueError
         return courier_type
 
+    @validator('working_hours', each_item=True)
+    def invalid_working_hours(cls, w_h):
+        if not is_valid_hours(w_h):
+            raise ValueError
+        return w_h
+
 
 class Courier(CourierDto):
     rating: float
@@ -58,6 +71,12 @@ class OrderDto(BaseModel):
             raise ValueError
         return w
 
+    @validator('delivery_hours', each_item=True)
+    def invalid_delivery_hours(cls, d_h):
+        if not is_valid_hours(d_h):
+            raise ValueError
+        return d_h
+
     # @validator('region')
     # def invalid_weight(cls, w):
     #     if isinstance(w, int):
@@ -71,3 +90,11 @@ class Order(OrderDto):
 
     class Config:
         orm_mode = True
+
+
+class OrderRecord(OrderDto):
+    status: str
+    courier_id: Optional[int]
+    courier_type: Optional[str]
+    assign_time: Optional[datetime]
+    complete_time: Optional[datetime]
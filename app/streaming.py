@@ -0,0 +1,103 @@
+import asyncio
+import json
+import os
+from typing import AsyncIterator
+
+from pydantic import ValidationError
+from starlette.responses import StreamingResponse
+
+from . import validation
+
+# Orders written per transaction by the streaming import
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "1000"))
+# A longer line is rejected without being buffered whole
+MAX_LINE_BYTES = int(os.getenv("IMPORT_MAX_LINE_BYTES", str(64 * 1024)))
+# Rejections listed in the import summary, the rest are only counted
+MAX_REPORTED_REJECTIONS = 1000
+
+# Records per keyset page of the list endpoints
+LIST_PAGE_SIZE = int(os.getenv("LIST_PAGE_SIZE", "500"))
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+TOO_LONG = object()
+
+
+async def ndjson_lines(chunks: AsyncIterator[bytes], max_line_bytes: int = MAX_LINE_BYTES):
+    # Yields the non-empty lines of a byte stream, or TOO_LONG in place of a
+    # line over the limit. Only the current chunk and one partial line are
+    # held in memory.
+    buffer = b""
+    skipping = False
+    async for chunk in chunks:
+        lines = (buffer + chunk).split(b"\n")
+        buffer = lines.pop()
+        for line in lines:
+            if skipping:
+                # The tail of a line already reported as too long
+                skipping = False
+            elif line.strip():
+                yield line if len(line) <= max_line_bytes else TOO_LONG
+        if skipping:
+            buffer = b""
+        elif len(buffer) > max_line_bytes:
+            skipping = True
+            buffer = b""
+            yield TOO_LONG
+    if not skipping and buffer.strip():
+        yield buffer
+
+
+def parse_order(line):
+    # Returns (order, order_id, None) or (None, order_id if known, reason)
+    if line is TOO_LONG:
+        return None, None, "line too long"
+    try:
+        record = json.loads(line)
+    except ValueError:
+        return None, None, "invalid json"
+    if not isinstance(record, dict):
+        return None, None, "not an object"
+    try:
+        order = validation.parse_order(record)
+    except ValidationError as e:
+        fields = sorted({str(error["loc"][0]) for error in e.errors()})
+        return None, record.get("order_id"), "invalid " + ", ".join(fields)
+    return order, order.order_id, None
+
+
+class ImportSummary:
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.rejections = []
+
+    def reject(self, record: int, order_id, reason: str):
+        # record counts the non-empty lines from 1
+        self.rejected += 1
+        if len(self.rejections) < MAX_REPORTED_REJECTIONS:
+            self.rejections.append({"record": record, "id": order_id, "reason": reason})
+
+    def as_dict(self):
+        # Duplicates are only found when their batch is written, after later records
+        rejections = sorted(self.rejections, key=lambda rejection: rejection["record"])
+        return {"accepted": self.accepted, "rejected": self.rejected, "rejections": rejections}
+
+
+class NDJSONResponse(StreamingResponse):
+    media_type = NDJSON_MEDIA_TYPE
+
+    async def __call__(self, scope, receive, send):
+        # Streams until done or the client disconnects. Starlette's own race
+        # hands asyncio.wait bare coroutines, which newer Pythons refuse.
+        tasks = {
+            asyncio.ensure_future(self.stream_response(send)),
+            asyncio.ensure_future(self.listen_for_disconnect(receive))
+        }
+        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+        for task in pending:
+            task.cancel()
+        for task in done:
+            task.result()
+        if self.background is not None:
+            await self.background()
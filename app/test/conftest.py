@@ -0,0 +1,62 @@
+from contextlib import contextmanager
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, make_engine
+from app.main import app, get_db
+
+
+@pytest.fixture
+def db_engine(tmp_path):
+    engine = make_engine("sqlite:///" + str(tmp_path / "test.db"))
+    Base.metadata.create_all(bind=engine)
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def session_local(db_engine):
+    return sessionmaker(autocommit=False, autoflush=False, bind=db_engine)
+
+
+@pytest.fixture
+def client(session_local):
+    def override_get_db():
+        db = session_local()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    previous = app.dependency_overrides.get(get_db)
+    app.dependency_overrides[get_db] = override_get_db
+    yield TestClient(app)
+    if previous is None:
+        del app.dependency_overrides[get_db]
+    else:
+        app.dependency_overrides[get_db] = previous
+
+
+@pytest.fixture
+def query_budget(db_engine):
+    # with query_budget(n): fails when the block runs more than n statements
+    @contextmanager
+    def budget(limit: int):
+        statements = []
+
+        def count(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db_engine, "before_cursor_execute", count)
+        try:
+            yield statements
+        finally:
+            event.remove(db_engine, "before_cursor_execute", count)
+        assert len(statements) <= limit, "%d statements over a budget of %d:\n%s" % (
+            len(statements), limit, "\n".join(statements)
+        )
+
+    return budget
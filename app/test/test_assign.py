@@ -0,0 +1,121 @@
+def create_courier(client, courier_id, courier_type, regions, working_hours):
+    response = client.post("/couriers", json={"data": [{
+        "courier_id": courier_id,
+        "courier_type": courier_type,
+        "regions": regions,
+        "working_hours": working_hours
+    }]})
+    assert response.status_code == 201
+
+
+def create_orders(client, orders):
+    response = client.post("/orders", json={"data": [
+        {"order_id": order_id, "weight": weight, "region": region, "delivery_hours": delivery_hours}
+        for order_id, weight, region, delivery_hours in orders
+    ]})
+    assert response.status_code == 201
+
+
+def assign(client, courier_id):
+    response = client.post("/orders/assign", json={"courier_id": courier_id})
+    assert response.status_code == 200
+    return sorted(order["id"] for order in response.json()["orders"])
+
+
+def test_assign_takes_every_matching_order_in_region(client):
+    create_courier(client, 1, "foot", [1, 2], ["09:00-12:00", "18:00-20:00"])
+    create_orders(client, [
+        (1, 1.0, 1, ["10:00-11:00"]),
+        (2, 2.0, 1, ["08:00-09:30"]),
+        (3, 3.0, 2, ["07:00-08:00", "19:30-21:00"]),
+        (4, 4.0, 1, ["12:00-18:00"]),
+        (5, 11.0, 1, ["10:00-11:00"]),
+        (6, 1.0, 3, ["10:00-11:00"])
+    ])
+    assert assign(client, 1) == [1, 2, 3]
+    assert assign(client, 1) == [1, 2, 3]
+
+
+def test_assign_skips_orders_taken_by_other_courier(client):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_courier(client, 2, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [1]
+    assert assign(client, 2) == []
+
+
+def test_patch_working_hours_releases_orders_outside_new_hours(client):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_orders(client, [
+        (1, 1.0, 1, ["10:00-11:00"]),
+        (2, 1.0, 1, ["12:30-14:00"])
+    ])
+    assert assign(client, 1) == [1, 2]
+    response = client.patch("/couriers/1", json={"working_hours": ["12:00-13:00"]})
+    assert response.status_code == 200
+    assert assign(client, 1) == [2]
+
+
+def test_patch_rejects_malformed_working_hours(client):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    response = client.patch("/couriers/1", json={"working_hours": ["9-18"]})
+    assert response.status_code == 400
+
+
+def assign_batch(client, body):
+    response = client.post("/orders/assign/batch", json=body)
+    assert response.status_code == 200
+    return {
+        courier["courier_id"]: sorted(order["id"] for order in courier["orders"])
+        for courier in response.json()["couriers"]
+    }
+
+
+def test_batch_assign_gives_each_order_to_one_courier(client):
+    create_courier(client, 1, "foot", [1], ["09:00-12:00"])
+    create_courier(client, 2, "car", [1, 2], ["09:00-18:00"])
+    create_courier(client, 3, "bike", [3], ["09:00-18:00"])
+    create_orders(client, [
+        (1, 1.0, 1, ["10:00-11:00"]),
+        (2, 20.0, 1, ["10:00-11:00"]),
+        (3, 1.0, 2, ["13:00-14:00"]),
+        (4, 1.0, 1, ["13:00-14:00"])
+    ])
+    response = client.post("/orders/assign/batch", json={"courier_ids": [1, 2, 3, 4]})
+    assert response.status_code == 200
+    body = response.json()
+    assert body["not_found"] == [4]
+    assert body["solve_time"] >= 0
+    assert [courier["courier_id"] for courier in body["couriers"]] == [1, 2, 3]
+    assert "assign_time" not in body["couriers"][2]
+    assert assign_batch(client, {"courier_ids": [1, 2, 3]}) == {1: [1], 2: [2, 3, 4], 3: []}
+    assert assign(client, 2) == [2, 3, 4]
+
+
+def test_batch_assign_all_idle_skips_busy_couriers(client):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_courier(client, 2, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [1]
+    create_orders(client, [(2, 1.0, 1, ["10:00-11:00"])])
+    assert assign_batch(client, {"all_idle": True}) == {2: [2]}
+    assert assign(client, 1) == [1]
+
+
+def test_batch_assign_rejects_malformed_request(client):
+    for body in ({}, {"courier_ids": [1], "all_idle": True}, {"courier_ids": ["1"]}, {"courier_id": 1}):
+        response = client.post("/orders/assign/batch", json=body)
+        assert response.status_code == 400
+
+
+def test_assign_fills_courier_up_to_capacity(client):
+    create_courier(client, 1, "foot", [1], ["09:00-18:00"])
+    create_orders(client, [
+        (1, 6.0, 1, ["10:00-11:00"]),
+        (2, 3.0, 1, ["10:00-11:00"]),
+        (3, 4.0, 1, ["10:00-11:00"])
+    ])
+    assert assign(client, 1) == [2, 3]
+    create_orders(client, [(4, 3.0, 1, ["10:00-11:00"]), (5, 2.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [2, 3, 5]
+    assert assign_batch(client, {"courier_ids": [1]}) == {1: [2, 3, 5]}
@@ -0,0 +1,41 @@
+import itertools
+import random
+
+import pytest
+
+from app import assignment
+
+
+def best_count(weights, capacity):
+    for size in range(len(weights), 0, -1):
+        if any(sum(c) <= capacity + assignment.CAPACITY_EPSILON for c in itertools.combinations(weights, size)):
+            return size
+    return 0
+
+
+def test_density_packer_respects_capacity():
+    packer = assignment.get_strategy("density")
+    assert packer.select([1, 2, 3, 4], [6.0, 3.0, 4.0, 0.5], 10) == [2, 3, 4]
+    assert packer.select([1, 2], [5.0, 5.0], 10) == [1, 2]
+    assert packer.select([1, 2], [5.0, 5.0], 0) == []
+    assert packer.select([], [], 10) == []
+
+
+def test_density_packer_fits_the_most_orders():
+    rnd = random.Random(0)
+    packer = assignment.get_strategy("density")
+    for _ in range(200):
+        weights = [round(rnd.uniform(0.01, 15), 2) for _ in range(rnd.randint(0, 8))]
+        capacity = rnd.choice([10, 15, 50])
+        selected = packer.select(list(range(len(weights))), weights, capacity)
+        assert sum(weights[i] for i in selected) <= capacity + assignment.CAPACITY_EPSILON
+        assert len(selected) == best_count(weights, capacity)
+
+
+def test_take_all_ignores_capacity():
+    assert assignment.get_strategy("all").select([3, 1], [40.0, 40.0], 10) == [1, 3]
+
+
+def test_unknown_strategy():
+    with pytest.raises(ValueError):
+        assignment.get_strategy("nope")
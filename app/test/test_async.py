@@ -0,0 +1,67 @@
+import asyncio
+
+import pytest
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from app.database import async_database_url, make_engine
+from app.main import app, get_db
+from app.test.test_assign import assign_batch, create_courier, create_orders
+
+
+def test_async_database_url_picks_async_driver():
+    assert async_database_url("sqlite:///./app.db") == "sqlite+aiosqlite:///./app.db"
+    assert async_database_url("postgresql+psycopg2://u:p@db/candy") == "postgresql+asyncpg://u:p@db/candy"
+    with pytest.raises(ValueError):
+        async_database_url("mysql://u:p@db/candy")
+
+
+def test_endpoints_run_on_async_sessions(db_engine, client):
+    async_engine = make_engine(str(db_engine.url), name="async", use_async=True)
+    async_session_local = sessionmaker(async_engine, class_=AsyncSession, autoflush=False)
+
+    async def override_get_db():
+        async with async_session_local() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    assert client.post("/couriers", json={"data": [{
+        "courier_id": 1, "courier_type": "car", "regions": [1], "working_hours": ["09:00-18:00"]
+    }]}).status_code == 201
+    assert client.post("/orders", json={"data": [{
+        "order_id": 1, "weight": 3, "region": 1, "delivery_hours": ["10:00-11:00"]
+    }]}).status_code == 201
+    assert client.post("/orders/assign", json={"courier_id": 1}).json()["orders"] == [{"id": 1}]
+    assert client.post("/orders/complete", json={
+        "courier_id": 1, "order_id": 1, "complete_time": "2100-01-01T00:00:00"
+    }).json() == {"order_id": 1}
+    assert client.patch("/couriers/1", json={"regions": [2]}).status_code == 200
+    assert client.get("/couriers/1").json()["regions"] == [2]
+
+
+def test_batch_assign_matches_off_the_event_loop(db_engine, client, monkeypatch):
+    async_engine = make_engine(str(db_engine.url), name="async", use_async=True)
+    async_session_local = sessionmaker(async_engine, class_=AsyncSession, autoflush=False)
+
+    async def override_get_db():
+        async with async_session_local() as db:
+            yield db
+
+    app.dependency_overrides[get_db] = override_get_db
+    select_batch = crud.select_batch
+    on_loop = []
+
+    def recording_select_batch(*args):
+        try:
+            asyncio.get_running_loop()
+            on_loop.append(True)
+        except RuntimeError:
+            on_loop.append(False)
+        return select_batch(*args)
+
+    monkeypatch.setattr(crud, "select_batch", recording_select_batch)
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 3.0, 1, ["10:00-11:00"])])
+    assert assign_batch(client, {"courier_ids": [1]}) == {1: [1]}
+    assert on_loop == [False]
@@ -0,0 +1,131 @@
+import time
+
+from app import crud
+from app.cache import LRUCache, assignments, courier_profiles
+from app.test.test_assign import assign, create_courier, create_orders
+
+
+def test_lru_cache_evicts_least_recently_used():
+    lru = LRUCache(max_size=2, ttl=60)
+    lru.set("a", 1)
+    lru.set("b", 2)
+    assert lru.get("a") == 1
+    lru.set("c", 3)
+    assert lru.get("b") is None
+    assert lru.get("a") == 1
+    assert lru.get("c") == 3
+    assert (lru.hits, lru.misses, lru.evictions) == (3, 1, 1)
+
+
+def test_lru_cache_expires_entries():
+    lru = LRUCache(max_size=2, ttl=0.01)
+    lru.set("a", 1)
+    time.sleep(0.02)
+    assert lru.get("a") is None
+    assert lru.expirations == 1
+
+
+def test_lru_cache_refuses_a_value_read_before_an_invalidation():
+    lru = LRUCache(max_size=2, ttl=60)
+    stamp = lru.stamp("a")
+    lru.invalidate("a")
+    lru.set("a", "stale", stamp)
+    assert lru.get("a") is None
+    lru.set("a", "fresh", lru.stamp("a"))
+    assert lru.get("a") == "fresh"
+
+
+def test_lru_cache_forgets_invalidations_after_the_ttl():
+    lru = LRUCache(max_size=2, ttl=0.01)
+    stamp = lru.stamp("a")
+    for key in range(100):
+        lru.invalidate(key)
+    time.sleep(0.02)
+    lru.invalidate("b")
+    assert list(lru.invalidated.touched) == ["b"]
+
+    # The read of "a" may have raced a forgotten invalidation
+    lru.set("a", "stale", stamp)
+    assert lru.get("a") is None
+    lru.set("a", "fresh", lru.stamp("a"))
+    assert lru.get("a") == "fresh"
+
+
+def test_courier_profile_read_racing_a_patch_is_not_cached(client, monkeypatch):
+    create_courier(client, 1, "foot", [1], ["09:00-18:00"])
+    get_courier_by_id = crud.get_courier_by_id
+
+    def read_then_patch(db, courier_id):
+        courier = get_courier_by_id(db, courier_id)
+        # Committed and invalidated after the read, before the profile is cached
+        monkeypatch.setattr(crud, "get_courier_by_id", get_courier_by_id)
+        assert client.patch("/couriers/1", json={"regions": [2]}).status_code == 200
+        return courier
+
+    monkeypatch.setattr(crud, "get_courier_by_id", read_then_patch)
+    assert client.get("/couriers/1").json()["regions"] == [1]
+    assert client.get("/couriers/1").json()["regions"] == [2]
+
+
+def test_courier_profile_is_cached_and_invalidated_by_patch(client):
+    response = client.post("/couriers", json={"data": [{
+        "courier_id": 1, "courier_type": "foot", "regions": [1], "working_hours": ["09:00-18:00"]
+    }]})
+    assert response.status_code == 201
+
+    hits = courier_profiles.hits
+    assert client.get("/couriers/1").json()["regions"] == [1]
+    assert client.get("/couriers/1").json()["regions"] == [1]
+    assert courier_profiles.hits == hits + 1
+
+    assert client.patch("/couriers/1", json={"regions": [2]}).status_code == 200
+    assert client.get("/couriers/1").json()["regions"] == [2]
+
+    metrics = client.get("/metrics").text
+    assert "courier_cache_hits_total" in metrics
+    assert "courier_cache_evictions_total" in metrics
+
+
+def test_assign_poll_is_answered_from_snapshot_until_invalidated(client, query_budget):
+    create_courier(client, 1, "foot", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 6.0, 1, ["10:00-11:00"]), (2, 6.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [1]
+    with query_budget(0):
+        assert assign(client, 1) == [1]
+
+    # Another region does not concern the courier, its own region does
+    create_orders(client, [(3, 1.0, 2, ["10:00-11:00"])])
+    with query_budget(0):
+        assert assign(client, 1) == [1]
+    create_orders(client, [(4, 1.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [1, 4]
+
+    # A completion frees capacity for order 2
+    response = client.post("/orders/complete", json={
+        "courier_id": 1, "order_id": 1, "complete_time": "2021-01-10T10:33:01.42Z"
+    })
+    assert response.status_code == 200
+    assert assign(client, 1) == [2, 4]
+
+    assert client.patch("/couriers/1", json={"regions": [2]}).status_code == 200
+    assert assign(client, 1) == [3]
+
+
+def test_assignment_snapshot_computed_across_a_write_is_not_kept(session_local):
+    db = session_local()
+    try:
+        stamp = assignments.stamp(db)
+        # An order lands in region 1 while the assignment is being computed
+        assignments.touch_regions(db, [1])
+        assignments.set(db, 1, [1], stamp, ([], None))
+        assert assignments.get(db, 1) is None
+
+        stamp = assignments.stamp(db)
+        assignments.set(db, 1, [1], stamp, ([5], "now"))
+        assert assignments.get(db, 1) == ([5], "now")
+        assignments.touch_regions(db, [2])
+        assert assignments.get(db, 1) == ([5], "now")
+        assignments.touch_courier(db, 1)
+        assert assignments.get(db, 1) is None
+    finally:
+        db.close()
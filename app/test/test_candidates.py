@@ -0,0 +1,88 @@
+import random
+
+import pytest
+
+from app import candidates
+from app.order_index import WEIGHT_BUCKETS, PendingOrderIndex
+from app.test.test_assign import create_courier, create_orders
+from app.test.test_order_index import brute_force, random_window
+
+
+def random_orders(rnd, count):
+    return {
+        order_id: (rnd.randint(1, 5), round(rnd.uniform(0.01, 50.0), 2),
+                   [random_window(rnd) for _ in range(rnd.randint(1, 3))])
+        for order_id in range(1, count + 1)
+    }
+
+
+def random_couriers(rnd, count):
+    return [
+        (courier_id, rnd.sample(range(1, 7), rnd.randint(1, 3)), rnd.choice([10.0, 15.0, 50.0]),
+         [random_window(rnd) for _ in range(rnd.randint(1, 3))])
+        for courier_id in range(1, count + 1)
+    ]
+
+
+def test_match_couriers_agrees_with_brute_force():
+    rnd = random.Random(11)
+    orders = random_orders(rnd, 1000)
+    couriers = random_couriers(rnd, 100)
+    matched = candidates.match_couriers(candidates.OrderWindows.from_orders(orders, WEIGHT_BUCKETS), couriers)
+    for courier_id, regions, max_weight, working_hours in couriers:
+        assert matched[courier_id] == sorted(brute_force(orders, regions, max_weight, working_hours))
+
+
+def test_match_couriers_on_no_orders():
+    windows = candidates.OrderWindows.from_orders({}, WEIGHT_BUCKETS)
+    assert candidates.match_couriers(windows, [(1, [1], 10.0, [(0, 60)])]) == {1: []}
+
+
+def test_match_all_in_worker_processes_agrees_with_one_process():
+    rnd = random.Random(12)
+    index = PendingOrderIndex()
+    index.built = True
+    for order_id, order in random_orders(rnd, 500).items():
+        index.add(order_id, *order)
+    couriers = random_couriers(rnd, 30)
+    windows = index.windows()
+    try:
+        for workers in (2, 3):
+            assert candidates.match_all(windows, couriers, workers=workers) \
+                == candidates.match_couriers(windows, couriers)
+    finally:
+        candidates.shutdown()
+
+
+def test_partition_sends_each_region_to_one_worker():
+    rnd = random.Random(13)
+    windows = candidates.OrderWindows.from_orders(random_orders(rnd, 300), WEIGHT_BUCKETS)
+    partition = candidates.partition_regions(windows, random_couriers(rnd, 20), 3)
+    assert len(partition) == 3
+    assert sorted(region_id for regions in partition for region_id in regions) == [1, 2, 3, 4, 5]
+
+    subset = windows.subset(partition[0])
+    assert set(subset.groups) == set(partition[0])
+    assert len(subset.order_id) == sum(hi - lo for region_id in partition[0]
+                                       for _, lo, hi, _ in windows.groups[region_id])
+
+
+@pytest.mark.parametrize("threshold, workers", [(10 ** 12, 0), (0, 1), (0, 2)])
+def test_batch_assign_is_the_same_whichever_way_it_matches(client, monkeypatch, threshold, workers):
+    monkeypatch.setattr(candidates, "PARALLEL_MATCH_THRESHOLD", threshold)
+    monkeypatch.setattr(candidates, "MATCH_WORKERS", workers)
+    create_courier(client, 1, "foot", [1], ["09:00-12:00"])
+    create_courier(client, 2, "car", [1, 2], ["09:00-18:00"])
+    create_orders(client, [
+        (1, 1.0, 1, ["10:00-11:00"]),
+        (2, 20.0, 1, ["10:00-11:00"]),
+        (3, 1.0, 2, ["13:00-14:00"]),
+        (4, 1.0, 1, ["13:00-14:00"])
+    ])
+    try:
+        response = client.post("/orders/assign/batch", json={"courier_ids": [1, 2]})
+    finally:
+        candidates.shutdown()
+    assert response.status_code == 200
+    assert {courier["courier_id"]: [order["id"] for order in courier["orders"]]
+            for courier in response.json()["couriers"]} == {1: [1], 2: [2, 3, 4]}
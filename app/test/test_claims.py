@@ -0,0 +1,79 @@
+import threading
+from datetime import datetime
+
+from sqlalchemy import event
+
+from app import crud, models
+from app.test.test_assign import create_courier, create_orders
+
+THREADS = 8
+
+
+def test_claim_skips_orders_taken_by_another_courier(client, session_local):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_courier(client, 2, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"]), (2, 1.0, 1, ["10:00-11:00"])])
+    db = session_local()
+    try:
+        assert crud.claim_orders(db, {1: (1, "car")}, datetime.now()) == [1]
+        db.commit()
+        assert crud.claim_orders(db, {1: (2, "car"), 2: (2, "car")}, datetime.now()) == [2]
+        db.commit()
+    finally:
+        db.close()
+
+
+def test_concurrent_assign_never_hands_an_order_to_two_couriers(client, session_local):
+    for courier_id in range(1, THREADS + 1):
+        create_courier(client, courier_id, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(order_id, 5.0, 1, ["10:00-11:00"]) for order_id in range(1, 101)])
+
+    barrier = threading.Barrier(THREADS)
+    results = {}
+    errors = []
+
+    def assign(courier_id):
+        db = session_local()
+        try:
+            courier = crud.get_courier_by_id(db, courier_id)
+            barrier.wait()
+            orders_id, _ = crud.assign_order(db, courier)
+            results[courier_id] = set(orders_id)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            db.close()
+
+    threads = [threading.Thread(target=assign, args=(courier_id,)) for courier_id in range(1, THREADS + 1)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    handed_out = [order_id for orders_id in results.values() for order_id in orders_id]
+    assert len(handed_out) == len(set(handed_out))
+    assert all(len(orders_id) <= 10 for orders_id in results.values())
+
+    db = session_local()
+    try:
+        for courier_id, orders_id in results.items():
+            owned = db.query(models.Order.id).filter(models.Order.courier_id == courier_id).all()
+            assert {order_id for order_id, in owned} == orders_id
+    finally:
+        db.close()
+
+
+def test_claim_stays_under_the_sqlite_parameter_limit(client, session_local, db_engine):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(order_id, 0.01, 1, ["10:00-11:00"]) for order_id in range(1, 1001)])
+    parameters = []
+    event.listen(db_engine, "before_cursor_execute", lambda *args: parameters.append(len(args[3])))
+    db = session_local()
+    try:
+        claimed = crud.claim_orders(db, {order_id: (1, "car") for order_id in range(1, 1001)}, datetime.now())
+        db.commit()
+    finally:
+        db.close()
+    assert sorted(claimed) == list(range(1, 1001))
+    assert max(parameters) <= crud.SQLITE_MAX_VARIABLES
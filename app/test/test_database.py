@@ -0,0 +1,33 @@
+from sqlalchemy import text
+
+from app import metrics
+from app.database import make_engine, pool_settings
+
+
+def test_pool_settings_use_dialect_defaults_and_environment(monkeypatch):
+    assert pool_settings("postgresql")["pool_pre_ping"] is True
+    assert pool_settings("sqlite")["statement_timeout"] == 0
+    monkeypatch.setenv("DB_POOL_SIZE", "3")
+    monkeypatch.setenv("DB_POOL_PRE_PING", "false")
+    settings = pool_settings("postgresql")
+    assert settings["pool_size"] == 3
+    assert settings["pool_pre_ping"] is False
+
+
+def test_sqlite_engine_sets_pragmas(tmp_path, monkeypatch):
+    monkeypatch.setenv("SQLITE_CACHE_SIZE", "-1000")
+    engine = make_engine("sqlite:///" + str(tmp_path / "pragmas.db"))
+    with engine.connect() as connection:
+        assert connection.execute(text("PRAGMA journal_mode")).scalar() == "wal"
+        assert connection.execute(text("PRAGMA synchronous")).scalar() == 1
+        assert connection.execute(text("PRAGMA cache_size")).scalar() == -1000
+    assert engine.pool.size() == 5
+    engine.dispose()
+
+
+def test_pool_metrics_are_exported(db_engine):
+    with db_engine.connect() as connection:
+        connection.execute(text("SELECT 1"))
+    rendered = metrics.render()
+    assert 'db_pool_utilisation{engine="sync"}' in rendered
+    assert "db_pool_checkout_wait_seconds_count" in rendered
@@ -0,0 +1,48 @@
+import logging
+
+from app import crud, instrumentation
+from app.test.test_assign import create_courier
+
+
+def observed(histogram, method, route):
+    # (count, sum) of one series, zeros when nothing was observed yet
+    series = histogram.series.get((method, route))
+    return (0, 0.0) if series is None else (series[2], series[1])
+
+
+def test_request_metrics_count_statements_and_rows_per_route(client):
+    for courier_id in range(1, 4):
+        create_courier(client, courier_id, "foot", [1], ["09:00-18:00"])
+    route = ("GET", "/couriers")
+    count, rows = observed(instrumentation.REQUEST_ROWS, *route)
+    _, statements = observed(instrumentation.REQUEST_STATEMENTS, *route)
+
+    assert client.get("/couriers").status_code == 200
+
+    # The listing is streamed, its queries run after the endpoint returned
+    assert observed(instrumentation.REQUEST_ROWS, *route)[0] == count + 1
+    assert observed(instrumentation.REQUEST_ROWS, *route)[1] >= rows + 3
+    assert observed(instrumentation.REQUEST_STATEMENTS, *route)[1] > statements
+    assert observed(instrumentation.REQUEST_DB_SECONDS, *route)[1] > 0
+
+
+def test_request_metrics_use_the_route_template(client):
+    create_courier(client, 7, "foot", [1], ["09:00-18:00"])
+    count, _ = observed(instrumentation.REQUEST_SECONDS, "GET", "/couriers/{courier_id}")
+    assert client.get("/couriers/7").status_code == 200
+    assert observed(instrumentation.REQUEST_SECONDS, "GET", "/couriers/{courier_id}")[0] == count + 1
+    assert ("GET", "/couriers/7") not in instrumentation.REQUEST_SECONDS.series
+
+    body = client.get("/metrics").text
+    assert 'http_request_db_statements_count{method="GET",route="/couriers/{courier_id}"}' in body
+
+
+def test_slow_query_log_names_the_crud_function(session_local, monkeypatch, caplog):
+    monkeypatch.setattr(instrumentation, "SLOW_QUERY_SECONDS", 1e-9)
+    db = session_local()
+    try:
+        with caplog.at_level(logging.WARNING, logger=instrumentation.__name__):
+            crud.get_idle_courier_ids(db)
+    finally:
+        db.close()
+    assert any("app.crud.get_idle_courier_ids" in record.getMessage() for record in caplog.records)
@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from app import streaming
+from app.test.test_assign import assign, create_courier, create_orders
+
+
+def ndjson(response):
+    assert response.status_code == 200
+    assert response.headers["content-type"] == streaming.NDJSON_MEDIA_TYPE
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+@pytest.fixture
+def listed(client, monkeypatch):
+    monkeypatch.setattr(streaming, "LIST_PAGE_SIZE", 2)
+    create_courier(client, 1, "foot", [1, 2], ["09:00-18:00"])
+    create_courier(client, 2, "car", [2], ["09:00-18:00"])
+    create_courier(client, 3, "car", [3], ["09:00-18:00"])
+    create_orders(client, [(order_id, 1.0, 1 + order_id % 2, ["10:00-11:00"]) for order_id in range(1, 8)])
+    assert assign(client, 1) == [1, 2, 3, 4, 5, 6, 7]
+    create_orders(client, [(order_id, 1.0, 3, ["19:00-20:00"]) for order_id in range(8, 11)])
+    for order_id in (1, 2):
+        response = client.post("/orders/complete", json={
+            "courier_id": 1, "order_id": order_id, "complete_time": "2021-01-10T10:33:01.42Z"
+        })
+        assert response.status_code == 200
+    return client
+
+
+def test_list_couriers_with_filters(listed):
+    couriers = ndjson(listed.get("/couriers"))
+    assert [courier["courier_id"] for courier in couriers] == [1, 2, 3]
+    assert couriers[0] == {
+        "courier_id": 1, "courier_type": "foot", "regions": [1, 2], "working_hours": ["09:00-18:00"],
+        "rating": couriers[0]["rating"], "earning": 2000
+    }
+    assert [c["courier_id"] for c in ndjson(listed.get("/couriers?type=car"))] == [2, 3]
+    assert [c["courier_id"] for c in ndjson(listed.get("/couriers?region=2"))] == [1, 2]
+    assert [c["courier_id"] for c in ndjson(listed.get("/couriers?after=1&limit=1"))] == [2]
+
+
+def test_list_orders_by_status(listed):
+    def ids(query):
+        return [order["order_id"] for order in ndjson(listed.get("/orders" + query))]
+
+    assert ids("") == list(range(1, 11))
+    assert ids("?status=pending") == [8, 9, 10]
+    assert ids("?status=assigned&courier_id=1") == [3, 4, 5, 6, 7]
+    assert ids("?status=assigned&region=2") == [3, 5, 7]
+    assert ids("?status=completed") == [1, 2]
+    assert ids("?type=foot&after=2&limit=3") == [3, 4, 5]
+
+    completed = ndjson(listed.get("/orders?status=completed&limit=1"))[0]
+    assert completed["status"] == "completed"
+    assert completed["courier_id"] == 1
+    assert completed["complete_time"].startswith("2021-01-10T10:33:01")
+    pending = ndjson(listed.get("/orders?status=pending&limit=1"))[0]
+    assert pending == {
+        "order_id": 8, "weight": 1.0, "region": 3, "delivery_hours": ["19:00-20:00"], "status": "pending",
+        "courier_id": None, "courier_type": None, "assign_time": None, "complete_time": None
+    }
+
+
+def test_list_orders_by_type_skips_released_orders(listed):
+    # Courier 1 no longer fits orders 3-7 and releases them
+    assert listed.patch("/couriers/1", json={"regions": [5]}).status_code == 200
+    foot = ndjson(listed.get("/orders?type=foot"))
+    assert [order["order_id"] for order in foot] == [1, 2]
+
+
+def test_list_rejects_unknown_filters(client):
+    assert client.get("/orders?status=lost").status_code == 400
+    assert client.get("/couriers?type=plane").status_code == 400
+    assert client.get("/orders?limit=0").status_code == 400
@@ -0,0 +1,104 @@
+import asyncio
+import itertools
+import random
+import threading
+
+from app import crud, main, matching
+from app.test.test_assign import assign, create_courier, create_orders
+
+
+def brute_force_matching_size(adjacency):
+    couriers = list(adjacency)
+    best = 0
+    for choice in itertools.product(*[[None] + adjacency[c] for c in couriers]):
+        orders = [order_id for order_id in choice if order_id is not None]
+        if len(orders) == len(set(orders)):
+            best = max(best, len(orders))
+    return best
+
+
+def test_max_matching_is_maximum():
+    rnd = random.Random(0)
+    for _ in range(300):
+        adjacency = {
+            courier_id: rnd.sample(range(6), rnd.randint(0, 3)) for courier_id in range(rnd.randint(1, 5))
+        }
+        matched = matching.max_matching(adjacency)
+        assert len(set(matched.values())) == len(matched)
+        assert all(order_id in adjacency[courier_id] for courier_id, order_id in matched.items())
+        assert len(matched) == brute_force_matching_size(adjacency)
+
+
+def test_solve_spreads_orders_within_capacity():
+    weights = {1: 1.0, 2: 2.0, 3: 9.0, 4: 5.0}
+    couriers = {
+        1: (10.0, [1, 2, 3, 4]),
+        2: (10.0, [1, 2]),
+        3: (4.0, [3, 4])
+    }
+    assignments, complete = matching.solve(couriers, weights, 10)
+    assert complete
+    assert sorted(assignments[2]) in ([1], [2])
+    assert assignments[3] == []
+    assert sorted(assignments[1] + assignments[2]) == [1, 2, 4]
+    assert sum(weights[order_id] for order_id in assignments[1]) <= 10
+
+
+def test_assign_reads_published_plan(client, session_local, monkeypatch):
+    monkeypatch.setattr(matching, "GLOBAL_MATCHING", True)
+    monkeypatch.setattr(main, "SessionLocal", session_local)
+    create_courier(client, 1, "car", [1, 2], ["09:00-18:00"])
+    create_courier(client, 2, "foot", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"]), (2, 20.0, 2, ["10:00-11:00"])])
+
+    plan = asyncio.run(main.compute_assignment_plan())
+    assert plan.assignments == {1: [2], 2: [1]}
+
+    create_orders(client, [(3, 1.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [2]
+    assert assign(client, 2) == [1]
+    create_courier(client, 3, "car", [1], ["09:00-18:00"])
+    assert assign(client, 3) == [3]
+
+
+def test_patch_takes_courier_out_of_the_plan(client, session_local, monkeypatch):
+    monkeypatch.setattr(matching, "GLOBAL_MATCHING", True)
+    monkeypatch.setattr(main, "SessionLocal", session_local)
+    create_courier(client, 1, "foot", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"])])
+    db = session_local()
+    try:
+        stale_plan = asyncio.run(main.compute_assignment_plan())
+        assert stale_plan.assignments == {1: [1]}
+
+        response = client.patch("/couriers/1", json={"regions": [5], "working_hours": ["20:00-21:00"]})
+        assert response.status_code == 200
+        assert matching.get_plan(db).orders_for(1) is None
+        assert assign(client, 1) == []
+
+        # A plan solved before the PATCH and published after it
+        matching.publish(db, matching.Plan({1: [1]}, True, 0))
+        assert assign(client, 1) == []
+    finally:
+        db.close()
+
+
+def test_server_solves_the_plan_off_the_event_loop(client, session_local, monkeypatch):
+    monkeypatch.setattr(main, "SessionLocal", session_local)
+    create_courier(client, 1, "foot", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"])])
+    solve = crud.solve_assignment_plan
+    solved_in = []
+
+    def recording_solve(*args):
+        solved_in.append(threading.get_ident())
+        return solve(*args)
+
+    monkeypatch.setattr(crud, "solve_assignment_plan", recording_solve)
+
+    async def compute():
+        return threading.get_ident(), await main.compute_assignment_plan()
+
+    loop_thread, plan = asyncio.run(compute())
+    assert plan.assignments == {1: [1]}
+    assert solved_in and solved_in[0] != loop_thread
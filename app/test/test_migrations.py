@@ -0,0 +1,34 @@
+from datetime import datetime
+
+from sqlalchemy import text
+
+from app import migrations, models
+
+
+def test_order_status_is_backfilled(db_engine):
+    orders = models.Order.__table__
+    with db_engine.begin() as connection:
+        connection.execute(models.Courier.__table__.insert(), {"courier_id": 1, "courier_type": "foot"})
+        connection.execute(orders.insert(), [
+            {"order_id": 1, "order_weight": 1, "order_region_id": 1, "order_courier_id": -1},
+            {"order_id": 2, "order_weight": 1, "order_region_id": 1, "order_courier_id": 1,
+             "assign_time": datetime(2021, 1, 10, 9)},
+            {"order_id": 3, "order_weight": 1, "order_region_id": 1, "order_courier_id": 1,
+             "assign_time": datetime(2021, 1, 10, 9)},
+        ])
+        connection.execute(models.CompletedCourierOrder.__table__.insert(), {
+            "courier_id": 1, "order_id": 3, "order_number": 1,
+            "complete_time": datetime(2021, 1, 10, 10), "lead_time": 3600, "order_region": 1
+        })
+        # Back to the schema of version 3
+        connection.execute(text("DROP INDEX ix_order_courier_status"))
+        connection.execute(text('ALTER TABLE "order" DROP COLUMN order_status'))
+        migrations.schema_version.create(connection)
+        connection.execute(migrations.schema_version.insert(), {"version": 3, "applied_at": datetime.now()})
+
+    assert migrations.upgrade(db_engine) == migrations.head() >= 4
+    with db_engine.connect() as connection:
+        statuses = connection.execute(text('SELECT order_id, order_status FROM "order" ORDER BY order_id')).fetchall()
+        indexes = connection.execute(text("PRAGMA index_list('order')")).fetchall()
+    assert [tuple(row) for row in statuses] == [(1, "pending"), (2, "assigned"), (3, "completed")]
+    assert "ix_order_courier_status" in {row[1] for row in indexes}
@@ -0,0 +1,75 @@
+import random
+
+from app import models, order_index
+from app.crud import intervals_overlap
+from app.order_index import PendingOrderIndex, weight_bucket
+
+
+def brute_force(orders, regions, max_weight, working_hours):
+    found = set()
+    for order_id, (region_id, weight, windows) in orders.items():
+        if region_id not in regions or weight > max_weight:
+            continue
+        for d_begin, d_end in windows:
+            for w_begin, w_end in working_hours:
+                if intervals_overlap(w_begin, w_end, d_begin, d_end):
+                    found.add(order_id)
+    return found
+
+
+def random_window(rnd):
+    begin = rnd.randrange(0, 24 * 60 - 1)
+    return begin, rnd.randrange(begin + 1, 24 * 60)
+
+
+def test_weight_bucket_matches_courier_limits():
+    assert weight_bucket(0.01) == 0
+    assert weight_bucket(10.0) == 0
+    assert weight_bucket(10.01) == 1
+    assert weight_bucket(15.0) == 1
+    assert weight_bucket(50.0) == 2
+
+
+def test_match_agrees_with_brute_force_after_mutations():
+    rnd = random.Random(7)
+    index = PendingOrderIndex()
+    index.built = True
+    orders = {}
+    for order_id in range(1, 2001):
+        orders[order_id] = (
+            rnd.randint(1, 5),
+            round(rnd.uniform(0.01, 50.0), 2),
+            [random_window(rnd) for _ in range(rnd.randint(1, 3))]
+        )
+        index.add(order_id, *orders[order_id])
+
+    removed = rnd.sample(sorted(orders), 500)
+    index.remove(removed)
+    for order_id in removed[:250]:
+        del orders[order_id]
+    for order_id in removed[250:]:
+        index.add(order_id, *orders[order_id])
+
+    for _ in range(200):
+        regions = rnd.sample(range(1, 6), rnd.randint(1, 3))
+        max_weight = rnd.choice([10.0, 15.0, 50.0])
+        working_hours = [random_window(rnd) for _ in range(rnd.randint(1, 3))]
+        assert index.match(regions, max_weight, working_hours) == \
+            brute_force(orders, regions, max_weight, working_hours)
+
+
+def test_index_reloads_orders_written_by_another_worker(session_local, monkeypatch):
+    monkeypatch.setattr(order_index, "ORDER_INDEX_TTL", 5)
+    db = session_local()
+    try:
+        index = order_index.get_index(db)
+        # Written without going through this process's index
+        db.add(models.Order(id=1, weight=1.0, region_id=1))
+        db.add(models.OrderDeliveryHours(order_id=1, delivery_hours="10:00-11:00", begin=600, end=660))
+        db.commit()
+        assert order_index.get_index(db).match([1], 10.0, [(540, 1080)]) == set()
+
+        index.loaded_at -= 6
+        assert order_index.get_index(db).match([1], 10.0, [(540, 1080)]) == {1}
+    finally:
+        db.close()
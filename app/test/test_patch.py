@@ -0,0 +1,130 @@
+import pytest
+from sqlalchemy import event
+
+from app import models
+from app.test.test_assign import assign, create_courier, create_orders
+
+
+def row_ids(db, model, courier_id):
+    return [row_id for row_id, in db.query(model.id).filter(model.courier_id == courier_id).order_by(model.id)]
+
+
+def test_patch_only_touches_changed_rows(client, session_local):
+    create_courier(client, 1, "car", [1, 2, 3], ["09:00-12:00", "13:00-18:00"])
+    db = session_local()
+    try:
+        regions_before = row_ids(db, models.CourierRegion, 1)
+        hours_before = row_ids(db, models.CourierWorkingHours, 1)
+    finally:
+        db.close()
+
+    response = client.patch("/couriers/1", json={"regions": [3, 4, 1], "working_hours": ["13:00-18:00"]})
+    assert response.status_code == 200
+    assert response.json() == {
+        "courier_id": 1, "courier_type": "car", "regions": [3, 4, 1], "working_hours": ["13:00-18:00"]
+    }
+
+    db = session_local()
+    try:
+        regions_after = row_ids(db, models.CourierRegion, 1)
+        hours_after = row_ids(db, models.CourierWorkingHours, 1)
+    finally:
+        db.close()
+    assert regions_after[:2] == [regions_before[0], regions_before[2]]
+    assert len(regions_after) == 3
+    assert hours_after == hours_before[1:]
+
+
+def test_patch_statement_count_does_not_grow_with_orders(client, query_budget):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_orders(client, [
+        (order_id, 0.5, 1, ["10:00-11:00" if order_id <= 40 else "11:30-12:00"]) for order_id in range(1, 81)
+    ])
+    assert len(assign(client, 1)) == 80
+
+    with query_budget(15):
+        response = client.patch("/couriers/1", json={"regions": [1, 2], "working_hours": ["11:00-12:00"]})
+    assert response.status_code == 200
+    assert assign(client, 1) == list(range(41, 81))
+
+
+def test_patch_type_releases_orders_over_new_limit(client):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 12.0, 1, ["10:00-11:00"]), (2, 3.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [1, 2]
+    assert client.patch("/couriers/1", json={"courier_type": "foot"}).status_code == 200
+    assert assign(client, 1) == [2]
+
+
+def test_patch_courier_id_moves_its_orders(client):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_courier(client, 2, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [1]
+    assert client.patch("/couriers/1", json={"courier_id": 2}).status_code == 400
+    response = client.patch("/couriers/1", json={"courier_id": 3})
+    assert response.status_code == 200
+    assert response.json()["regions"] == [1]
+    assert assign(client, 3) == [1]
+    assert client.get("/couriers/1").status_code == 404
+
+
+def test_patch_rejects_bad_fields(client):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    for body in ({"courier_type": "plane"}, {"regions": ["1"]}, {"courier_id": "2"}, {"rating": 5}):
+        assert client.patch("/couriers/1", json=body).status_code == 400
+    assert client.patch("/couriers/2", json={"regions": [1]}).status_code == 404
+
+
+def test_released_orders_go_back_to_pending(client):
+    create_courier(client, 1, "car", [1, 2], ["09:00-18:00"])
+    create_courier(client, 2, "car", [2], ["09:00-18:00"])
+    create_orders(client, [
+        (1, 1.0, 1, ["10:00-11:00"]),
+        (2, 1.0, 2, ["10:00-11:00"]),
+        (3, 40.0, 1, ["10:00-11:00"]),
+        (4, 1.0, 1, ["19:00-20:00", "17:00-17:30"])
+    ])
+    assert assign(client, 1) == [1, 2, 3, 4]
+    assert client.patch("/couriers/1", json={"regions": [1], "courier_type": "bike"}).status_code == 200
+    assert assign(client, 1) == [1, 4]
+    assert assign(client, 2) == [2]
+
+
+@pytest.fixture
+def enforce_foreign_keys(db_engine):
+    # SQLite only checks foreign keys when asked to, PostgreSQL always does
+    @event.listens_for(db_engine, "connect")
+    def foreign_keys_on(dbapi_connection, connection_record):
+        dbapi_connection.execute("PRAGMA foreign_keys = ON")
+
+    db_engine.dispose()
+
+
+def test_patch_courier_id_with_foreign_keys_enforced(client, session_local, enforce_foreign_keys):
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    create_courier(client, 3, "car", [1], ["09:00-18:00"])
+    create_orders(client, [(1, 1.0, 1, ["10:00-11:00"]), (2, 1.0, 1, ["10:00-11:00"])])
+    assert assign(client, 1) == [1, 2]
+    assert client.post("/orders/complete", json={
+        "courier_id": 1, "order_id": 1, "complete_time": "2021-01-10T10:33:01.42Z"
+    }).status_code == 200
+
+    assert client.patch("/couriers/1", json={"courier_id": 3}).status_code == 400
+    response = client.patch("/couriers/1", json={"courier_id": 2})
+    assert response.status_code == 200
+    assert client.get("/couriers/1").status_code == 404
+    courier = client.get("/couriers/2").json()
+    assert courier["regions"] == [1] and "rating" in courier
+    assert assign(client, 2) == [2]
+
+    db = session_local()
+    try:
+        assert db.execute("PRAGMA foreign_keys").scalar() == 1
+        assert db.execute("PRAGMA foreign_key_check").fetchall() == []
+        for model in (models.CourierRegion, models.CourierWorkingHours,
+                      models.CompletedCourierOrder, models.CourierRegionStats):
+            assert db.query(model).filter(model.courier_id == 1).count() == 0
+            assert db.query(model).filter(model.courier_id == 2).count() > 0
+    finally:
+        db.close()
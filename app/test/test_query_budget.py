@@ -0,0 +1,50 @@
+import pytest
+
+from app.test.test_assign import create_courier, create_orders
+
+# Statements each endpoint may run, whatever the amount of data involved
+BUDGETS = {
+    "post_couriers": 3,
+    "post_orders": 3,
+    "get_courier": 4,
+    "assign": 11,
+    "assign_batch": 10,
+    "complete": 10,
+    "patch": 12,
+    "metrics": 0,
+}
+
+
+@pytest.mark.parametrize("size", [1, 40])
+def test_endpoints_stay_within_query_budget(client, query_budget, size):
+    for courier_id in range(1, size + 1):
+        create_courier(client, courier_id, "car", [1, 2], ["09:00-18:00", "19:00-20:00"])
+    create_orders(client, [
+        (order_id, 1.0, 1 + order_id % 2, ["10:00-11:00", "19:00-19:30"]) for order_id in range(1, 10 * size + 1)
+    ])
+
+    requests = [
+        ("post_couriers", "post", "/couriers", {"data": [{
+            "courier_id": 1000 + i, "courier_type": "foot", "regions": [1, 2, 3], "working_hours": ["09:00-18:00"]
+        } for i in range(size)]}),
+        ("post_orders", "post", "/orders", {"data": [{
+            "order_id": 1000 + i, "weight": 1, "region": 1, "delivery_hours": ["09:00-10:00", "11:00-12:00"]
+        } for i in range(size)]}),
+        ("get_courier", "get", "/couriers/1", None),
+        ("assign", "post", "/orders/assign", {"courier_id": 1}),
+        ("assign", "post", "/orders/assign", {"courier_id": 1}),
+        ("assign_batch", "post", "/orders/assign/batch", {"all_idle": True}),
+        ("complete", "post", "/orders/complete", {
+            "courier_id": 1, "order_id": 2, "complete_time": "2021-01-10T10:33:01.42Z"
+        }),
+        ("patch", "patch", "/couriers/1", {"regions": [1, 3], "working_hours": ["09:00-10:30"]}),
+        ("get_courier", "get", "/couriers/1", None),
+        ("metrics", "get", "/metrics", None),
+    ]
+    for name, method, path, body in requests:
+        with query_budget(BUDGETS[name]):
+            if body is None:
+                response = getattr(client, method)(path)
+            else:
+                response = getattr(client, method)(path, json=body)
+        assert response.status_code in (200, 201), (name, response.text)
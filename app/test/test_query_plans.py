@@ -0,0 +1,95 @@
+from contextlib import contextmanager
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from app import crud, order_index, schemas
+
+
+@contextmanager
+def captured_selects(engine):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT"):
+            statements.append((statement, parameters))
+
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    try:
+        yield statements
+    finally:
+        event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def query_plan(engine, statements):
+    # (plan line, statement) of every step of every statement
+    with engine.connect() as connection:
+        return [
+            (row[-1], statement)
+            for statement, parameters in statements
+            for row in connection.exec_driver_sql("EXPLAIN QUERY PLAN " + statement, parameters)
+        ]
+
+
+def full_scans(engine, statements):
+    return [
+        (detail, statement) for detail, statement in query_plan(engine, statements)
+        if detail.startswith("SCAN") and "INDEX" not in detail and "CONSTANT ROW" not in detail
+    ]
+
+
+@pytest.fixture
+def db(session_local):
+    db = session_local()
+    crud.create_couriers(db, [
+        schemas.CourierDto(courier_id=1, courier_type="foot", regions=[1, 2], working_hours=["09:00-12:00"]),
+        schemas.CourierDto(courier_id=2, courier_type="car", regions=[2], working_hours=["12:00-18:00"])
+    ])
+    crud.create_orders(db, [
+        schemas.OrderDto(order_id=1, weight=1.0, region=1, delivery_hours=["10:00-11:00"]),
+        schemas.OrderDto(order_id=2, weight=5.0, region=2, delivery_hours=["08:00-09:30", "17:00-19:00"]),
+        schemas.OrderDto(order_id=3, weight=20.0, region=2, delivery_hours=["13:00-14:00"]),
+        schemas.OrderDto(order_id=4, weight=2.0, region=1, delivery_hours=["11:00-12:00"])
+    ])
+    crud.assign_order(db, crud.get_courier_by_id(db, 1))
+    complete_order(db, 1)
+    yield db
+    db.close()
+
+
+def complete_order(db, order_id):
+    crud.order_complete(db, {"courier_id": 1, "order_id": order_id, "complete_time": datetime.now().isoformat()})
+
+
+QUERIES = {
+    "get_courier_by_id": lambda db: crud.get_courier_by_id(db, 1),
+    "get_suitable_orders": lambda db: crud.get_suitable_orders(db, 2, 50.0),
+    "get_pending_orders_by_ids": lambda db: crud.get_pending_orders_by_ids(db, [2, 3]),
+    "assign_order": lambda db: crud.assign_order(db, crud.get_courier_by_id(db, 2)),
+    "get_active_orders": lambda db: crud.get_active_orders(db, [1, 2]),
+    "update_courier": lambda db: crud.update_courier(db, {"regions": [1], "working_hours": ["10:00-11:00"]}, 1),
+    "check_courier": lambda db: crud.check_courier(db, 1),
+    "calculate_courier_rating_earning": lambda db: crud.calculate_courier_rating_earning(db, 1, 2),
+    "order_index_rebuild": lambda db: order_index.PendingOrderIndex().rebuild(db),
+    "order_complete": lambda db: complete_order(db, 4),
+    "list_couriers": lambda db: crud.list_couriers(db, 0, 100, courier_type="foot", region=2),
+    "list_pending_orders": lambda db: crud.list_orders(db, 0, 100, status="pending", region=2),
+    "list_assigned_orders": lambda db: crud.list_orders(db, 0, 100, status="assigned", courier_id=1),
+    "list_completed_orders": lambda db: crud.list_orders(db, 0, 100, status="completed")
+}
+
+
+@pytest.mark.parametrize("query", QUERIES.values(), ids=QUERIES.keys())
+def test_crud_queries_use_indexes(db, db_engine, query):
+    with captured_selects(db_engine) as statements:
+        query(db)
+    assert statements
+    assert full_scans(db_engine, statements) == []
+
+
+def test_pending_orders_are_found_through_the_partial_index(db, db_engine):
+    with captured_selects(db_engine) as statements:
+        crud.get_suitable_orders(db, 2, 50.0)
+    searches = [detail for detail, _ in query_plan(db_engine, statements) if detail.startswith("SEARCH order ")]
+    assert searches == ["SEARCH order USING INDEX ix_order_pending (order_region_id=? AND order_weight<?)"]
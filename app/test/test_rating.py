@@ -0,0 +1,99 @@
+from datetime import timedelta
+
+from sqlalchemy import event
+
+from app import crud, models, schemas
+from app.backfill import rebuild_courier_region_stats
+
+
+def complete(db, courier_id, order_id, after):
+    db_order = db.query(models.Order).get(order_id)
+    crud.order_complete(db, {
+        "courier_id": courier_id,
+        "order_id": order_id,
+        "complete_time": (db_order.assign_time + after).isoformat()
+    })
+
+
+def stats_rows(db):
+    return db.query(
+        models.CourierRegionStats.courier_id,
+        models.CourierRegionStats.region_id,
+        models.CourierRegionStats.lead_time_sum,
+        models.CourierRegionStats.completed_count
+    ).order_by(models.CourierRegionStats.courier_id, models.CourierRegionStats.region_id).all()
+
+
+def test_rating_uses_running_averages_per_courier_and_region(session_local):
+    db = session_local()
+    crud.create_couriers(db, [
+        schemas.CourierDto(courier_id=1, courier_type="foot", regions=[1], working_hours=["00:00-23:59"]),
+        schemas.CourierDto(courier_id=2, courier_type="foot", regions=[1], working_hours=["00:00-23:59"])
+    ])
+    crud.create_orders(db, [
+        schemas.OrderDto(order_id=1, weight=1.0, region=1, delivery_hours=["10:00-11:00"]),
+        schemas.OrderDto(order_id=2, weight=1.0, region=1, delivery_hours=["10:00-11:00"])
+    ])
+    crud.assign_order(db, crud.get_courier_by_id(db, 1))
+    crud.create_orders(db, [schemas.OrderDto(order_id=3, weight=1.0, region=1, delivery_hours=["10:00-11:00"])])
+    crud.assign_order(db, crud.get_courier_by_id(db, 2))
+
+    complete(db, 1, 1, timedelta(seconds=600))
+    complete(db, 1, 2, timedelta(seconds=1800))
+    complete(db, 2, 3, timedelta(seconds=3600))
+
+    assert stats_rows(db) == [(1, 1, 1800, 2), (2, 1, 3600, 1)]
+    assert float(db.query(models.Courier).get(1).rating) == 3.75
+    assert float(db.query(models.Courier).get(2).rating) == 0.0
+
+    connection = db.connection()
+    rebuild_courier_region_stats(connection)
+    db.commit()
+    assert stats_rows(db) == [(1, 1, 1800, 2), (2, 1, 3600, 1)]
+    db.close()
+
+
+def test_completion_cost_does_not_grow_with_history(session_local, db_engine):
+    db = session_local()
+    crud.create_couriers(db, [
+        schemas.CourierDto(courier_id=1, courier_type="car", regions=[1], working_hours=["00:00-23:59"])
+    ])
+    crud.create_orders(db, [
+        schemas.OrderDto(order_id=order_id, weight=1.0, region=1, delivery_hours=["10:00-11:00"])
+        for order_id in range(1, 31)
+    ])
+    crud.assign_order(db, crud.get_courier_by_id(db, 1))
+
+    statements = []
+    event.listen(db_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+    counts = []
+    for order_id in range(1, 31):
+        del statements[:]
+        complete(db, 1, order_id, timedelta(seconds=60 * order_id))
+        counts.append(len(statements))
+    assert counts[1] == counts[-1]
+
+    lead_times = [
+        lead_time for lead_time, in db.query(models.CompletedCourierOrder.lead_time)
+        .order_by(models.CompletedCourierOrder.order_number)
+    ]
+    assert lead_times == [60] * 30
+    db.close()
+
+
+def test_first_completions_in_a_region_from_two_sessions_both_count(session_local, query_budget):
+    first = session_local()
+    second = session_local()
+    crud.create_couriers(first, [
+        schemas.CourierDto(courier_id=1, courier_type="foot", regions=[1], working_hours=["00:00-23:59"])
+    ])
+    # Neither reads the row first, so neither can miss the other's insert
+    with query_budget(1):
+        crud.add_completion_to_stats(first, 1, 1, 600)
+    first.commit()
+    with query_budget(1):
+        crud.add_completion_to_stats(second, 1, 1, 1200)
+    second.commit()
+    assert stats_rows(first) == [(1, 1, 1800, 2)]
+    first.close()
+    second.close()
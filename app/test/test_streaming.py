@@ -0,0 +1,61 @@
+import asyncio
+import json
+
+from app import streaming
+from app.test.test_assign import assign, create_courier
+
+
+def collect_lines(chunks, max_line_bytes):
+    async def source():
+        for chunk in chunks:
+            yield chunk
+
+    async def run():
+        return [line async for line in streaming.ndjson_lines(source(), max_line_bytes)]
+
+    return asyncio.new_event_loop().run_until_complete(run())
+
+
+def test_ndjson_lines_split_across_chunks():
+    assert collect_lines([b'{"a"', b': 1}\n\n{"b": 2}\n{"c"', b": 3}"], 100) == [b'{"a": 1}', b'{"b": 2}', b'{"c": 3}']
+
+
+def test_ndjson_lines_reject_long_lines_without_buffering_them():
+    lines = collect_lines([b"x" * 30, b"x" * 30, b"x\n{}\n", b"y" * 20 + b"\nz\n" + b"w" * 26], 25)
+    assert lines == [streaming.TOO_LONG, b"{}", b"y" * 20, b"z", streaming.TOO_LONG]
+
+
+def order_line(order_id, weight=1.0, region=1, hours=("10:00-11:00",)):
+    return json.dumps({"order_id": order_id, "weight": weight, "region": region, "delivery_hours": list(hours)})
+
+
+def test_stream_import_reports_each_rejected_record(client, monkeypatch):
+    monkeypatch.setattr(streaming, "IMPORT_BATCH_SIZE", 2)
+    body = "\n".join([
+        order_line(1),
+        order_line(2, weight=60),
+        "not json",
+        order_line(3, hours=["9-10"]),
+        order_line(4),
+        order_line(1),
+        order_line(5),
+        order_line(5),
+        "[1]",
+        order_line(6)
+    ]) + "\n"
+    response = client.post("/orders/stream", data=body.encode(), headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    assert response.json() == {
+        "accepted": 4,
+        "rejected": 6,
+        "rejections": [
+            {"record": 2, "id": 2, "reason": "invalid weight"},
+            {"record": 3, "id": None, "reason": "invalid json"},
+            {"record": 4, "id": 3, "reason": "invalid delivery_hours"},
+            {"record": 6, "id": 1, "reason": "duplicate order_id"},
+            {"record": 8, "id": 5, "reason": "duplicate order_id"},
+            {"record": 9, "id": None, "reason": "not an object"}
+        ]
+    }
+    create_courier(client, 1, "car", [1], ["09:00-18:00"])
+    assert assign(client, 1) == [1, 4, 5, 6]
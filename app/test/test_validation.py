@@ -0,0 +1,94 @@
+import pytest
+from pydantic import ValidationError
+
+from app import schemas, validation
+
+COURIERS = [
+    {"courier_id": 1, "courier_type": "foot", "regions": [1, 2], "working_hours": ["09:00-11:00"]},
+    {"courier_id": 2, "courier_type": "boat", "regions": [1], "working_hours": []},
+    {"courier_id": "3", "courier_type": "car", "regions": ["4"], "working_hours": []},
+    {"courier_id": 4, "courier_type": "bike", "regions": [1], "working_hours": ["9:00-11:00"]},
+    {"courier_id": 5, "courier_type": "bike", "regions": 1, "working_hours": []},
+    {"courier_id": 6, "courier_type": "bike", "working_hours": []},
+    {"courier_id": 7, "courier_type": ["foot"], "regions": [1], "working_hours": []},
+    ["not", "an", "object"],
+]
+
+ORDERS = [
+    {"order_id": 1, "weight": 0.23, "region": 12, "delivery_hours": ["09:00-18:00"]},
+    {"order_id": 2, "weight": 50.03, "region": 1, "delivery_hours": ["09:00-18:00"]},
+    {"order_id": 3, "weight": 15, "region": "22region", "delivery_hours": ["09:00-18:00"]},
+    {"order_id": 4, "weight": "2.5", "region": 1, "delivery_hours": []},
+    {"order_id": 5, "weight": 1, "region": 1, "delivery_hours": ["09:00-24:00"]},
+    {"order_id": 6, "weight": None, "region": 1, "delivery_hours": []},
+]
+
+
+def pydantic_verdicts(model, items):
+    verdicts = []
+    for item in items:
+        try:
+            verdicts.append(model.parse_obj(item).dict())
+        except ValidationError:
+            verdicts.append(None)
+    return verdicts
+
+
+def fast_verdicts(parse, items):
+    verdicts = []
+    for item in items:
+        try:
+            verdicts.append(parse(item).dict())
+        except ValidationError:
+            verdicts.append(None)
+    return verdicts
+
+
+@pytest.mark.parametrize("model, parse, items", [
+    (schemas.CourierDto, validation.parse_courier, COURIERS),
+    (schemas.OrderDto, validation.parse_order, ORDERS),
+])
+def test_fast_path_agrees_with_the_schema(model, parse, items):
+    assert fast_verdicts(parse, items) == pydantic_verdicts(model, items)
+
+
+def test_validate_couriers_lists_each_invalid_item_once_in_payload_order():
+    couriers, invalid_ids = validation.validate_couriers(COURIERS)
+    assert [courier.courier_id for courier in couriers] == [1, 3]
+    assert invalid_ids == [2, 4, 5, 6, 7, None]
+
+
+def test_validate_orders_coerces_like_the_schema():
+    orders, invalid_ids = validation.validate_orders(ORDERS)
+    assert [(order.order_id, order.weight) for order in orders] == [(1, 0.23), (4, 2.5)]
+    assert all(type(order.weight) is float for order in orders)
+    assert invalid_ids == [2, 3, 5, 6]
+
+
+def test_import_rejects_a_body_without_data(client):
+    response = client.post("/couriers", json={"couriers": []})
+    assert response.status_code == 400
+
+
+def test_validate_rejects_an_id_repeated_in_the_payload():
+    couriers, invalid_ids = validation.validate_couriers([COURIERS[0], COURIERS[2], dict(COURIERS[0], regions=[3])])
+    assert [courier.courier_id for courier in couriers] == [1, 3]
+    assert invalid_ids == [1]
+
+
+def test_import_rejects_ids_already_taken(client):
+    courier = {"courier_id": 1, "courier_type": "foot", "regions": [1], "working_hours": ["09:00-11:00"]}
+    order = {"order_id": 1, "weight": 1, "region": 1, "delivery_hours": ["09:00-18:00"]}
+    assert client.post("/couriers", json={"data": [courier]}).status_code == 201
+    assert client.post("/orders", json={"data": [order]}).status_code == 201
+
+    response = client.post("/couriers", json={"data": [dict(courier, courier_id=2), courier]})
+    assert response.status_code == 400
+    assert response.json() == {"validation_error": {"couriers": [{"id": 1}]}}
+    response = client.post("/orders", json={"data": [dict(order, order_id=2), order]})
+    assert response.status_code == 400
+    assert response.json() == {"validation_error": {"orders": [{"id": 1}]}}
+
+    # Nothing of a rejected import is written
+    assert client.get("/couriers/2").status_code == 404
+    assert client.post("/orders", json={"data": [dict(order, order_id=2)]}).status_code == 201
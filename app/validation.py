@@ -0,0 +1,84 @@
+from pydantic import ValidationError
+
+from . import schemas
+
+COURIER_TYPES = frozenset(("foot", "bike", "car"))
+MIN_WEIGHT = 0.01
+MAX_WEIGHT = 50.0
+
+_hours_match = schemas.HOURS_RE.fullmatch
+
+
+def _all_hours(hours):
+    return type(hours) is list and all(type(h) is str and _hours_match(h) for h in hours)
+
+
+def _all_ints(values):
+    return type(values) is list and all(type(v) is int for v in values)
+
+
+# The fast paths accept only items already in their canonical form, which
+# need no coercion and can skip pydantic. Anything else, valid or not, goes
+# through the schema itself, so both paths agree on what is accepted.
+
+def parse_courier(item) -> schemas.CourierDto:
+    if type(item) is dict \
+            and type(item.get("courier_id")) is int \
+            and type(item.get("courier_type")) is str \
+            and item["courier_type"] in COURIER_TYPES \
+            and _all_ints(item.get("regions")) \
+            and _all_hours(item.get("working_hours")):
+        return schemas.CourierDto.construct(
+            courier_id=item["courier_id"],
+            courier_type=item["courier_type"],
+            regions=item["regions"],
+            working_hours=item["working_hours"]
+        )
+    return schemas.CourierDto.parse_obj(item)
+
+
+def parse_order(item) -> schemas.OrderDto:
+    if type(item) is dict:
+        weight = item.get("weight")
+        if type(item.get("order_id")) is int \
+                and (type(weight) is float or type(weight) is int) \
+                and MIN_WEIGHT <= weight <= MAX_WEIGHT \
+                and type(item.get("region")) is int \
+                and _all_hours(item.get("delivery_hours")):
+            return schemas.OrderDto.construct(
+                order_id=item["order_id"],
+                weight=float(weight),
+                region=item["region"],
+                delivery_hours=item["delivery_hours"]
+            )
+    return schemas.OrderDto.parse_obj(item)
+
+
+def _validate(items: list, parse, id_field: str):
+    valid = []
+    invalid_ids = []
+    seen = set()
+    for item in items:
+        try:
+            parsed = parse(item)
+        except ValidationError:
+            invalid_ids.append(item.get(id_field) if type(item) is dict else None)
+            continue
+        item_id = getattr(parsed, id_field)
+        if item_id in seen:
+            invalid_ids.append(item_id)
+        else:
+            seen.add(item_id)
+            valid.append(parsed)
+    return valid, invalid_ids
+
+
+# Both return the valid items and the ids of the invalid ones, in payload
+# order. An id repeated in the payload is invalid from its second item on.
+
+def validate_couriers(items: list):
+    return _validate(items, parse_courier, "courier_id")
+
+
+def validate_orders(items: list):
+    return _validate(items, parse_order, "order_id")
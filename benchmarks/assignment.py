@@ -0,0 +1,54 @@
+"""Orders per courier and solve time of the assignment strategies.
+
+    python -m benchmarks.assignment --couriers 1000 --orders 20000
+"""
+import argparse
+
+from app import assignment, crud
+from benchmarks.common import make_client, generate_couriers, generate_orders, Timer
+
+
+def run(couriers_count, orders_count, regions, strategies):
+    couriers = generate_couriers(couriers_count, regions=regions)
+    orders = generate_orders(orders_count, regions=regions)
+    weights = {order["order_id"]: order["weight"] for order in orders}
+    capacity = {courier["courier_id"]: crud.get_max_weight(courier["courier_type"]) for courier in couriers}
+
+    print("%-8s %12s %10s %12s %12s %12s" % (
+        "strategy", "orders", "per-courier", "overloaded", "solve s", "request s"
+    ))
+    for name in strategies:
+        client, engine = make_client()
+        for i in range(0, couriers_count, 1000):
+            assert client.post("/couriers", json={"data": couriers[i:i + 1000]}).status_code == 201
+        for i in range(0, orders_count, 1000):
+            assert client.post("/orders", json={"data": orders[i:i + 1000]}).status_code == 201
+
+        assignment.ASSIGN_STRATEGY = name
+        with Timer() as timer:
+            response = client.post("/orders/assign/batch", json={"all_idle": True})
+        assert response.status_code == 200, response.text
+        body = response.json()
+
+        assigned = 0
+        overloaded = 0
+        for courier in body["couriers"]:
+            orders_id = [order["id"] for order in courier["orders"]]
+            assigned += len(orders_id)
+            if sum(weights[order_id] for order_id in orders_id) > capacity[courier["courier_id"]] + 1e-6:
+                overloaded += 1
+        print("%-8s %12d %10.2f %12d %12.4f %12.4f" % (
+            name, assigned, assigned / max(1, len(body["couriers"])), overloaded,
+            body["solve_time"], timer.elapsed
+        ))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--couriers", type=int, default=1000)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--regions", type=int, default=50)
+    parser.add_argument("--strategies", nargs="+", default=sorted(assignment.STRATEGIES))
+    args = parser.parse_args()
+    run(args.couriers, args.orders, args.regions, args.strategies)
@@ -0,0 +1,100 @@
+"""Latency and throughput of sync (threadpool) versus DB_ASYNC=1 serving.
+
+Each client owns one courier and loops assign -> complete -> profile read
+against a uvicorn process backed by a fresh SQLite database.
+
+    python -m benchmarks.async_load --clients 128 --duration 20
+"""
+import argparse
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.common import HttpClient, Timer, generate_orders, percentile, uvicorn_server
+
+
+def seed(port, clients, orders, regions):
+    client = HttpClient(port)
+    couriers = []
+    for courier_id in range(1, clients + 1):
+        couriers.append({
+            "courier_id": courier_id,
+            "courier_type": "car",
+            "regions": [courier_id % regions + 1],
+            "working_hours": ["00:00-23:59"]
+        })
+    assert client.request("POST", "/couriers", {"data": couriers})[0] == 201
+    for start in range(0, orders, 10000):
+        batch = generate_orders(min(10000, orders - start), start_id=start + 1, regions=regions, seed=start)
+        assert client.request("POST", "/orders", {"data": batch})[0] == 201
+
+
+def client_loop(port, courier_id, deadline, samples, errors):
+    while time.time() < deadline:
+        try:
+            client_round(HttpClient(port), courier_id, deadline, samples, errors)
+        except OSError as e:
+            errors.append(type(e).__name__)
+
+
+def client_round(client, courier_id, deadline, samples, errors):
+    while time.time() < deadline:
+        with Timer() as timer:
+            status, body = client.request("POST", "/orders/assign", {"courier_id": courier_id})
+        samples["assign"].append(timer.elapsed)
+        if status != 200:
+            errors.append(status)
+            continue
+        for order in body["orders"][:3]:
+            with Timer() as timer:
+                status, _ = client.request("POST", "/orders/complete", {
+                    "courier_id": courier_id,
+                    "order_id": order["id"],
+                    "complete_time": datetime.now().isoformat()
+                })
+            samples["complete"].append(timer.elapsed)
+            if status != 200:
+                errors.append(status)
+        with Timer() as timer:
+            status, _ = client.request("GET", "/couriers/%d" % courier_id)
+        samples["profile"].append(timer.elapsed)
+        if status != 200:
+            errors.append(status)
+
+
+def run_mode(name, env, args):
+    with uvicorn_server(env) as (port, _):
+        seed(port, args.clients, args.orders, args.regions)
+        samples = {"assign": [], "complete": [], "profile": []}
+        errors = []
+        deadline = time.time() + args.duration
+        threads = [
+            threading.Thread(target=client_loop, args=(port, courier_id, deadline, samples, errors))
+            for courier_id in range(1, args.clients + 1)
+        ]
+        with Timer() as timer:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+    all_samples = [value for values in samples.values() for value in values]
+    print("%-6s %-9s %9s %10s %10s %10s %8s" % ("mode", "endpoint", "requests", "req/s", "p50 ms", "p99 ms", "errors"))
+    for endpoint, values in list(samples.items()) + [("total", all_samples)]:
+        print("%-6s %-9s %9d %10.1f %10.1f %10.1f %8s" % (
+            name, endpoint, len(values), len(values) / timer.elapsed,
+            percentile(values, 50) * 1000, percentile(values, 99) * 1000,
+            len(errors) if endpoint == "total" else ""
+        ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--clients", type=int, default=128)
+    parser.add_argument("--duration", type=float, default=20)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--regions", type=int, default=20)
+    parser.add_argument("--modes", nargs="+", default=["sync", "async"])
+    args = parser.parse_args()
+    for mode in args.modes:
+        run_mode(mode, {"DB_ASYNC": "1" if mode == "async" else "0"}, args)
@@ -0,0 +1,37 @@
+"""Throughput of POST /couriers and POST /orders for growing batch sizes.
+
+    python -m benchmarks.bulk_insert --sizes 10 1000 100000
+"""
+import argparse
+
+from benchmarks.common import make_client, generate_couriers, generate_orders, count_rows, Timer
+
+
+def run(sizes, total_items):
+    print("%-10s %-10s %10s %14s %14s" % ("endpoint", "batch", "requests", "requests/s", "rows/s"))
+    for size in sizes:
+        requests = max(1, total_items // size)
+        for endpoint, generate, key, children in (
+                ("/couriers", generate_couriers, "courier_id", ("regions", "working_hours")),
+                ("/orders", generate_orders, "order_id", ("delivery_hours",))
+        ):
+            client, _ = make_client()
+            payloads = [generate(size, start_id=i * size + 1, seed=i) for i in range(requests)]
+            rows = sum(count_rows(payload, *children) for payload in payloads)
+            with Timer() as timer:
+                for payload in payloads:
+                    response = client.post(endpoint, json={"data": payload})
+                    assert response.status_code == 201, response.text
+            print("%-10s %-10d %10d %14.1f %14.1f" % (
+                endpoint, size, requests,
+                requests / timer.elapsed, rows / timer.elapsed
+            ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 1000, 100000])
+    parser.add_argument("--total-items", type=int, default=100000,
+                        help="items sent per batch size; small batches are repeated to reach it")
+    args = parser.parse_args()
+    run(args.sizes, args.total_items)
@@ -0,0 +1,90 @@
+"""Reconciling a courier's assigned orders after a PATCH: per-order loop versus set-based.
+
+    python -m benchmarks.check_courier --orders 1000 5000 20000
+"""
+import argparse
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+
+from app import crud, models
+from benchmarks.common import make_client, Timer
+
+
+def check_courier_loop(db, courier_id):
+    # Reconciliation as crud did it before: lazy-loaded delivery hours,
+    # overlap checked on "HH:MM-HH:MM" strings, a commit per released order
+    courier_orders = db.query(models.Order).filter(models.Order.courier_id == courier_id).all()
+    courier_regions = crud.get_regions_by_courier_id(db, courier_id)
+    courier_w_h = crud.get_working_hours_by_courier_id(db, courier_id)
+    courier = crud.get_courier_by_id(db, courier_id)
+    courier_max_weight = crud.get_max_weight(courier.courier_type)
+
+    released = 0
+    for order in courier_orders:
+        fits = order.weight <= courier_max_weight and order.region_id in courier_regions
+        if fits and order.delivery_hours:
+            fits = any(
+                crud.intervals_overlap(*crud.convert_to_minute(w_h), *crud.convert_to_minute(d_h.delivery_hours))
+                for d_h in order.delivery_hours for w_h in courier_w_h
+            )
+        if not fits:
+            order.courier_id = -1
+            order.assign_time = None
+            db.commit()
+            released += 1
+    return released
+
+
+def check_courier_set_based(db, courier_id):
+    released = crud.check_courier(db, courier_id)
+    db.commit()
+    return len(released)
+
+
+def prepare(orders_count):
+    client, engine = make_client()
+    assert client.post("/couriers", json={"data": [{
+        "courier_id": 1, "courier_type": "car", "regions": [1, 2, 3], "working_hours": ["06:00-22:00"]
+    }]}).status_code == 201
+    orders = [{
+        "order_id": order_id,
+        "weight": 1 + order_id % 20,
+        "region": 1 + order_id % 3,
+        "delivery_hours": ["%02d:00-%02d:30" % (6 + order_id % 15, 6 + order_id % 15)]
+    } for order_id in range(1, orders_count + 1)]
+    for i in range(0, orders_count, 1000):
+        assert client.post("/orders", json={"data": orders[i:i + 1000]}).status_code == 201
+
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    db = session_local()
+    db.query(models.Order).update({models.Order.courier_id: 1}, synchronize_session=False)
+    # Drops region 3 and the evening, and caps the weight at 15
+    crud.update_courier(db, {"courier_type": "bike", "regions": [1, 2], "working_hours": ["06:00-15:00"]}, 1)
+    db.commit()
+    return engine, db
+
+
+def run(orders_counts, loop_limit):
+    print("%-10s %8s %10s %12s %10s" % ("check", "orders", "released", "statements", "seconds"))
+    for orders_count in orders_counts:
+        for name, check in (("loop", check_courier_loop), ("set-based", check_courier_set_based)):
+            if check is check_courier_loop and orders_count > loop_limit:
+                continue
+            engine, db = prepare(orders_count)
+            statements = []
+            event.listen(engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+            with Timer() as timer:
+                released = check(db, 1)
+            print("%-10s %8d %10d %12d %10.3f" % (name, orders_count, released, len(statements), timer.elapsed))
+            db.close()
+            engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, nargs="+", default=[1000, 5000, 20000])
+    parser.add_argument("--loop-limit", type=int, default=5000,
+                        help="skip the per-order loop above this many orders, it grows quadratically")
+    args = parser.parse_args()
+    run(args.orders, args.loop_limit)
@@ -0,0 +1,166 @@
+import http.client
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+
+from fastapi.testclient import TestClient
+from sqlalchemy.orm import sessionmaker
+
+from app.database import Base, make_engine
+from app.main import app, get_db
+
+COURIER_TYPES = ["foot", "bike", "car"]
+
+
+def make_client():
+    """In-process client bound to a fresh SQLite database in a temp dir."""
+    path = os.path.join(tempfile.mkdtemp(prefix="candy-bench-"), "bench.db")
+    engine = make_engine("sqlite:///" + path)
+    Base.metadata.create_all(bind=engine)
+    session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    def override_get_db():
+        db = session_local()
+        try:
+            yield db
+        finally:
+            db.close()
+
+    app.dependency_overrides[get_db] = override_get_db
+    return TestClient(app), engine
+
+
+def random_hours(rnd: random.Random, count: int, min_len: int = 60, max_len: int = 600):
+    hours = []
+    for _ in range(count):
+        begin = rnd.randrange(0, 24 * 60 - max_len)
+        end = begin + rnd.randrange(min_len, max_len)
+        hours.append("%02d:%02d-%02d:%02d" % (begin // 60, begin % 60, end // 60, end % 60))
+    return hours
+
+
+# Order weight samplers by name, in kg
+WEIGHT_DISTRIBUTIONS = {
+    "uniform": lambda rnd: rnd.uniform(0.01, 50.0),
+    # Mostly parcels a foot courier can carry, with a long tail
+    "light": lambda rnd: rnd.expovariate(1 / 4.0),
+    # Mostly more than a bike takes
+    "heavy": lambda rnd: rnd.uniform(15.0, 50.0),
+}
+
+
+def generate_couriers(count: int, start_id: int = 1, regions: int = 50, seed: int = 0,
+                      max_hours: int = 3, min_len: int = 60, max_len: int = 600):
+    rnd = random.Random(seed)
+    couriers = []
+    for courier_id in range(start_id, start_id + count):
+        couriers.append({
+            "courier_id": courier_id,
+            "courier_type": rnd.choice(COURIER_TYPES),
+            "regions": rnd.sample(range(1, regions + 1), rnd.randint(1, min(4, regions))),
+            "working_hours": random_hours(rnd, rnd.randint(1, max_hours), min_len, max_len)
+        })
+    return couriers
+
+
+def generate_orders(count: int, start_id: int = 1, regions: int = 50, seed: int = 0,
+                    weights: str = "uniform", max_hours: int = 2, min_len: int = 60, max_len: int = 600):
+    rnd = random.Random(seed)
+    weight = WEIGHT_DISTRIBUTIONS[weights]
+    orders = []
+    for order_id in range(start_id, start_id + count):
+        orders.append({
+            "order_id": order_id,
+            "weight": min(50.0, max(0.01, round(weight(rnd), 2))),
+            "region": rnd.randint(1, regions),
+            "delivery_hours": random_hours(rnd, rnd.randint(1, max_hours), min_len, max_len)
+        })
+    return orders
+
+
+def count_rows(items, *children):
+    rows = len(items)
+    for item in items:
+        for child in children:
+            rows += len(item[child])
+    return rows
+
+
+class Timer:
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+
+
+def percentile(values, q: float):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(q / 100.0 * (len(values) - 1)))))
+    return values[k]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@contextmanager
+def uvicorn_server(env=None, workers: int = 1):
+    """Run app.main under uvicorn against a fresh SQLite database, yield (port, process)."""
+    port = free_port()
+    server_env = dict(os.environ)
+    server_env["DB_URL"] = "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="candy-bench-"), "bench.db")
+    server_env.update(env or {})
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--workers", str(workers), "--log-level", "warning"],
+        env=server_env
+    )
+    try:
+        deadline = time.time() + 30
+        while True:
+            try:
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+                connection.request("GET", "/metrics")
+                connection.getresponse().read()
+                break
+            except OSError:
+                if time.time() > deadline or process.poll() is not None:
+                    raise RuntimeError("uvicorn did not start")
+                time.sleep(0.2)
+        yield port, process
+    finally:
+        process.terminate()
+        process.wait(timeout=30)
+
+
+class HttpClient:
+    """Keep-alive JSON client for one benchmark thread."""
+
+    def __init__(self, port: int):
+        self.connection = http.client.HTTPConnection("127.0.0.1", port, timeout=120)
+
+    def request(self, method: str, path: str, body=None, content_type: str = "application/json"):
+        # A bytes body is sent as is, anything else as JSON
+        if body is None or isinstance(body, bytes):
+            payload = body
+        else:
+            payload = json.dumps(body)
+        headers = {} if body is None else {"Content-Type": content_type}
+        self.connection.request(method, path, body=payload, headers=headers)
+        response = self.connection.getresponse()
+        data = response.read()
+        if data and response.getheader("content-type", "").startswith("application/json"):
+            data = json.loads(data)
+        return response.status, data
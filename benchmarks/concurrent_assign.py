@@ -0,0 +1,76 @@
+"""Assign throughput with concurrent callers competing for the same orders.
+
+    python -m benchmarks.concurrent_assign --threads 1 2 4 8 16
+"""
+import argparse
+import threading
+from collections import Counter
+
+from sqlalchemy.orm import sessionmaker
+
+from app import crud
+from benchmarks.common import make_client, Timer
+
+
+def run(threads_counts, couriers_per_thread, orders_count, regions):
+    print("%-8s %10s %12s %12s %12s" % ("threads", "assigns", "assigns/s", "handed out", "duplicates"))
+    for threads_count in threads_counts:
+        client, engine = make_client()
+        session_local = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+        couriers_count = threads_count * couriers_per_thread
+        couriers = [{
+            "courier_id": courier_id,
+            "courier_type": "car",
+            "regions": [courier_id % regions + 1],
+            "working_hours": ["09:00-18:00"]
+        } for courier_id in range(1, couriers_count + 1)]
+        orders = [{
+            "order_id": order_id,
+            "weight": 5.0,
+            "region": order_id % regions + 1,
+            "delivery_hours": ["10:00-11:00"]
+        } for order_id in range(1, orders_count + 1)]
+        for i in range(0, couriers_count, 1000):
+            assert client.post("/couriers", json={"data": couriers[i:i + 1000]}).status_code == 201
+        for i in range(0, orders_count, 1000):
+            assert client.post("/orders", json={"data": orders[i:i + 1000]}).status_code == 201
+
+        handed_out = Counter()
+        lock = threading.Lock()
+        barrier = threading.Barrier(threads_count + 1)
+
+        def worker(thread_number):
+            db = session_local()
+            try:
+                couriers_id = range(thread_number + 1, couriers_count + 1, threads_count)
+                profiles = [crud.get_courier_by_id(db, courier_id) for courier_id in couriers_id]
+                barrier.wait()
+                for courier in profiles:
+                    orders_id, _ = crud.assign_order(db, courier)
+                    with lock:
+                        handed_out.update(orders_id)
+            finally:
+                db.close()
+
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(threads_count)]
+        for thread in threads:
+            thread.start()
+        barrier.wait()
+        with Timer() as timer:
+            for thread in threads:
+                thread.join()
+        duplicates = sum(1 for count in handed_out.values() if count > 1)
+        print("%-8d %10d %12.1f %12d %12d" % (
+            threads_count, couriers_count, couriers_count / timer.elapsed, len(handed_out), duplicates
+        ))
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--couriers-per-thread", type=int, default=50)
+    parser.add_argument("--orders", type=int, default=20000)
+    parser.add_argument("--regions", type=int, default=10)
+    args = parser.parse_args()
+    run(args.threads, args.couriers_per_thread, args.orders, args.regions)
@@ -0,0 +1,74 @@
+"""Global matching versus first-come greedy assignment on synthetic data.
+
+    python -m benchmarks.matching --orders 1000 10000 100000 --couriers 1000
+"""
+import argparse
+
+from app import assignment, crud, matching
+from app.order_index import PendingOrderIndex
+from benchmarks.common import generate_couriers, generate_orders, Timer
+
+
+def build_inputs(couriers_count, orders_count, regions, seed):
+    index = PendingOrderIndex()
+    for order in generate_orders(orders_count, regions=regions, seed=seed):
+        windows = [crud.convert_to_minute(hours) for hours in order["delivery_hours"]]
+        index._add(order["order_id"], order["region"], order["weight"], windows)
+    index.built = True
+
+    inputs = {}
+    weights = {}
+    for courier in generate_couriers(couriers_count, regions=regions, seed=seed + 1):
+        max_weight = crud.get_max_weight(courier["courier_type"])
+        working_hours = [crud.convert_to_minute(hours) for hours in courier["working_hours"]]
+        courier_weights = index.weights(index.match(courier["regions"], max_weight, working_hours))
+        weights.update(courier_weights)
+        inputs[courier["courier_id"]] = (max_weight, list(courier_weights))
+    return inputs, weights
+
+
+def greedy(inputs, weights):
+    # What sequential /orders/assign calls do, couriers arriving in id order
+    packer = assignment.get_strategy("density")
+    taken = set()
+    assignments = {}
+    for courier_id, (capacity, orders_id) in inputs.items():
+        orders_id = [order_id for order_id in orders_id if order_id not in taken]
+        assignments[courier_id] = packer.select(orders_id, [weights[order_id] for order_id in orders_id], capacity)
+        taken.update(assignments[courier_id])
+    return assignments
+
+
+def report(name, orders_count, assignments, inputs, seconds, complete=True):
+    eligible = [courier_id for courier_id, (_, orders_id) in inputs.items() if orders_id]
+    assigned = sum(len(orders_id) for orders_id in assignments.values())
+    served = sum(1 for courier_id in eligible if assignments[courier_id])
+    print("%-8s %8d %10d %10d %10d %10.2f %10.3f %9s" % (
+        name, orders_count, len(eligible), served, assigned,
+        assigned / max(1, len(eligible)), seconds, "yes" if complete else "no"
+    ))
+
+
+def run(orders_counts, couriers_count, regions, budget, seed):
+    print("%-8s %8s %10s %10s %10s %10s %10s %9s" % (
+        "solver", "orders", "eligible", "served", "assigned", "per-cour.", "seconds", "complete"
+    ))
+    for orders_count in orders_counts:
+        inputs, weights = build_inputs(couriers_count, orders_count, regions, seed)
+        with Timer() as timer:
+            assignments = greedy(inputs, weights)
+        report("greedy", orders_count, assignments, inputs, timer.elapsed)
+        with Timer() as timer:
+            assignments, complete = matching.solve(inputs, weights, budget)
+        report("matching", orders_count, assignments, inputs, timer.elapsed, complete)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--couriers", type=int, default=1000)
+    parser.add_argument("--regions", type=int, default=50)
+    parser.add_argument("--budget", type=float, default=60.0, help="solver time budget in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.orders, args.couriers, args.regions, args.budget, args.seed)
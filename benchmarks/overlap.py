@@ -0,0 +1,58 @@
+"""Interval overlap check on "HH:MM-HH:MM" strings versus stored minute integers.
+
+    python -m benchmarks.overlap --pairs 200000
+"""
+import argparse
+import random
+
+from app.crud import convert_to_minute, intervals_overlap
+from benchmarks.common import random_hours, Timer
+
+
+def checking_the_time(w_h: str, d_h: str):
+    # String-based check used by crud before minutes were stored in the db
+    d_h_begin, d_h_end = convert_to_minute(d_h)
+    w_h_begin, w_h_end = convert_to_minute(w_h)
+
+    b1 = d_h_end <= w_h_begin
+    b2 = d_h_begin >= w_h_end
+
+    if b1 or b2:
+        return False
+    elif d_h_begin <= w_h_begin < d_h_end:
+        return True
+    elif w_h_begin <= d_h_begin < d_h_end:
+        return True
+
+
+def run(pairs, seed):
+    rnd = random.Random(seed)
+    working = [random_hours(rnd, rnd.randint(1, 3)) for _ in range(pairs)]
+    delivery = [random_hours(rnd, rnd.randint(1, 2)) for _ in range(pairs)]
+    working_min = [[convert_to_minute(w_h) for w_h in hours] for hours in working]
+    delivery_min = [[convert_to_minute(d_h) for d_h in hours] for hours in delivery]
+
+    with Timer() as old:
+        old_result = [
+            any(checking_the_time(w_h, d_h) for d_h in d_hours for w_h in w_hours)
+            for w_hours, d_hours in zip(working, delivery)
+        ]
+    with Timer() as new:
+        new_result = [
+            any(intervals_overlap(w_b, w_e, d_b, d_e) for d_b, d_e in d_hours for w_b, w_e in w_hours)
+            for w_hours, d_hours in zip(working_min, delivery_min)
+        ]
+    assert old_result == new_result
+
+    print("%-8s %12s %14s" % ("check", "seconds", "pairs/s"))
+    print("%-8s %12.3f %14.0f" % ("strings", old.elapsed, pairs / old.elapsed))
+    print("%-8s %12.3f %14.0f" % ("minutes", new.elapsed, pairs / new.elapsed))
+    print("speedup  %.1fx" % (old.elapsed / new.elapsed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--pairs", type=int, default=200000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.pairs, args.seed)
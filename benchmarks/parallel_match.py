@@ -0,0 +1,63 @@
+"""Candidate matching for a batch of couriers: index lookups versus OrderWindows across worker processes.
+
+    python -m benchmarks.parallel_match --orders 100000 --couriers 10000 --workers 1 2 4 8
+"""
+import argparse
+
+from app import candidates, crud
+from app.order_index import PendingOrderIndex
+from benchmarks.common import generate_couriers, generate_orders, Timer
+
+
+def build(orders_count, couriers_count, regions, seed):
+    index = PendingOrderIndex()
+    for order in generate_orders(orders_count, regions=regions, seed=seed):
+        windows = [crud.convert_to_minute(hours) for hours in order["delivery_hours"]]
+        index._add(order["order_id"], order["region"], order["weight"], windows)
+    index.built = True
+    couriers = [
+        (courier["courier_id"], courier["regions"], crud.get_max_weight(courier["courier_type"]),
+         [crud.convert_to_minute(hours) for hours in courier["working_hours"]])
+        for courier in generate_couriers(couriers_count, regions=regions, seed=seed + 1)
+    ]
+    return index, couriers
+
+
+def run(orders_count, couriers_count, regions, workers_counts, seed):
+    index, couriers = build(orders_count, couriers_count, regions, seed)
+    print("%d orders, %d couriers, %d window comparisons" % (
+        orders_count, couriers_count, index.comparisons(couriers)
+    ))
+
+    with Timer() as lookups:
+        expected = {
+            courier_id: sorted(index.match(regions, max_weight, working_hours))
+            for courier_id, regions, max_weight, working_hours in couriers
+        }
+    with Timer() as snapshot:
+        windows = index.windows()
+    print("%-14s %10s %10s" % ("matcher", "seconds", "speedup"))
+    print("%-14s %10.3f %10s" % ("index lookups", lookups.elapsed, "1.0x"))
+    print("%-14s %10.3f" % ("  snapshot", snapshot.elapsed))
+
+    for workers in workers_counts:
+        if workers > 1:
+            # Start the pool outside the measurement, as a server keeps it
+            candidates.match_all(windows, couriers[:2], workers=workers)
+        with Timer() as timer:
+            matched = candidates.match_all(windows, couriers, workers=workers)
+        assert matched == expected
+        total = timer.elapsed + snapshot.elapsed
+        print("%-14s %10.3f %9.1fx" % ("workers=%d" % workers, total, lookups.elapsed / total))
+    candidates.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--orders", type=int, default=100000)
+    parser.add_argument("--couriers", type=int, default=10000)
+    parser.add_argument("--regions", type=int, default=50)
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    run(args.orders, args.couriers, args.regions, args.workers, args.seed)
@@ -0,0 +1,65 @@
+"""Peak server memory of POST /orders versus the streaming NDJSON import.
+
+    python -m benchmarks.stream_import --sizes 10000 100000 300000
+"""
+import argparse
+import http.client
+import json
+
+from benchmarks.common import generate_orders, Timer, uvicorn_server
+
+CHUNK_ORDERS = 1000
+
+
+def peak_rss_mb(pid: int):
+    with open("/proc/%d/status" % pid) as status:
+        for line in status:
+            if line.startswith("VmHWM:"):
+                return int(line.split()[1]) / 1024.0
+    return 0.0
+
+
+def ndjson_chunks(size: int):
+    # Generated lazily so the client does not hold the upload either
+    for start in range(1, size + 1, CHUNK_ORDERS):
+        orders = generate_orders(min(CHUNK_ORDERS, size - start + 1), start_id=start, seed=start)
+        yield "".join(json.dumps(order) + "\n" for order in orders).encode()
+
+
+def upload(port: int, endpoint: str, size: int):
+    connection = http.client.HTTPConnection("127.0.0.1", port, timeout=3600)
+    if endpoint == "/orders":
+        body = json.dumps({"data": generate_orders(size)})
+        connection.request("POST", endpoint, body=body, headers={"Content-Type": "application/json"})
+    else:
+        connection.request("POST", endpoint, body=ndjson_chunks(size), encode_chunked=True,
+                           headers={"Content-Type": "application/x-ndjson", "Transfer-Encoding": "chunked"})
+    response = connection.getresponse()
+    data = response.read()
+    assert response.status in (200, 201), data[:200]
+    return json.loads(data)
+
+
+def run(sizes):
+    print("%-14s %10s %12s %14s %10s" % ("endpoint", "orders", "idle MB", "peak MB", "seconds"))
+    for size in sizes:
+        for endpoint in ("/orders", "/orders/stream"):
+            # The pending index and SQLite's page cache and mmap grow with the
+            # table, not with the request: keep them out of the measurement
+            env = {"ORDER_INDEX": "0", "SQLITE_CACHE_SIZE": "-2000", "SQLITE_MMAP_SIZE": "0"}
+            with uvicorn_server(env) as (port, process):
+                idle = peak_rss_mb(process.pid)
+                with Timer() as timer:
+                    result = upload(port, endpoint, size)
+                if endpoint == "/orders/stream":
+                    assert result["accepted"] == size, result
+                print("%-14s %10d %12.1f %14.1f %10.2f" % (
+                    endpoint, size, idle, peak_rss_mb(process.pid), timer.elapsed
+                ))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000, 300000])
+    args = parser.parse_args()
+    run(args.sizes)
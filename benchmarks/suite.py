@@ -0,0 +1,311 @@
+"""Every endpoint of app.main against a synthetic fleet, in-process and over uvicorn.
+
+Results are written as JSON; compare two of them, e.g. from two commits, to
+catch regressions in latency, throughput or queries per request.
+
+    python -m benchmarks.suite run --couriers 1000 --orders 20000 --output before.json
+    python -m benchmarks.suite run --couriers 1000 --orders 20000 --output after.json
+    python -m benchmarks.suite compare before.json after.json
+"""
+import argparse
+import json
+import platform
+import random
+import re
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+from benchmarks.common import (
+    HttpClient, Timer, WEIGHT_DISTRIBUTIONS, generate_couriers, generate_orders, make_client, percentile,
+    uvicorn_server
+)
+
+NDJSON = "application/x-ndjson"
+
+SAMPLE_RE = re.compile(r'^(http_request_db_\w+)_(sum|count)\{method="([^"]*)",route="([^"]*)"\} (\S+)$')
+
+
+class InProcessClient:
+    """HttpClient interface over the TestClient of benchmarks.common.make_client."""
+
+    def __init__(self):
+        self.client, self.engine = make_client()
+
+    def request(self, method: str, path: str, body=None, content_type: str = "application/json"):
+        if body is None:
+            response = self.client.request(method, path)
+        elif isinstance(body, bytes):
+            response = self.client.request(method, path, data=body, headers={"Content-Type": content_type})
+        else:
+            response = self.client.request(method, path, json=body)
+        data = response.content
+        if data and response.headers.get("content-type", "").startswith("application/json"):
+            data = response.json()
+        return response.status_code, data
+
+
+def scrape(client):
+    # (metric, method, route, "sum" | "count") -> value of the per-route db histograms
+    status, body = client.request("GET", "/metrics")
+    samples = {}
+    if status != 200:
+        return samples
+    text = body.decode() if isinstance(body, bytes) else str(body)
+    for line in text.splitlines():
+        match = SAMPLE_RE.match(line)
+        if match:
+            metric, kind, method, route, value = match.groups()
+            samples[(metric, method, route, kind)] = float(value)
+    return samples
+
+
+def per_request(before, after, metric, method, route):
+    # None when the server does not publish the metric
+    count = after.get((metric, method, route, "count"))
+    if count is None:
+        return None
+    count -= before.get((metric, method, route, "count"), 0.0)
+    total = after[(metric, method, route, "sum")] - before.get((metric, method, route, "sum"), 0.0)
+    return total / count if count else None
+
+
+class Runner:
+    """Runs one endpoint's requests over `concurrency` clients and records its figures.
+
+    Queries and rows per request come from /metrics, which only covers the
+    whole server when it is a single process: with several uvicorn workers
+    each keeps its own histograms and a scrape reaches any one of them, so
+    `per_process_metrics=False` records those figures as None.
+    """
+
+    def __init__(self, clients, per_process_metrics: bool = True):
+        self.clients = clients
+        self.per_process_metrics = per_process_metrics
+        self.results = {}
+
+    def __call__(self, method: str, route: str, requests, expected=(200, 201)):
+        requests = list(requests)
+        responses = [None] * len(requests)
+        latencies = [None] * len(requests)
+        errors = []
+        position = iter(range(len(requests)))
+        lock = threading.Lock()
+
+        def work(client):
+            while True:
+                with lock:
+                    i = next(position, None)
+                if i is None:
+                    return
+                path, body = requests[i][:2]
+                content_type = requests[i][2] if len(requests[i]) > 2 else "application/json"
+                with Timer() as timer:
+                    try:
+                        responses[i] = client.request(method, path, body, content_type)
+                    except OSError as e:
+                        responses[i] = (type(e).__name__, None)
+                latencies[i] = timer.elapsed
+                if responses[i][0] not in expected:
+                    errors.append(responses[i][0])
+
+        before = scrape(self.clients[0]) if self.per_process_metrics else {}
+        threads = [threading.Thread(target=work, args=(client,)) for client in self.clients]
+        with Timer() as wall:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        after = scrape(self.clients[0]) if self.per_process_metrics else {}
+
+        self.results["%s %s" % (method, route)] = {
+            "requests": len(requests),
+            "errors": len(errors),
+            "throughput": len(requests) / wall.elapsed if wall.elapsed else 0.0,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000,
+            "queries_per_request": per_request(before, after, "http_request_db_statements", method, route),
+            "rows_per_request": per_request(before, after, "http_request_db_rows", method, route),
+        }
+        return [body for status, body in responses]
+
+
+def chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def workload(run, args):
+    rnd = random.Random(args.seed)
+    shape = {"max_hours": args.max_windows, "min_len": args.window_min, "max_len": args.window_max}
+    couriers = generate_couriers(args.couriers, regions=args.regions, seed=args.seed, **shape)
+    orders = generate_orders(args.orders, regions=args.regions, seed=args.seed + 1,
+                             weights=args.weights, **shape)
+    streamed = generate_orders(max(1, args.orders // 10), start_id=args.orders + 1, regions=args.regions,
+                               seed=args.seed + 2, weights=args.weights, **shape)
+    courier_ids = [courier["courier_id"] for courier in couriers]
+    sample = rnd.sample(courier_ids, min(args.requests, len(courier_ids)))
+    others = [courier_id for courier_id in courier_ids if courier_id not in set(sample)]
+
+    run("POST", "/couriers", [("/couriers", {"data": batch}) for batch in chunks(couriers, args.batch)])
+    run("POST", "/orders", [("/orders", {"data": batch}) for batch in chunks(orders, args.batch)])
+    run("POST", "/orders/stream", [
+        ("/orders/stream", "".join(json.dumps(order) + "\n" for order in batch).encode(), NDJSON)
+        for batch in chunks(streamed, args.batch)
+    ])
+    run("GET", "/couriers/{courier_id}", [("/couriers/%d" % courier_id, None) for courier_id in sample])
+
+    assigned = run("POST", "/orders/assign", [
+        ("/orders/assign", {"courier_id": courier_id}) for courier_id in sample
+    ])
+    now = datetime.now().isoformat()
+    run("POST", "/orders/complete", [
+        ("/orders/complete", {"courier_id": courier_id, "order_id": body["orders"][0]["id"], "complete_time": now})
+        for courier_id, body in zip(sample, assigned) if isinstance(body, dict) and body.get("orders")
+    ])
+    run("POST", "/orders/assign/batch", [
+        ("/orders/assign/batch", {"courier_ids": batch}) for batch in chunks(others, 50)[:max(1, args.requests // 10)]
+    ])
+    run("PATCH", "/couriers/{courier_id}", [
+        ("/couriers/%d" % courier_id, {"working_hours": ["%02d:00-%02d:00" % (hour, hour + 4)]})
+        for courier_id, hour in zip(sample, (rnd.randrange(0, 20) for _ in sample))
+    ])
+
+    pages = max(1, args.requests // 10)
+    run("GET", "/couriers", [
+        ("/couriers?after=%d&limit=100" % rnd.randrange(0, args.couriers), None) for _ in range(pages)
+    ])
+    run("GET", "/orders", [
+        ("/orders?status=%s&after=%d&limit=100" % (rnd.choice(("pending", "assigned")), rnd.randrange(0, args.orders)),
+         None)
+        for _ in range(pages)
+    ])
+    run("GET", "/metrics", [("/metrics", None) for _ in range(pages)])
+
+
+def run_inprocess(args):
+    runner = Runner([InProcessClient()])
+    workload(runner, args)
+    return runner.results
+
+
+def run_uvicorn(args):
+    with uvicorn_server(workers=args.workers) as (port, _):
+        runner = Runner([HttpClient(port) for _ in range(args.concurrency)], per_process_metrics=args.workers <= 1)
+        workload(runner, args)
+    return runner.results
+
+
+MODES = {"inprocess": run_inprocess, "uvicorn": run_uvicorn}
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(mode, results):
+    print("%-10s %-30s %8s %7s %9s %8s %8s %8s %8s" % (
+        mode, "endpoint", "requests", "errors", "req/s", "p50 ms", "p95 ms", "p99 ms", "queries"
+    ))
+    for endpoint, figures in results.items():
+        queries = figures["queries_per_request"]
+        print("%-10s %-30s %8d %7d %9.1f %8.1f %8.1f %8.1f %8s" % (
+            "", endpoint, figures["requests"], figures["errors"], figures["throughput"],
+            figures["p50_ms"], figures["p95_ms"], figures["p99_ms"], "-" if queries is None else "%.1f" % queries
+        ))
+
+
+def run(args):
+    report = {
+        "commit": git_commit(),
+        "created": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "config": {key: value for key, value in vars(args).items() if key not in ("command", "func")},
+        "modes": {},
+    }
+    for mode in args.modes:
+        start = time.time()
+        report["modes"][mode] = MODES[mode](args)
+        print_results(mode, report["modes"][mode])
+        print("%s took %.1fs" % (mode, time.time() - start))
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print("written to %s" % args.output)
+
+
+def regressions(old, new, threshold):
+    # Yields (mode, endpoint, figure, old value, new value) past the threshold
+    for mode, endpoints in new["modes"].items():
+        for endpoint, figures in endpoints.items():
+            before = old["modes"].get(mode, {}).get(endpoint)
+            if before is None:
+                continue
+            for figure, worse in (("p95_ms", 1), ("p99_ms", 1), ("throughput", -1), ("queries_per_request", 1)):
+                a, b = before.get(figure), figures.get(figure)
+                if a is None or b is None or a == 0:
+                    continue
+                if worse * (b - a) / a > threshold:
+                    yield mode, endpoint, figure, a, b
+            if figures["errors"] > before["errors"]:
+                yield mode, endpoint, "errors", before["errors"], figures["errors"]
+
+
+def compare(args):
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    if old.get("config", {}).get("couriers") != new.get("config", {}).get("couriers") \
+            or old.get("config", {}).get("orders") != new.get("config", {}).get("orders"):
+        print("warning: the runs used different data sizes")
+    print("%s -> %s" % ((old.get("commit") or "?")[:10], (new.get("commit") or "?")[:10]))
+    print("%-10s %-30s %12s %12s %12s %12s" % ("mode", "endpoint", "p95 ms", "", "queries", ""))
+    for mode, endpoints in new["modes"].items():
+        for endpoint, figures in endpoints.items():
+            before = old["modes"].get(mode, {}).get(endpoint, {})
+            print("%-10s %-30s %12s %12s %12s %12s" % (
+                mode, endpoint,
+                "%.1f" % before["p95_ms"] if before else "-", "%.1f" % figures["p95_ms"],
+                "%.1f" % before["queries_per_request"] if before.get("queries_per_request") is not None else "-",
+                "%.1f" % figures["queries_per_request"] if figures["queries_per_request"] is not None else "-"
+            ))
+    found = list(regressions(old, new, args.threshold))
+    for mode, endpoint, figure, a, b in found:
+        print("REGRESSION %s %s %s: %.2f -> %.2f" % (mode, endpoint, figure, a, b))
+    return 1 if found else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("--modes", nargs="+", default=["inprocess", "uvicorn"], choices=sorted(MODES))
+    run_parser.add_argument("--couriers", type=int, default=1000)
+    run_parser.add_argument("--orders", type=int, default=20000)
+    run_parser.add_argument("--regions", type=int, default=20)
+    run_parser.add_argument("--weights", default="uniform", choices=sorted(WEIGHT_DISTRIBUTIONS))
+    run_parser.add_argument("--max-windows", type=int, default=2, help="hour windows per courier and order")
+    run_parser.add_argument("--window-min", type=int, default=60, help="minutes")
+    run_parser.add_argument("--window-max", type=int, default=600, help="minutes")
+    run_parser.add_argument("--requests", type=int, default=200, help="requests per single-item endpoint")
+    run_parser.add_argument("--batch", type=int, default=1000, help="items per import request")
+    run_parser.add_argument("--concurrency", type=int, default=16, help="uvicorn clients")
+    run_parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.set_defaults(func=run)
+
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("old")
+    compare_parser.add_argument("new")
+    compare_parser.add_argument("--threshold", type=float, default=0.2, help="relative change flagged")
+    compare_parser.set_defaults(func=compare)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))